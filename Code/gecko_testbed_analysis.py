@@ -0,0 +1,330 @@
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from gecko_testbed_metrics import log_throttled
+from gecko_testbed_recording import ns_to_timestamps, timestamps_to_ns
+from gecko_testbed_retention import read_archive
+from gecko_testbed_sessions import SESSION_KINDS
+from gecko_testbed_storage import connect, format_timestamp
+
+ANALYSIS_DEFAULTS = {
+    "contact_force": 0.3,  # N; compression beyond this is the pad pressed on, tension beyond it the pad adhering
+    "detach_fraction": 0.3,  # Detached once tension falls below this fraction of its peak, as in force control
+    "merge_gap": 0.1,  # Seconds; contact lost and regained within this counts as one attachment
+    "min_contact": 0.1,  # Seconds; shorter compressions are noise or the ring-down after a detachment
+}
+ANALYZED_KINDS = ('test', 'automation')  # Idle sessions are decimated and hold no deliberate cycles
+METRICS = ("preload", "peak_adhesion", "adhesion_coefficient", "work_of_detachment")
+CYCLE_KEYS = ("cycle", "attach_at", "preload_at", "pull_at", "detach_at") + METRICS + ("samples",)
+
+
+def create_tables(conn):
+    # Per-cycle results plus, per session, how far the analysis got and with which thresholds
+    conn.execute('''CREATE TABLE IF NOT EXISTS adhesion_cycles
+                    (session_id INTEGER, cycle INTEGER,
+                     attach_at DATETIME, preload_at DATETIME, pull_at DATETIME, detach_at DATETIME,
+                     preload REAL, peak_adhesion REAL, adhesion_coefficient REAL, work_of_detachment REAL,
+                     samples INTEGER, PRIMARY KEY (session_id, cycle))''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS adhesion_progress
+                    (session_id INTEGER PRIMARY KEY, cycles INTEGER, resume_at DATETIME, complete INTEGER,
+                     params TEXT, analyzed_at DATETIME)''')
+    conn.commit()
+
+
+def drop_orphans(conn):
+    # Session ids are never reused, so cycles of sessions deleted without purge_session can simply be dropped
+    with conn:
+        conn.execute("DELETE FROM adhesion_cycles WHERE session_id NOT IN (SELECT id FROM sessions)")
+        conn.execute("DELETE FROM adhesion_progress WHERE session_id NOT IN (SELECT id FROM sessions)")
+
+
+def purge_session(conn, session_id):
+    # Runs in the compactor's transaction that deletes the session itself
+    conn.execute("DELETE FROM adhesion_cycles WHERE session_id = ?", (session_id,))
+    conn.execute("DELETE FROM adhesion_progress WHERE session_id = ?", (session_id,))
+
+
+def runs(mask, t_ns, merge_gap_ns=0, min_length_ns=0):
+    # (starts, ends) of every run of True; runs split by less than merge_gap_ns are joined, then short ones dropped
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+    starts, ends = edges[::2], edges[1::2]
+    if len(starts) > 1:
+        split = t_ns[starts[1:]] - t_ns[ends[:-1] - 1] >= merge_gap_ns
+        starts = starts[np.concatenate(([True], split))]
+        ends = ends[np.concatenate((split, [True]))]
+    keep = t_ns[ends - 1] - t_ns[starts] >= min_length_ns
+    return starts[keep], ends[keep]
+
+
+def detect_cycles(t_ns, fz, z, params=None):
+    # One cycle per contact: attach (compression starts), preload (peak compression), pull (the force crosses
+    # into tension) and detach (tension collapses after its peak). Work of detachment is the area under force
+    # over Z displacement from pull to detach, in mJ (N * mm). Returns the cycles and each one's first index.
+    p = dict(ANALYSIS_DEFAULTS, **(params or {}))
+    starts, ends = runs(fz > p["contact_force"], t_ns, p["merge_gap"] * 1e9, p["min_contact"] * 1e9)
+    bounds = np.append(starts[1:], len(fz))
+    cycles = []
+    for start, end, bound in zip(starts.tolist(), ends.tolist(), bounds.tolist()):
+        preload_i = start + int(np.argmax(fz[start:end]))
+        preload = float(fz[preload_i])
+        peak, pull_i, detach_i, work = 0.0, None, None, None
+        if bound > end:
+            peak_i = end + int(np.argmin(fz[end:bound]))
+            if fz[peak_i] < -p["contact_force"]:
+                peak = -float(fz[peak_i])
+                untensioned = np.flatnonzero(fz[end:peak_i] >= 0)
+                pull_i = end + int(untensioned[-1]) + 1 if len(untensioned) else end
+                released = np.flatnonzero(fz[peak_i:bound] > p["detach_fraction"] * fz[peak_i])
+                if len(released):
+                    detach_i = peak_i + int(released[0])
+                    f, zs = fz[pull_i:detach_i + 1], z[pull_i:detach_i + 1]
+                    if len(f) > 1 and np.all(np.isfinite(zs)):
+                        work = abs(float(np.sum((f[1:] + f[:-1]) * np.diff(zs)) / 2))
+        cycles.append({
+            "attach_at": int(t_ns[start]),
+            "preload_at": int(t_ns[preload_i]),
+            "pull_at": int(t_ns[pull_i]) if pull_i is not None else None,
+            "detach_at": int(t_ns[detach_i]) if detach_i is not None else None,
+            "preload": preload,
+            "peak_adhesion": peak,
+            "adhesion_coefficient": peak / preload,
+            "work_of_detachment": work,
+            "samples": bound - start,
+        })
+    return cycles, starts
+
+
+def load_trace(conn, session_id, since=None):
+    # Time (ns), Fz and Z of a session from `since` on, archived windows first, then the raw rows. Both lists are
+    # read in one snapshot, so a window the compactor moves meanwhile is seen exactly once.
+    since = since or ''
+    conn.execute("BEGIN")
+    try:
+        paths = [row[0] for row in conn.execute('''SELECT path FROM result_archives WHERE session_id = ? AND t_end >= ?
+                                                   ORDER BY t_start''', (session_id, since))]
+        rows = conn.execute('''SELECT timestamp, fz, z FROM test_results WHERE session_id = ? AND timestamp >= ?
+                               ORDER BY timestamp''', (session_id, since)).fetchall()
+    finally:
+        conn.commit()
+    since_ns = timestamps_to_ns([since])[0] if since else np.iinfo(np.int64).min
+    parts = []
+    for path in paths:
+        try:
+            archive = read_archive(path)
+        except FileNotFoundError:
+            logging.warning(f"Archive {path} of session {session_id} is gone, analysing without it")
+            continue
+        keep = archive["ts"] >= since_ns
+        z = archive["z"] if "z" in archive else np.full(len(keep), np.nan)  # Archived before Z was stored
+        parts.append((archive["ts"][keep], archive["fz"][keep], z[keep]))
+    if rows:
+        timestamps, fz, z = zip(*rows)
+        parts.append((timestamps_to_ns([str(t) for t in timestamps]), np.array(fz, dtype=np.float64),
+                      np.array(z, dtype=np.float64)))
+    if not parts:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+    t_ns, fz, z = (np.concatenate(column) for column in zip(*parts))
+    order = np.argsort(t_ns, kind='stable')
+    return t_ns[order], fz[order], z[order]
+
+
+def _timestamp(ns):
+    return ns_to_timestamps([ns])[0] if ns is not None else None
+
+
+def _quiet_from(t_ns, fz, params=None):
+    # Where a trace without a complete cycle can be resumed from: its last sample, unless a contact (or the merge
+    # gap after one) is still running at the end, which may yet become a cycle and is read again from its start
+    p = dict(ANALYSIS_DEFAULTS, **(params or {}))
+    starts, ends = runs(fz > p["contact_force"], t_ns, p["merge_gap"] * 1e9)
+    if len(starts) and t_ns[-1] - t_ns[ends[-1] - 1] < p["merge_gap"] * 1e9:
+        return int(t_ns[starts[-1]])
+    return int(t_ns[-1])
+
+
+def analyze_session(db_path, session_id, since=None, final=True, params=None):
+    # Runs in a worker process. Returns the session's cycles from `since` on and where the next run resumes:
+    # an open session's newest cycle may still be going, so it is left out and analysed again next time.
+    conn = connect(db_path)
+    try:
+        t_ns, fz, z = load_trace(conn, session_id, since)
+    finally:
+        conn.close()
+    cycles, starts = detect_cycles(t_ns, fz, z, params)
+    resume_at = since
+    if not final:
+        if cycles:
+            cycles = cycles[:-1]
+            resume_at = _timestamp(int(t_ns[starts[-1]]))
+        elif len(t_ns):
+            resume_at = _timestamp(_quiet_from(t_ns, fz, params))
+    rows = [tuple(_timestamp(cycle[key]) if key.endswith('_at') else cycle[key] for key in CYCLE_KEYS[1:])
+            for cycle in cycles]
+    return rows, resume_at
+
+
+def analyze(db_path, session_ids=None, kinds=ANALYZED_KINDS, params=None, workers=None):
+    # Brings the cache up to date and returns a summary per session. Closed sessions already analysed are skipped
+    # outright and open ones only re-read data from their newest cycle on, so re-running after new data arrives
+    # only processes the new cycles. Sessions are analysed in parallel, one per worker process.
+    params = dict(ANALYSIS_DEFAULTS, **(params or {}))
+    key = json.dumps(params, sort_keys=True)
+    conn = connect(db_path)
+    try:
+        create_tables(conn)
+        query, args = "SELECT id, status FROM sessions WHERE status != 'deleting'", []
+        if kinds is not None:
+            query += f" AND kind IN ({', '.join('?' * len(kinds))})"
+            args += list(kinds)
+        if session_ids is not None:
+            query += f" AND id IN ({', '.join('?' * len(session_ids))})"
+            args += list(session_ids)
+        sessions = conn.execute(query, args).fetchall()
+        progress = {row[0]: row[1:] for row in
+                    conn.execute("SELECT session_id, cycles, resume_at, complete, params FROM adhesion_progress")}
+        tasks = []
+        for session_id, status in sessions:
+            cycles, resume_at, complete, cached = progress.get(session_id, (0, None, 0, key))
+            if cached != key:
+                cycles, resume_at, complete = 0, None, 0  # Thresholds changed, so start over
+            if not complete:
+                tasks.append((session_id, cycles, resume_at, status != 'open'))
+        pool = ProcessPoolExecutor(workers) if len(tasks) > 1 and workers != 1 else None
+        try:
+            calls = [(db_path, session_id, resume_at, final, params) for session_id, _, resume_at, final in tasks]
+            results = pool.map(analyze_session, *zip(*calls)) if pool else (analyze_session(*call) for call in calls)
+            for (session_id, first, _, final), (rows, resume_at) in zip(tasks, results):
+                with conn:
+                    conn.execute("DELETE FROM adhesion_cycles WHERE session_id = ? AND cycle >= ?", (session_id, first))
+                    conn.executemany(f"INSERT INTO adhesion_cycles VALUES ({', '.join('?' * (len(CYCLE_KEYS) + 1))})",
+                                     [(session_id, first + i) + row for i, row in enumerate(rows)])
+                    conn.execute("INSERT OR REPLACE INTO adhesion_progress VALUES (?, ?, ?, ?, ?, ?)",
+                                 (session_id, first + len(rows), resume_at, int(final), key,
+                                  format_timestamp(time.time())))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return {session_id: summarize(conn, session_id) for session_id, _ in sessions}
+    finally:
+        conn.close()
+
+
+# Keeps a rig's cycle cache current on a background thread, so API requests only ever read the cache. Sessions
+# asked about are queued and analysed one batch at a time; analysis is incremental, so repeats are cheap.
+class AdhesionAnalyzer:
+    def __init__(self, db_path, params=None, name='default'):
+        self.db_path = db_path
+        self.params = params
+        self.name = name  # Rig label in the logs
+        self._pending = set()
+        self._running = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        conn = connect(db_path)
+        try:
+            create_tables(conn)
+            drop_orphans(conn)
+        finally:
+            conn.close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def request(self, session_id):
+        with self._lock:
+            self._pending.add(session_id)
+        self._wake.set()
+
+    def busy(self, session_id):
+        with self._lock:
+            return session_id in self._pending or session_id in self._running
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._stopped:
+                break
+            with self._lock:
+                self._running, self._pending = self._pending, set()
+            try:
+                analyze(self.db_path, sorted(self._running), kinds=None, params=self.params, workers=1)
+            except Exception as e:
+                log_throttled(f"analyzer-{self.name}", logging.ERROR, f"Error analysing {self.db_path}: {str(e)}")
+            with self._lock:
+                self._running = set()
+
+
+def progress(conn, session_id):
+    row = conn.execute("SELECT cycles, resume_at, complete, analyzed_at FROM adhesion_progress WHERE session_id = ?",
+                       (session_id,)).fetchone()
+    if row is None:
+        return {"cycles": 0, "resume_at": None, "complete": False, "analyzed_at": None}
+    return {"cycles": row[0], "resume_at": row[1], "complete": bool(row[2]), "analyzed_at": row[3]}
+
+
+def summarize(conn, session_id):
+    rows = conn.execute(f"SELECT detach_at, {', '.join(METRICS)} FROM adhesion_cycles WHERE session_id = ?",
+                        (session_id,)).fetchall()
+    values = np.array([row[1:] for row in rows], dtype=np.float64).reshape(-1, len(METRICS))
+    summary = {"session_id": session_id, "cycles": len(rows), "detached": sum(row[0] is not None for row in rows)}
+    for i, metric in enumerate(METRICS):
+        column = values[np.isfinite(values[:, i]), i]
+        summary[metric] = {"count": len(column), "mean": float(column.mean()), "std": float(column.std()),
+                           "min": float(column.min()), "max": float(column.max())} if len(column) else None
+    return summary
+
+
+def session_cycles(conn, session_id, since_cycle=-1, limit=10000):
+    rows = conn.execute(f'''SELECT {', '.join(CYCLE_KEYS)} FROM adhesion_cycles WHERE session_id = ? AND cycle > ?
+                            ORDER BY cycle LIMIT ?''', (session_id, since_cycle, limit)).fetchall()
+    return {key: [row[i] for row in rows] for i, key in enumerate(CYCLE_KEYS)}
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Per-cycle adhesion metrics for stored sessions, cached per session")
+    parser.add_argument('databases', nargs='+', help="Rig databases to analyse")
+    parser.add_argument('--session', type=int, action='append', help="Only this session (repeatable)")
+    parser.add_argument('--kind', action='append', choices=SESSION_KINDS, help="Session kinds to analyse "
+                        f"(repeatable, default {' and '.join(ANALYZED_KINDS)})")
+    parser.add_argument('--workers', type=int, help="Worker processes, default one per CPU")
+    parser.add_argument('--cycles', action='store_true', help="Also output every cycle")
+    parser.add_argument('--output', help="Write results to this JSON file instead of stdout")
+    args = parser.parse_args()
+    results = {}
+    for db_path in args.databases:
+        started = time.perf_counter()
+        conn = connect(db_path)
+        create_tables(conn)
+        drop_orphans(conn)
+        conn.close()
+        summaries = analyze(db_path, args.session, tuple(args.kind or ANALYZED_KINDS), workers=args.workers)
+        logging.info(f"Analysed {len(summaries)} sessions of {db_path} in {time.perf_counter() - started:.2f} s")
+        if args.cycles:
+            conn = connect(db_path)
+            for session_id, summary in summaries.items():
+                summary["cycles_detail"] = session_cycles(conn, session_id)
+            conn.close()
+        results[db_path] = {str(session_id): summary for session_id, summary in summaries.items()}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
@@ -1,218 +1,494 @@
-from flask import Flask, request, jsonify
-import serial
-import struct
+from flask import Blueprint, Flask, Response, current_app, g, request, jsonify
+from werkzeug.local import LocalProxy
 import time
-import sqlite3
-import RPi.GPIO as GPIO
 import logging
+import json
+import os
+import queue
 import threading
-import glob
-
-# Set up logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-
-app = Flask(__name__)
-
-# GPIO and Motor Setup
-GPIO.setmode(GPIO.BCM)
-AXES = {
-    "X": (16, 26),  # Step, Dir pins
-    "Y": (24, 25),
-    "Z": (27, 17)
-}
-for step_pin, dir_pin in AXES.values():
-    GPIO.setup(step_pin, GPIO.OUT, initial=GPIO.LOW)
-    GPIO.setup(dir_pin, GPIO.OUT, initial=GPIO.LOW)
-
-step_delay = 0.001  # Adjustable step delay
-moving = {ax: False for ax in AXES}
-STEPS_PER_MM = 200  # Placeholder, calibrate based on motor resolution
-
-# Sensor Setup
-def find_serial_port():
-    ports = glob.glob('/dev/tty[A-Za-z]*')
-    for port in ports:
-        if 'ttyUSB' in port or 'ttyACM' in port or 'ttyS0' in port:
-            logging.debug(f"Found potential serial port: {port}")
-            return port
-    logging.error("No suitable serial port found")
-    return '/dev/ttyUSB0'  # Default if none found
-
-SERIAL_PORT = find_serial_port()
-BAUDRATE = 115200
-CALIBRATION_FACTORS = {'Fx': 20.0, 'Fy': 20.0, 'Fz': 20.0}  # Placeholder, calibrate
-ser = serial.Serial(SERIAL_PORT, BAUDRATE, timeout=1)
-
-def raw_to_mv_v(raw, scale=2.0):
-    return (raw - 32768) / 32768 * scale
-
-def read_sensor():
-    try:
-        ser.write(b'\x23')
-        time.sleep(0.1)
-        ser.write(b'\x26\x01\x62\x65\x72\x6C\x69\x6E')
-        time.sleep(0.1)
-        ser.write(b'\x24')
-        while True:
-            frame = ser.read(11)
-            if len(frame) == 11 and frame[0] == 0xA5:
-                fx_raw = struct.unpack('>H', frame[1:3])[0]
-                fy_raw = struct.unpack('>H', frame[3:5])[0]
-                fz_raw = struct.unpack('>H', frame[5:7])[0]
-                fx_mv_v = raw_to_mv_v(fx_raw)
-                fy_mv_v = raw_to_mv_v(fy_raw)
-                fz_mv_v = raw_to_mv_v(fz_raw)
-                return {
-                    'Fx': fx_mv_v * CALIBRATION_FACTORS['Fx'],
-                    'Fy': fy_mv_v * CALIBRATION_FACTORS['Fy'],
-                    'Fz': fz_mv_v * CALIBRATION_FACTORS['Fz']
-                }
-            time.sleep(0.05)
-    except Exception as e:
-        logging.error(f"Error reading sensor: {str(e)}")
-        return {'Fx': 0.0, 'Fy': 0.0, 'Fz': 0.0}
-
-class GeckoTestbed:
-    def __init__(self):
-        self.db_conn = sqlite3.connect("gecko_testbed.db", check_same_thread=False)
-        self.create_db()
-        self.sensor_thread = threading.Thread(target=self._sensor_loop, daemon=True)
-        self.sensor_thread.start()
-
-    def create_db(self):
-        cursor = self.db_conn.cursor()
-        cursor.execute('''CREATE TABLE IF NOT EXISTS test_results
-                         (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                          fx REAL, fy REAL, fz REAL,
-                          timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-        self.db_conn.commit()
-
-    def _sensor_loop(self):
-        while True:
-            force_data = read_sensor()
-            self.store_result(force_data['Fx'], force_data['Fy'], force_data['Fz'])
-            time.sleep(0.05)
-
-    def store_result(self, fx, fy, fz):
-        try:
-            cursor = self.db_conn.cursor()
-            cursor.execute('''INSERT INTO test_results (fx, fy, fz)
-                             VALUES (?, ?, ?)''', (fx, fy, fz))
-            self.db_conn.commit()
-            logging.debug("Force data stored successfully")
-        except Exception as e:
-            logging.error(f"Error storing result: {str(e)}")
-
-    def get_results(self):
-        try:
-            cursor = self.db_conn.cursor()
-            cursor.execute("SELECT id, fx, fy, fz, timestamp FROM test_results")
-            results = [{"id": r[0], "fx": r[1], "fy": r[2], "fz": r[3], "timestamp": str(r[4])} for r in cursor.fetchall()]
-            logging.debug(f"Retrieved {len(results)} results: {results}")
-            return results
-        except Exception as e:
-            logging.error(f"Error fetching results: {str(e)}")
-            return []
-
-    def move_axis(self, axis, steps):
-        if axis not in AXES:
-            return False
-        step_pin, dir_pin = AXES[axis]
-        direction = steps >= 0
-        steps = abs(steps)
-        GPIO.output(dir_pin, GPIO.HIGH if direction else GPIO.LOW)
-        for _ in range(steps):
-            GPIO.output(step_pin, GPIO.HIGH)
-            time.sleep(step_delay)
-            GPIO.output(step_pin, GPIO.LOW)
-            time.sleep(step_delay)
-        return True
-
-    def cleanup(self):
-        GPIO.cleanup()
-        self.db_conn.close()
-        ser.close()
-
-testbed = GeckoTestbed()
-
-@app.route('/')
+from gecko_testbed_analysis import progress, session_cycles, summarize
+from gecko_testbed_metrics import HTTP_REQUESTS, REGISTRY
+from gecko_testbed_query import aggregate, cycle_peaks, downsample_lttb, downsample_minmax, rollups
+from gecko_testbed_rig import RESULTS_LIMIT, LazyTestbed, SensorStale, load_rig_configs
+from gecko_testbed_server import SERVER_THREADS, serve
+from gecko_testbed_storage import format_timestamp
+from gecko_testbed_wire import (CYCLE_COLUMNS, MIN_COMPRESS_BYTES, PACKED_MEDIA_TYPE, RESULT_COLUMNS, choose_encoding,
+                                compress, encode_columns, to_arrays)
+
+# Set up logging; nothing logs per sample or per request, so INFO is quiet enough to leave on
+logging.basicConfig(level=os.environ.get('GECKO_LOG_LEVEL', 'INFO').upper(), format='%(asctime)s - %(levelname)s - %(message)s')
+
+MOTION_BACKEND = os.environ.get('GECKO_MOTION_BACKEND', 'auto')  # 'auto', 'pigpio' or 'thread'
+RESULTS_MAX_LIMIT = 10000
+MAX_BUCKETS = 10000  # Upper bound for aggregate buckets and downsampled points
+STREAM_KEEPALIVE = 15.0  # Seconds between SSE comments when no samples arrive
+# Each open stream holds a server worker, so streams may only ever take part of the pool
+MAX_STREAMS = int(os.environ.get('GECKO_MAX_STREAMS', SERVER_THREADS // 2))
+
+# Process-wide routes and hooks; everything that talks to a rig lives on rig_api
+core_api = Blueprint('core_api', __name__)
+# Routes are served for the default rig at / and for every rig under /rigs/<rig_id>/
+rig_api = Blueprint('rig_api', __name__)
+testbed = LocalProxy(lambda: g.testbed)
+
+
+def get_rigs():
+    return current_app.extensions['gecko_rigs']
+
+@rig_api.url_value_preprocessor
+def select_rig(endpoint, values):
+    default = current_app.config['GECKO_DEFAULT_RIG']
+    g.rig_id = values.pop('rig_id', default) if values else default
+
+@rig_api.before_request
+def load_rig():
+    rig = get_rigs().get(g.rig_id)
+    if rig is None:
+        return jsonify({"error": f"Unknown rig {g.rig_id}"}), 404
+    g.testbed = rig.start().testbed
+    if g.testbed is None:
+        # Still probing or failed; the client can poll /health instead of hanging on the hardware
+        return jsonify({"error": f"Rig {g.rig_id} is {rig.status}", "health": rig.health()}), 503, {'Retry-After': '1'}
+
+@core_api.before_app_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@core_api.after_app_request
+def record_latency(response):
+    # Labelled by URL rule rather than path so the series stay bounded
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_REQUESTS.observe(time.perf_counter() - started, route=route, method=request.method,
+                              status=str(response.status_code))
+    return response
+
+@core_api.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@core_api.route('/health', methods=['GET'])
+def health():
+    # 200 once every rig is streaming; never blocks on hardware, so it answers while rigs are still starting
+    rigs = [rig.start().health() for rig in get_rigs().values()]
+    ready = all(rig.get("streaming") for rig in rigs)
+    return jsonify({"ready": ready, "rigs": rigs}), 200 if ready else 503
+
+@core_api.route('/')
 def index():
-    return jsonify({"status": "API running"})
+    return jsonify({"status": "API running", "default_rig": current_app.config['GECKO_DEFAULT_RIG'],
+                    "rigs": list(get_rigs())})
 
-@app.route('/force', methods=['GET'])
+@core_api.route('/rigs', methods=['GET'])
+def list_rigs():
+    return jsonify([rig.testbed.info() if rig.testbed else rig.health() for rig in get_rigs().values()])
+
+@rig_api.route('/force', methods=['GET'])
 def get_force():
     try:
-        force_data = read_sensor()
+        force_data = testbed.read_sensor()
         return jsonify(force_data)
+    except SensorStale as e:
+        return jsonify({"error": str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         logging.error(f"Error getting force: {str(e)}")
         return jsonify({"error": str(e)}), 400
 
-@app.route('/apply_push', methods=['POST'])
+def motion_queue_full():
+    # The motion thread already has a backlog of moves; turning new ones away keeps the queue short
+    return jsonify({"error": "Motion queue is full"}), 429, {'Retry-After': '1'}
+
+def force_control_response(job, result_key):
+    # Push/pull block until the control loop finishes unless the client asks for the job handle
+    if not request.json.get('wait', True):
+        return jsonify({"job": job.to_dict()}), 202
+    job.wait()
+    if job.status != 'done':
+        return jsonify({"error": job.error or f"Force control {job.status}", "job": job.to_dict()}), 409
+    return jsonify({"result": job.result.get(result_key), "job": job.to_dict()})
+
+@rig_api.route('/apply_push', methods=['POST'])
 def apply_push():
+    # Drives Z down until Fz reaches the requested preload, then holds it
     try:
         force = float(request.json.get('force', 0))
-        force_data = read_sensor()
-        return jsonify({"result": force_data['Fz']})
+        job = testbed.apply_force('push', force)
+        if job is None:
+            return jsonify({"error": "Rig has no Z axis"}), 400
+        return force_control_response(job, 'preload')
+    except queue.Full:
+        return motion_queue_full()
     except Exception as e:
         logging.error(f"Error in apply_push: {str(e)}")
         return jsonify({"error": str(e)}), 400
 
-@app.route('/apply_pull', methods=['POST'])
+@rig_api.route('/apply_pull', methods=['POST'])
 def apply_pull():
+    # Ramps from the held preload into tension, up to the requested pull force, until the pad detaches
     try:
         force = float(request.json.get('force', 0))
-        force_data = read_sensor()
-        return jsonify({"result": -force_data['Fz']})
+        job = testbed.apply_force('pull', force)
+        if job is None:
+            return jsonify({"error": "Rig has no Z axis"}), 400
+        return force_control_response(job, 'peak_adhesion')
+    except queue.Full:
+        return motion_queue_full()
     except Exception as e:
         logging.error(f"Error in apply_pull: {str(e)}")
         return jsonify({"error": str(e)}), 400
 
-@app.route('/automate', methods=['POST'])
+@rig_api.route('/automate', methods=['POST'])
 def automate():
+    # Runs are queued as jobs; poll /automate/<id> for progress and page through /automate/<id>/results
     try:
         steps = int(request.json.get('steps', 0))
         push_force = float(request.json.get('push_force', 10))
         pull_force = float(request.json.get('pull_force', 50))
-        results = []
-        for _ in range(steps):
-            force_data = read_sensor()
-            results.append({"push_result": force_data['Fz'], "pull_result": -force_data['Fz']})
-        return jsonify({"results": results})
+        job = testbed.jobs.submit(steps, push_force, pull_force)
+        if request.json.get('wait'):
+            job.wait()
+            return jsonify({"job": job.to_dict(), "results": testbed.jobs.results(job.id, limit=steps)})
+        return jsonify(job.to_dict()), 202
     except Exception as e:
         logging.error(f"Error in automate: {str(e)}")
         return jsonify({"error": str(e)}), 400
 
-@app.route('/results', methods=['GET'])
+@rig_api.route('/automate', methods=['GET'])
+def automation_jobs():
+    return jsonify(testbed.jobs.recent(request.args.get('limit', 20, type=int)))
+
+@rig_api.route('/automate/<int:job_id>', methods=['GET'])
+def automation_job(job_id):
+    job = testbed.jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown automation job"}), 404
+    return jsonify(job)
+
+@rig_api.route('/automate/<int:job_id>/results', methods=['GET'])
+def automation_results(job_id):
+    try:
+        since_cycle = request.args.get('since_cycle', -1, type=int)
+        limit = max(1, min(request.args.get('limit', RESULTS_LIMIT, type=int), RESULTS_MAX_LIMIT))
+        results = testbed.jobs.results(job_id, since_cycle, limit)
+        return bulk_response({key: [r[key] for r in results] for key in CYCLE_COLUMNS}, CYCLE_COLUMNS,
+                             legacy=lambda: {"results": results})
+    except Exception as e:
+        logging.error(f"Error in automation_results: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+
+@rig_api.route('/automate/<int:job_id>/cancel', methods=['POST'])
+def cancel_automation(job_id):
+    if not testbed.jobs.cancel(job_id):
+        return jsonify({"error": "Automation job is not running"}), 404
+    return jsonify(testbed.jobs.get(job_id))
+
+def bulk_response(data, layout, meta=None, legacy=None):
+    # Content negotiation for bulk payloads: packed little-endian columns when the client prefers them over
+    # JSON, otherwise the columnar dict, or legacy() where the endpoint has an older layout. Either is compressed
+    # if the client accepts it.
+    accept = request.accept_mimetypes
+    if accept[PACKED_MEDIA_TYPE] > accept['application/json']:
+        body, mimetype = encode_columns(to_arrays(data, layout), meta), PACKED_MEDIA_TYPE
+    else:
+        body = current_app.json.dumps(legacy() if legacy is not None else dict(data, **(meta or {}))).encode()
+        mimetype = 'application/json'
+    response = Response(body, mimetype=mimetype)
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    encoding = choose_encoding([coding for coding, quality in request.accept_encodings if quality > 0])
+    if encoding and len(body) >= MIN_COMPRESS_BYTES:
+        response.set_data(compress(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+def parse_time_arg(value):
+    # Accept either epoch seconds or a timestamp string in the stored format
+    if value is None:
+        return None
+    try:
+        return format_timestamp(float(value))
+    except ValueError:
+        return value
+
+@rig_api.route('/results', methods=['GET'])
 def get_results():
     try:
-        results = testbed.get_results()
-        if not results:
-            logging.warning("No results found in database")
-            return jsonify([])
-        return jsonify(results)
+        query = {
+            "since_id": request.args.get('since_id', type=int),
+            "before_id": request.args.get('before_id', type=int),
+            "start": parse_time_arg(request.args.get('start')),
+            "end": parse_time_arg(request.args.get('end')),
+            "session_id": request.args.get('session_id', type=int),
+            "limit": max(1, min(request.args.get('limit', RESULTS_LIMIT, type=int), RESULTS_MAX_LIMIT)),
+        }
+        rows = testbed.query_results(**query)
+        ids, fx, fy, fz, timestamps = (list(col) for col in zip(*rows)) if rows else ([], [], [], [], [])
+        data = {"id": ids, "fx": fx, "fy": fy, "fz": fz, "timestamp": [str(t) for t in timestamps]}
+        legacy = None
+        if request.args.get('format') != 'columnar':
+            legacy = lambda: [{"id": r[0], "fx": r[1], "fy": r[2], "fz": r[3], "timestamp": str(r[4])} for r in rows]
+        return bulk_response(data, RESULT_COLUMNS, {"last_id": ids[-1] if ids else query["since_id"]}, legacy)
     except Exception as e:
         logging.error(f"Error in get_results: {str(e)}")
         return jsonify({"error": str(e)}), 400
 
-@app.route('/move/<axis>', methods=['POST'])
+@rig_api.route('/results/aggregate', methods=['GET'])
+def results_aggregate():
+    try:
+        buckets = max(1, min(request.args.get('buckets', 100, type=int), MAX_BUCKETS))
+        return jsonify(aggregate(testbed.reader(), parse_time_arg(request.args.get('start')),
+                                 parse_time_arg(request.args.get('end')), buckets))
+    except Exception as e:
+        logging.error(f"Error in results_aggregate: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+
+@rig_api.route('/results/downsample', methods=['GET'])
+def results_downsample():
+    try:
+        points = max(3, min(request.args.get('points', 1000, type=int), MAX_BUCKETS))
+        method = request.args.get('method', 'minmax')
+        if method not in ('minmax', 'lttb'):
+            return jsonify({"error": "method must be 'minmax' or 'lttb'"}), 400
+        downsample = downsample_lttb if method == 'lttb' else downsample_minmax
+        return bulk_response(downsample(testbed.reader(), parse_time_arg(request.args.get('start')),
+                                        parse_time_arg(request.args.get('end')), points,
+                                        request.args.get('channel', 'fz')), RESULT_COLUMNS)
+    except Exception as e:
+        logging.error(f"Error in results_downsample: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+
+@rig_api.route('/results/rollups', methods=['GET'])
+def results_rollups():
+    try:
+        limit = max(1, min(request.args.get('limit', MAX_BUCKETS, type=int), MAX_BUCKETS))
+        return jsonify(rollups(testbed.reader(), request.args.get('session_id', type=int),
+                               parse_time_arg(request.args.get('start')), parse_time_arg(request.args.get('end')),
+                               limit))
+    except Exception as e:
+        logging.error(f"Error in results_rollups: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+
+@rig_api.route('/sessions', methods=['GET'])
+def list_sessions():
+    return jsonify(testbed.sessions.recent(request.args.get('limit', 20, type=int), request.args.get('kind')))
+
+@rig_api.route('/sessions', methods=['POST'])
+def start_session():
+    # Starting a session ends the open one; samples are stored at full rate until it is ended
+    try:
+        body = request.json or {}
+        session_id = testbed.sessions.start(body.get('kind', 'test'), body.get('name'), body.get('notes'),
+                                            bool(body.get('pinned', False)))
+        return jsonify(testbed.sessions.get(session_id)), 201
+    except Exception as e:
+        logging.error(f"Error in start_session: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+
+@rig_api.route('/sessions/current', methods=['GET'])
+def current_session():
+    return jsonify(testbed.sessions.get(testbed.sessions.current["id"]))
+
+@rig_api.route('/sessions/<int:session_id>', methods=['GET'])
+def get_session(session_id):
+    session = testbed.sessions.get(session_id, counts=True)
+    if session is None:
+        return jsonify({"error": "Unknown session"}), 404
+    return jsonify(session)
+
+@rig_api.route('/sessions/<int:session_id>/adhesion', methods=['GET'])
+def session_adhesion(session_id):
+    # Per-cycle adhesion metrics as cached so far. Each request queues the session for the rig's analyzer,
+    # which only reads what was added since its last pass; poll until "analyzing" is false for the latest cycles.
+    try:
+        session = testbed.sessions.get(session_id)
+        if session is None:
+            return jsonify({"error": "Unknown session"}), 404
+        if session["status"] == 'deleting':
+            return jsonify({"error": "Session is being deleted"}), 409
+        conn = testbed.reader()
+        state = progress(conn, session_id)
+        if not state["complete"]:
+            testbed.analyzer.request(session_id)
+        since_cycle = request.args.get('since_cycle', -1, type=int)
+        return jsonify({"summary": summarize(conn, session_id), "cycles": session_cycles(conn, session_id, since_cycle),
+                        "analysis": dict(state, analyzing=testbed.analyzer.busy(session_id))})
+    except Exception as e:
+        logging.error(f"Error in session_adhesion: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+
+@rig_api.route('/sessions/<int:session_id>/end', methods=['POST'])
+def end_session(session_id):
+    if not testbed.sessions.end(session_id):
+        return jsonify({"error": "Session is not the open test session"}), 409
+    return jsonify(testbed.sessions.get(session_id))
+
+@rig_api.route('/sessions/<int:session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    # Rows, rollups and archives are removed by the compactor, which is woken straight away
+    if not testbed.sessions.delete(session_id):
+        return jsonify({"error": "Unknown or open session"}), 409
+    testbed.compactor.trigger()
+    return jsonify(testbed.sessions.get(session_id)), 202
+
+@rig_api.route('/retention', methods=['GET'])
+def retention_stats():
+    return jsonify(testbed.compactor.stats())
+
+@rig_api.route('/retention/compact', methods=['POST'])
+def compact_now():
+    testbed.compactor.trigger()
+    return jsonify(testbed.compactor.stats()), 202
+
+@rig_api.route('/automate/<int:job_id>/peaks', methods=['GET'])
+def automation_peaks(job_id):
+    try:
+        return jsonify(cycle_peaks(testbed.reader(), job_id))
+    except Exception as e:
+        logging.error(f"Error in automation_peaks: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+
+@rig_api.route('/stream', methods=['GET'])
+def stream():
+    # Server-sent events fed straight from the sample buffer: no serial traffic or DB queries per client
+    decimate = max(1, request.args.get('decimate', 1, type=int))
+    rate = request.args.get('rate', 0.0, type=float)  # Optional cap in samples/s
+    min_interval = 1.0 / rate if rate > 0 else 0.0
+    streams = current_app.extensions['gecko_streams']
+    if not streams.acquire(blocking=False):
+        return jsonify({"error": "Too many open streams"}), 503, {'Retry-After': '5'}
+
+    buffer = testbed.buffer  # The generator runs after the request context is gone
+
+    def events():
+        seq = buffer.seq
+        last_sent = 0.0
+        last_event = time.monotonic()
+        while True:
+            samples = buffer.wait_since(seq, timeout=1.0)
+            now = time.monotonic()
+            if samples:
+                seq = samples[-1].seq
+                if decimate > 1:
+                    samples = [s for s in samples if s.seq % decimate == 0]
+                if min_interval:
+                    samples = samples[-1:] if now - last_sent >= min_interval else []
+            if samples:
+                last_sent = last_event = now
+                payload = {
+                    "seq": [s.seq for s in samples],
+                    "timestamp": [s.timestamp for s in samples],
+                    "Fx": [s.fx for s in samples],
+                    "Fy": [s.fy for s in samples],
+                    "Fz": [s.fz for s in samples],
+                }
+                yield f"data: {json.dumps(payload)}\n\n"
+            elif now - last_event >= STREAM_KEEPALIVE:
+                last_event = now
+                yield ": keepalive\n\n"
+
+    response = Response(events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(streams.release)  # Also runs when the client goes away mid-stream
+    return response
+
+@rig_api.route('/writer_stats', methods=['GET'])
+def writer_stats():
+    return jsonify(testbed.writer.stats())
+
+def motion_response(job, targets):
+    if request.json.get('wait'):
+        job.wait()
+        return jsonify({"status": "Moved to position", "position": targets, "job": job.to_dict()})
+    return jsonify({"status": "Moving to position", "position": targets, "job": job.to_dict()})
+
+@rig_api.route('/move', methods=['POST'])
+def move():
+    try:
+        targets = {axis: float(request.json[axis.lower()]) for axis in testbed.axes if axis.lower() in request.json}  # mm
+        job = testbed.move_to(targets)
+        if job is None:
+            return jsonify({"error": "No target position given"}), 400
+        return motion_response(job, targets)
+    except queue.Full:
+        return motion_queue_full()
+    except Exception as e:
+        logging.error(f"Error in move: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+
+@rig_api.route('/move/<axis>', methods=['POST'])
 def move_axis(axis):
     try:
         axis = axis.upper()
-        if axis not in AXES:
+        if axis not in testbed.axes:
             return jsonify({"error": "Invalid axis"}), 400
-        position = float(request.json.get('position', 0))  # mm
-        steps = int(position * STEPS_PER_MM)  # Convert mm to steps
-        success = testbed.move_axis(axis, steps)
-        if success:
-            return jsonify({"status": "Moved to position", "position": position})
-        return jsonify({"error": "Movement failed"}), 400
+        position = float(request.json.get('position', 0))  # Absolute, mm
+        job = testbed.move_to({axis: position})
+        if job is None:
+            return jsonify({"error": "Movement failed"}), 400
+        return motion_response(job, {axis: position})
+    except queue.Full:
+        return motion_queue_full()
     except Exception as e:
         logging.error(f"Error in move_{axis}: {str(e)}")
         return jsonify({"error": str(e)}), 400
 
+@rig_api.route('/position', methods=['GET'])
+def position():
+    return jsonify(testbed.positions())
+
+@rig_api.route('/motion/<int:job_id>', methods=['GET'])
+def motion_job(job_id):
+    job = testbed.motion.jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown motion job"}), 404
+    return jsonify(job.to_dict())
+
+@rig_api.route('/motion/<int:job_id>/cancel', methods=['POST'])
+def cancel_motion_job(job_id):
+    job = testbed.motion.jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown motion job"}), 404
+    job.cancel()
+    return jsonify(job.to_dict())
+
+
+def create_app(configs=None, start=False, motion_backend=MOTION_BACKEND, max_streams=MAX_STREAMS):
+    # Building the app touches no hardware: each rig comes up on a background thread, either straight away
+    # (start=True) or on the first request, so importing this module for tooling is side-effect free
+    configs = configs if configs is not None else load_rig_configs()
+    if len(configs) > 1 and motion_backend != 'thread':
+        # pigpio has a single wave transmitter, so rigs sharing the daemon would cancel each other's moves
+        logging.info("Several rigs configured, using threaded step generation")
+        motion_backend = 'thread'
+    # Every rig in the config gets its own serial port, acquisition thread, database and motion thread
+    rigs = {}
+    for config in configs:
+        others = {other["serial_port"] for other in configs if other is not config and other["serial_port"]}
+        rigs[config["id"]] = LazyTestbed(config, motion_backend, exclude_ports=others)
+    app = Flask(__name__)
+    app.config['GECKO_DEFAULT_RIG'] = configs[0]["id"]
+    app.extensions['gecko_rigs'] = rigs
+    app.extensions['gecko_streams'] = threading.BoundedSemaphore(max_streams)
+    app.register_blueprint(core_api)
+    app.register_blueprint(rig_api)
+    app.register_blueprint(rig_api, url_prefix='/rigs/<rig_id>', name='rigs')
+    if start:
+        for rig in rigs.values():
+            rig.start()
+    return app
+
+
+def shutdown(app):
+    for rig in app.extensions['gecko_rigs'].values():
+        rig.cleanup()
+
+
+app = create_app()
+
 if __name__ == '__main__':
+    app = create_app(start=True)
     try:
-        app.run(host='0.0.0.0', port=5000)
+        # Flask's development server starts a thread per connection; this one runs a fixed worker pool
+        serve(app, host='0.0.0.0', port=5000)
     finally:
-        testbed.cleanup()
\ No newline at end of file
+        shutdown(app)
@@ -0,0 +1,874 @@
+import os
+import sys
+import json
+import time
+import struct
+import random
+import sqlite3
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import numpy as np
+from gecko_testbed_analysis import analyze, create_tables
+from gecko_testbed_hardware import SIM_NOISE, SimulatedAmplifier, push_pull_profile
+from gecko_testbed_motion import step_times
+from gecko_testbed_query import aggregate
+from gecko_testbed_recording import ns_to_timestamps
+from gecko_testbed_retention import Compactor, init_incremental_vacuum
+from gecko_testbed_rig import GeckoTestbed, SensorStale, default_config
+from gecko_testbed_sensor import (CMD_START, FRAME_HEADER, FRAME_SIZE, SampleBuffer, SensorStream, calibration_matrix,
+                                  parse_frames, parse_frames_batch)
+from gecko_testbed_server import SERVER_THREADS, PooledWSGIServer
+from gecko_testbed_sessions import SessionStore
+from gecko_testbed_storage import ResultWriter, connect, create_results_table, format_timestamp
+from gecko_testbed_wire import ENCODINGS, PACKED_MEDIA_TYPE, decode_columns, decompress
+
+CALIBRATION = {'Fx': 20.0, 'Fy': 20.0, 'Fz': 20.0}
+SUITES = ('decode', 'sensor', 'acquisition', 'storage', 'api', 'wire', 'motion', 'control', 'rigs', 'stress',
+          'retention', 'analysis')
+# Metric name endings --compare knows how to judge; anything else is informational
+HIGHER_IS_BETTER = ('_per_s', 'speedup', 'rate_hz')
+LOWER_IS_BETTER = ('_ms', '_us', 'us_per_frame')
+
+
+def make_stream(frames, junk=0.01, seed=0):
+    # Valid frames with the occasional burst of line noise between them
+    rng = random.Random(seed)
+    out = bytearray()
+    for _ in range(frames):
+        out += bytes([FRAME_HEADER]) + struct.pack('>HHH', *(rng.randrange(65536) for _ in range(3))) + bytes(4)
+        if rng.random() < junk:
+            out += bytes(rng.randrange(256) for _ in range(rng.randrange(1, 8)))
+    return bytes(out)
+
+
+def percentiles(seconds):
+    values = np.asarray(seconds) * 1e3
+    return {
+        "count": len(values),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p90_ms": float(np.percentile(values, 90)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+def sim_config(root, rig_id, **overrides):
+    config = default_config(rig_id)
+    config.update({
+        "hardware": 'sim',
+        "sim_speed": 1.0,
+        "db_path": os.path.join(root, f"{rig_id}.db"),
+        "recording_dir": None,
+    })
+    config.update(overrides)
+    return config
+
+
+def replay_steps(gpio, axes):
+    # Replay every pin change in order: a step counts in whatever direction its dir pin was set to
+    step_pins = {step: (axis, direction) for axis, (step, direction) in axes.items()}
+    levels, replayed, overlapping = {}, {axis: 0 for axis in axes}, 0
+    for _, pin, level in list(gpio.events):
+        if pin in step_pins and level:
+            axis, direction = step_pins[pin]
+            replayed[axis] += 1 if levels.get(direction) else -1
+            overlapping += bool(levels.get(pin))  # Raised again before it was lowered
+        levels[pin] = level
+    return replayed, overlapping
+
+
+def bench_decode(frames=100000, chunk=4096, repeat=5):
+    data = make_stream(frames)
+
+    def run(parse, calibration):
+        rx = bytearray()
+        decoded = 0
+        start = time.perf_counter()
+        for offset in range(0, len(data), chunk):
+            rx += data[offset:offset + chunk]
+            forces, consumed = parse(rx, calibration)[:2]
+            del rx[:consumed]
+            decoded += len(forces)
+        return time.perf_counter() - start, decoded
+
+    results = {}
+    for name, parse, calibration in (('per_frame', parse_frames, CALIBRATION),
+                                     ('batch', parse_frames_batch, calibration_matrix(CALIBRATION))):
+        seconds, decoded = min(run(parse, calibration) for _ in range(repeat))
+        results[name] = {
+            "frames": decoded,
+            "seconds": seconds,
+            "frames_per_s": decoded / seconds,
+            "us_per_frame": seconds / decoded * 1e6,
+        }
+    results["speedup"] = results["per_frame"]["seconds"] / results["batch"]["seconds"]
+    return results
+
+
+def bench_sensor(frames=20000, chunks=(11, 64, 1024, 4096), size=64, published=1000):
+    # Correctness checks on the acquisition path rather than timings: both parsers agree on the same noisy
+    # stream whatever the read size, the sample ring hands back the right tail after wrapping, and a rig
+    # whose amplifier has stopped refuses to report its last reading as the current force
+    data = make_stream(frames, junk=0.05)
+    counts = {}
+    for chunk in chunks:
+        for name, parse, calibration in (('per_frame', parse_frames, CALIBRATION),
+                                         ('batch', parse_frames_batch, calibration_matrix(CALIBRATION))):
+            rx, gap, decoded, resyncs, dropped = bytearray(), False, 0, 0, 0
+            for offset in range(0, len(data), chunk):
+                rx += data[offset:offset + chunk]
+                if parse is parse_frames:
+                    forces, consumed, found, skipped, gap = parse(rx, calibration, gap)
+                else:
+                    forces, consumed, found, skipped, gap = parse(rx, calibration, None, gap)
+                del rx[:consumed]
+                decoded, resyncs, dropped = decoded + len(forces), resyncs + found, dropped + skipped
+            counts[f"{name}_{chunk}"] = (decoded, resyncs, dropped)
+    parsers_agree = len(set(counts.values())) == 1
+
+    buffer = SampleBuffer(size)
+    buffer.publish([(i, 0.0, 0.0, float(i)) for i in range(published)])
+    tail = [sample.seq for sample in buffer.since(0)]
+    recent = [sample.seq for sample in buffer.since(published - 10)]
+    wraps = (tail == list(range(published - size + 1, published + 1)) and recent == tail[-10:]
+             and buffer.since(published) == [] and buffer.latest().seq == published
+             and buffer.wait_next(published, timeout=0.05) is None)
+
+    with tempfile.TemporaryDirectory(prefix='gecko-bench-') as root:
+        rig = GeckoTestbed(sim_config(root, 'sensor'))
+        time.sleep(0.5)
+        fresh = rig.read_sensor() is not None
+        # A stopped simulated amplifier also stops its own clock, so age the last sample by the wall clock as a
+        # real port would
+        rig.sensor_stream.stop()
+        rig.sensor_stream.clock = time.time
+        time.sleep(0.1)
+        try:
+            rig.read_sensor()
+            refused = False
+        except SensorStale:
+            refused = True
+        rig.cleanup()
+
+    decoded, resyncs, dropped = counts[f"per_frame_{chunks[0]}"]
+    return {
+        "frames": decoded,
+        "resyncs": resyncs,
+        "dropped_bytes": dropped,
+        "parsers_agree": parsers_agree,
+        "buffer_wraps": wraps,
+        "stale_refused": fresh and refused,
+        "ok": parsers_agree and wraps and fresh and refused,
+    }
+
+
+def bench_acquisition(seconds=3.0, reads=2000, frames_per_read=8):
+    # Unpaced simulated amplifier into a SensorStream: the sample rate the acquisition thread can sustain
+    amplifier = SimulatedAmplifier(speed=0)
+    stream = SensorStream(amplifier, SampleBuffer(), CALIBRATION, clock=amplifier.clock)
+    stream.start()
+    time.sleep(0.5)
+    frames, start = stream.frames, time.perf_counter()
+    time.sleep(seconds)
+    frames, elapsed = stream.frames - frames, time.perf_counter() - start
+    stream.stop()
+
+    # One serial-sized read through feed(): what each sample costs before it reaches the buffer
+    feed_stream = SensorStream(amplifier, SampleBuffer(), CALIBRATION)
+    amplifier.write(CMD_START)
+    chunks = [amplifier.read(FRAME_SIZE * frames_per_read) for _ in range(reads)]
+    start = time.perf_counter()
+    for chunk in chunks:
+        feed_stream.feed(chunk)
+    feed_seconds = time.perf_counter() - start
+
+    # read_sensor as the API calls it, on a rig streaming at the real amplifier rate
+    with tempfile.TemporaryDirectory(prefix='gecko-bench-') as root:
+        rig = GeckoTestbed(sim_config(root, 'acquisition'))
+        time.sleep(0.5)
+        latencies = []
+        for _ in range(reads):
+            start = time.perf_counter()
+            rig.read_sensor()
+            latencies.append(time.perf_counter() - start)
+        rig.cleanup()
+        return {
+            "samples_per_s": frames / elapsed,
+            "feed_us_per_frame": feed_seconds / (reads * frames_per_read) * 1e6,
+            "read_sensor": percentiles(latencies),
+        }
+
+
+def bench_storage(rows=200000, commits=200):
+    with tempfile.TemporaryDirectory(prefix='gecko-bench-') as root:
+        db_path = os.path.join(root, 'storage.db')
+        conn = connect(db_path)
+        create_results_table(conn)
+
+        # store_result hands rows to the batching writer; throughput counts until they are committed
+        writer = ResultWriter(db_path)
+        writer.start()
+        t0 = time.time()
+        start = time.perf_counter()
+        for i in range(rows):
+            writer.submit(0.1, 0.2, 0.3, t0 + i * 0.001)
+        submit_seconds = time.perf_counter() - start
+        writer.stop()
+        elapsed = time.perf_counter() - start
+        stats = writer.stats()
+
+        # One commit per sample, i.e. the fsync the writer amortises over a batch
+        commit_seconds = {}
+        for mode in ('NORMAL', 'FULL'):
+            conn.execute(f"PRAGMA synchronous={mode}")
+            start = time.perf_counter()
+            for _ in range(commits):
+                with conn:
+                    conn.execute("INSERT INTO test_results (fx, fy, fz, timestamp) VALUES (?, ?, ?, ?)",
+                                 (0.1, 0.2, 0.3, format_timestamp(t0)))
+            commit_seconds[mode] = (time.perf_counter() - start) / commits
+        conn.close()
+        return {
+            "rows": rows,
+            "rows_per_s": rows / elapsed,
+            "submit_us": submit_seconds / rows * 1e6,
+            "avg_batch_size": stats["avg_batch_size"],
+            "avg_flush_ms": stats["avg_flush_ms"],
+            "max_flush_ms": stats["max_flush_ms"],
+            "row_commit_ms": commit_seconds['NORMAL'] * 1e3,
+            "row_commit_full_sync_ms": commit_seconds['FULL'] * 1e3,
+        }
+
+
+def fill_results(db_path, total, batch=20000, noise=0.0):
+    # Bulk-loads synthetic rows straight into a rig's table until it holds total rows. With noise (N), the
+    # values are jittered and quantised to the amplifier's resolution, so they compress like real data.
+    conn = sqlite3.connect(db_path)
+    count = conn.execute("SELECT COUNT(*) FROM test_results").fetchone()[0]
+    t0 = time.time() - total * 0.001
+    rng = np.random.default_rng(0)
+    resolution = 2.0 / 32768 * CALIBRATION['Fz']
+    while count < total:
+        n = min(batch, total - count)
+        forces = np.tile((0.1, 0.2, 0.3), (n, 1))
+        if noise:
+            forces = np.rint((forces + rng.normal(0.0, noise, forces.shape)) / resolution) * resolution
+        with conn:
+            conn.executemany("INSERT INTO test_results (fx, fy, fz, timestamp) VALUES (?, ?, ?, ?)",
+                             ((fx, fy, fz, format_timestamp(t0 + (count + i) * 0.001))
+                              for i, (fx, fy, fz) in enumerate(forces.tolist())))
+        count += n
+    conn.close()
+
+
+def bench_api(sizes=(1000, 100000, 1000000), requests=200, cycles=10):
+    with tempfile.TemporaryDirectory(prefix='gecko-bench-') as root:
+        start = time.perf_counter()
+        from gecko_testbed_api import create_app, shutdown
+        app = create_app([sim_config(root, 'api')])
+        client = app.test_client()
+        client.get('/health')  # Kicks off the rig in the background
+        startup = {"first_response_ms": (time.perf_counter() - start) * 1e3}
+        rig = app.extensions['gecko_rigs']['api']
+        testbed = rig.wait(timeout=10)
+        while not client.get('/health').get_json()["ready"] and time.perf_counter() - start < 10:
+            time.sleep(0.005)
+        startup["ready_ms"] = (time.perf_counter() - start) * 1e3
+        if testbed is None:
+            raise RuntimeError(f"Rig failed to start: {rig.error}")
+
+        def timed(method, path, count, **kwargs):
+            latencies = []
+            for _ in range(count):
+                start = time.perf_counter()
+                response = getattr(client, method)(path, **kwargs)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code >= 400:
+                    raise RuntimeError(f"{path} returned {response.status_code}: {response.get_data(as_text=True)}")
+            return percentiles(latencies)
+
+        page_requests = max(requests // 10, 5)
+        results = {"startup": startup, "force": timed('get', '/force', requests), "results": {}}
+        for size in sizes:
+            fill_results(testbed.db_path, size)
+            results["results"][str(size)] = {
+                "newest_page": timed('get', '/results', page_requests),
+                "newest_page_columnar": timed('get', '/results?format=columnar', page_requests),
+                "cursor_page": timed('get', f'/results?since_id={size // 2}&format=columnar', page_requests),
+                "aggregate": timed('get', '/results/aggregate?buckets=500', 5),
+            }
+        results["automate_submit"] = timed('post', '/automate', page_requests, json={"steps": cycles})
+        results["automate_wait"] = timed('post', '/automate', page_requests, json={"steps": cycles, "wait": True})
+        results["automate_wait"]["cycles"] = cycles
+        shutdown(app)
+        return results
+
+
+def bench_wire(limits=(1000, 10000), rows=100000, requests=20):
+    # /results as legacy JSON rows, columnar JSON and packed columns, each plain and compressed: bytes on
+    # the wire, server time per request and client time to get NumPy arrays out of the body
+    with tempfile.TemporaryDirectory(prefix='gecko-wire-') as root:
+        from gecko_testbed_api import create_app, shutdown
+        app = create_app([sim_config(root, 'wire')])
+        testbed = app.extensions['gecko_rigs']['wire'].wait(timeout=10)
+        fill_results(testbed.db_path, rows, noise=0.5)
+        client = app.test_client()
+
+        def parse_json(body):
+            data = json.loads(body)
+            if isinstance(data, list):
+                data = {key: [row[key] for row in data] for key in ('id', 'fx', 'fy', 'fz', 'timestamp')}
+            return {key: np.asarray(values) for key, values in data.items() if isinstance(values, list)}
+
+        variants = {
+            "json_rows": ('', 'application/json', parse_json),
+            "json_columnar": ('&format=columnar', 'application/json', parse_json),
+            "packed": ('', PACKED_MEDIA_TYPE, decode_columns),
+        }
+        results = {}
+        for limit in limits:
+            sizes = results[str(limit)] = {}
+            for name, (suffix, accept, parse) in variants.items():
+                for encoding in (None,) + ENCODINGS:
+                    headers = {'Accept': accept, 'Accept-Encoding': encoding or 'identity'}
+                    latencies = []
+                    for _ in range(requests):
+                        start = time.perf_counter()
+                        response = client.get(f'/results?limit={limit}{suffix}', headers=headers)
+                        latencies.append(time.perf_counter() - start)
+                    body = response.get_data()
+                    start = time.perf_counter()
+                    for _ in range(requests):
+                        parse(decompress(body, response.headers.get('Content-Encoding')))
+                    decode = (time.perf_counter() - start) / requests
+                    sizes[f"{name}_{encoding}" if encoding else name] = {
+                        "bytes": len(body),
+                        "server_p50_ms": percentiles(latencies)["p50_ms"],
+                        "client_decode_ms": decode * 1e3,
+                    }
+            baseline = sizes["json_rows"]
+            for variant in sizes.values():
+                variant["size_vs_json_rows"] = variant["bytes"] / baseline["bytes"]
+        shutdown(app)
+        return results
+
+
+def bench_motion(steps=8000):
+    # Compares every step edge on the simulated pins with the planned timing table
+    with tempfile.TemporaryDirectory(prefix='gecko-bench-') as root:
+        rig = GeckoTestbed(sim_config(root, 'motion'))
+        config = rig.config
+        step_pin = rig.axes["X"][0]
+        rig.gpio.record()
+        job = rig.move_axis("X", steps)
+        job.wait()
+        edges = np.asarray(rig.gpio.rising_edges(step_pin))
+        rig.cleanup()
+        planned = np.asarray(step_times(steps, config["max_step_rate"], config["step_accel"], config["motion_profile"]))
+        errors = np.abs((edges - edges[0]) - (planned[:len(edges)] - planned[0])) * 1e6
+        cruise = np.diff(edges[len(edges) // 3:2 * len(edges) // 3])
+        return {
+            "steps": steps,
+            "steps_issued": len(edges),
+            "steps_missed": steps - len(edges),
+            "timing_error_mean_us": float(errors.mean()),
+            "timing_error_p99_us": float(np.percentile(errors, 99)),
+            "timing_error_max_us": float(errors.max()),
+            "max_lateness_us": job.max_lateness * 1e6,
+            "cruise_rate_per_s": float(1.0 / cruise.mean()),
+            "cruise_rate_target": float(min(config["max_step_rate"], np.sqrt(config["step_accel"] * steps))),
+        }
+
+
+def bench_control(backends=('thread', 'pigpio'), preload=5.0, pull=10.0, min_rate_hz=250):
+    # Closed-loop push then pull against the simulated spring plant, once per step backend: the pigpio one
+    # plays its DMA waveforms on the simulated pins. Checks loop rate, preload accuracy and overshoot, that the
+    # pull detaches, and that the position the motion thread reports matches the steps replayed from the pins.
+    with tempfile.TemporaryDirectory(prefix='gecko-control-') as root:
+        results = {}
+        for backend in backends:
+            rig = GeckoTestbed(sim_config(root, f"control-{backend}", sim_plant=True), motion_backend=backend)
+            time.sleep(0.5)  # Force jobs abort if they start before the amplifier streams
+            rig.gpio.record()
+            push = rig.apply_force('push', preload)
+            push.wait(timeout=30)
+            pull_job = rig.apply_force('pull', pull)
+            pull_job.wait(timeout=30)
+            while rig.motion.busy():
+                time.sleep(0.05)
+            replayed, overlapping = replay_steps(rig.gpio, rig.axes)
+            reported = rig.motion.positions()
+            rig.cleanup()
+            loop = push.loop_stats()
+            overshoot = push.result.get("overshoot")
+            results[backend] = {
+                "push_status": push.status,
+                "pull_status": pull_job.status,
+                "loop_rate_hz": loop.get("rate_hz"),
+                "loop_period_p99_ms": loop.get("period_p99_ms"),
+                "loop_latency_p99_ms": loop.get("latency_p99_ms"),
+                "settle_s": push.result.get("settle_s"),
+                "preload": push.result.get("preload"),
+                "overshoot_n": overshoot,
+                "peak_adhesion": pull_job.result.get("peak_adhesion"),
+                "detached": pull_job.result.get("detached"),
+                "z_steps_reported": reported["Z"],
+                "z_steps_replayed": replayed["Z"],
+                "overlapping_pulses": overlapping,
+            }
+            results[backend]["ok"] = (push.status == pull_job.status == 'done' and loop["rate_hz"] >= min_rate_hz
+                                      and abs(push.result["preload"] - preload) <= push.params["settle_band"] * preload
+                                      and overshoot <= push.params["max_overshoot"] * preload
+                                      and pull_job.result["detached"] and reported == replayed and overlapping == 0)
+        results["ok"] = all(result["ok"] for result in results.values())
+        return results
+
+
+def bench_rigs(rigs=4, rate=1000, seconds=5.0, tolerance=0.05):
+    # Runs several simulated rigs side by side while the first one moves continuously, then checks that
+    # every rig still acquired at its amplifier's rate and never went long without samples
+    with tempfile.TemporaryDirectory(prefix='gecko-rigs-') as root:
+        testbeds = []
+        for i in range(rigs):
+            axes = {axis: (100 * i + 2 * n, 100 * i + 2 * n + 1) for n, axis in enumerate(("X", "Y", "Z"))}
+            testbeds.append(GeckoTestbed(sim_config(root, f"rig{i}", sim_rate=rate, sim_seed=i, axes=axes)))
+
+        gaps = [0.0] * rigs
+        running = True
+
+        def watch(i, buffer):
+            seq, last = buffer.seq, time.monotonic()
+            while running:
+                samples = buffer.wait_since(seq, timeout=0.5)
+                now = time.monotonic()
+                if samples:
+                    seq = samples[-1].seq
+                    gaps[i] = max(gaps[i], now - last)
+                    last = now
+
+        time.sleep(0.5)  # Let every amplifier finish its configure sequence
+        watchers = [threading.Thread(target=watch, args=(i, rig.buffer), daemon=True) for i, rig in enumerate(testbeds)]
+        for watcher in watchers:
+            watcher.start()
+        before = [rig.buffer.seq for rig in testbeds]
+        start = time.monotonic()
+        moves = 0
+        while time.monotonic() - start < seconds:
+            testbeds[0].move_axis("Z", 2000 if moves % 2 == 0 else -2000).wait()
+            moves += 1
+        elapsed = time.monotonic() - start
+        running = False
+        counts = [rig.buffer.seq - seq for rig, seq in zip(testbeds, before)]
+        for watcher in watchers:
+            watcher.join()
+        for rig in testbeds:
+            rig.cleanup()
+
+        results = {"rate": rate, "seconds": elapsed, "moves_on_rig0": moves, "rigs": {}}
+        for rig, count, gap in zip(testbeds, counts, gaps):
+            achieved = count / elapsed
+            results["rigs"][rig.id] = {
+                "samples": count,
+                "samples_per_s": achieved,
+                "max_gap_ms": gap * 1e3,
+                "ok": abs(achieved - rate) <= tolerance * rate,
+            }
+        results["ok"] = all(rig["ok"] for rig in results["rigs"].values())
+        return results
+
+
+def bench_stress(clients=200, seconds=10.0, streams=8, threads=SERVER_THREADS, rate_tolerance=0.05):
+    # Hundreds of concurrent HTTP clients against one simulated rig behind the pooled server: mixed reads,
+    # moves and SSE streams. Checks that every /force answer carried a real sample, nothing failed, acquisition
+    # kept its rate, and the step pins replay to exactly the position the motion thread reports, i.e. no two
+    # moves ever drove the pins at once. Clients share the process (and the GIL) with the server.
+    from http.client import HTTPConnection, RemoteDisconnected
+    from urllib.request import urlopen
+    from gecko_testbed_api import create_app, shutdown
+    with tempfile.TemporaryDirectory(prefix='gecko-stress-') as root:
+        app = create_app([sim_config(root, 'stress')])
+        testbed = app.extensions['gecko_rigs']['stress'].wait(timeout=10)
+        server = PooledWSGIServer('127.0.0.1', 0, app, threads=threads)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_port}"
+        time.sleep(0.5)  # Let the amplifier finish its configure sequence
+        testbed.gpio.record()
+
+        axes = list(testbed.axes)
+        mix = ([('GET', '/force')] * 10 + [('GET', '/results?limit=100&format=columnar')] * 4 +
+               [('GET', '/position')] * 3 + [('POST', '/move')] * 2 + [('GET', '/health')])
+        deadline = time.monotonic() + seconds
+        outcomes = [None] * clients
+        reuses = [0] * clients
+        stream_events = [0] * streams
+
+        def client(i):
+            # Keeps its connection open between requests like the client's requests.Session, and reconnects once
+            # if the server closed an idle one just as it was reused
+            rng = random.Random(i)
+            latencies, statuses, zero, errors = {}, {}, 0, []
+            conn = None
+            while time.monotonic() < deadline:
+                method, path = rng.choice(mix)
+                body = (json.dumps({rng.choice(axes).lower(): rng.randrange(11) / 10}).encode()
+                        if method == 'POST' else None)
+                start = time.perf_counter()
+                for attempt in range(2):
+                    reused = conn is not None
+                    try:
+                        if conn is None:
+                            conn = HTTPConnection('127.0.0.1', server.server_port, timeout=30)
+                        conn.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+                        response = conn.getresponse()
+                        status, payload = response.status, response.read()
+                        if response.will_close:
+                            conn.close()
+                            conn = None
+                        else:
+                            reuses[i] += 1
+                        break
+                    except Exception as e:
+                        conn.close()
+                        conn = None
+                        if not (reused and isinstance(e, (RemoteDisconnected, ConnectionError))):
+                            status, payload = 'error', b''
+                            errors.append(str(e))
+                            break
+                route = f"{method} {path.split('?')[0]}"
+                latencies.setdefault(route, []).append(time.perf_counter() - start)
+                statuses[f"{route} {status}"] = statuses.get(f"{route} {status}", 0) + 1
+                if path == '/force' and status == 200 and not any(json.loads(payload).values()):
+                    zero += 1  # Only an empty sample buffer gives exactly zero on every channel
+            if conn is not None:
+                conn.close()
+            outcomes[i] = (latencies, statuses, zero, errors)
+
+        def stream(i):
+            try:
+                with urlopen(f"{base}/stream?rate=50", timeout=5) as response:
+                    while time.monotonic() < deadline:
+                        if response.readline().startswith(b'data:'):
+                            stream_events[i] += 1
+            except Exception as e:
+                logging.error(f"Error reading stream {i}: {str(e)}")
+
+        before = testbed.buffer.seq
+        start = time.monotonic()
+        workers = ([threading.Thread(target=client, args=(i,), daemon=True) for i in range(clients)] +
+                   [threading.Thread(target=stream, args=(i,), daemon=True) for i in range(streams)])
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - start
+        samples = testbed.buffer.seq - before
+        while testbed.motion.busy():
+            time.sleep(0.05)
+
+        replayed, overlapping = replay_steps(testbed.gpio, testbed.axes)
+        reported = testbed.motion.positions()
+        server.shutdown()
+        server.server_close()
+        shutdown(app)
+
+        latencies, statuses, zero, errors = {}, {}, 0, []
+        for client_latencies, client_statuses, client_zero, client_errors in outcomes:
+            for route, values in client_latencies.items():
+                latencies.setdefault(route, []).extend(values)
+            for key, count in client_statuses.items():
+                statuses[key] = statuses.get(key, 0) + count
+            zero += client_zero
+            errors += client_errors
+        total = sum(statuses.values())
+        failed = sum(count for key, count in statuses.items() if not key.endswith((' 200', ' 429')))
+        rate = testbed.config.get("sim_rate", 1000)
+        results = {
+            "clients": clients,
+            "server_threads": threads,
+            "seconds": elapsed,
+            "requests": total,
+            "requests_per_s": total / elapsed,
+            "kept_alive": sum(reuses),
+            "failed_requests": failed,
+            "errors": errors[:5],
+            "statuses": statuses,
+            "zero_force_readings": zero,
+            "routes": {route: percentiles(values) for route, values in latencies.items()},
+            "stream_events": stream_events,
+            "samples_per_s": samples / elapsed,
+            "positions_reported": reported,
+            "positions_replayed": replayed,
+            "overlapping_pulses": overlapping,
+        }
+        results["ok"] = (failed == 0 and zero == 0 and reported == replayed and overlapping == 0 and all(stream_events)
+                         and abs(samples / elapsed - rate) <= rate_tolerance * rate)
+        return results
+
+
+def bench_analysis(sessions=16, minutes=10, rate=200, stiffness=20.0, tolerance=0.05):
+    # Synthetic push/pull sessions with a known answer: the pad sits on a spring of the given stiffness (N/mm)
+    # and the stage holds still when it lets go, so every cycle has the profile's preload and peak adhesion and
+    # a work of detachment of peak^2 / 2k. Half the sessions are compacted into archives first. Times a cold
+    # analysis serially and with the process pool, then the re-run after a minute more data reaches the open one.
+    with tempfile.TemporaryDirectory(prefix='gecko-analysis-') as root:
+        db_path = os.path.join(root, 'analysis.db')
+        conn = connect(db_path)
+        create_results_table(conn)
+        compactor = Compactor(db_path, {"idle_raw_days": 0, "test_raw_days": 0}, name='bench')
+        SessionStore(db_path)
+        create_tables(conn)
+        rng = np.random.default_rng(0)
+        push_force, pull_force, period = 10.0, 5.0, 4.0
+        span = minutes * 60
+        start = time.time() - 86400
+
+        def append(session_id, t0, offset, seconds):
+            t = offset + np.arange(int(seconds * rate)) / rate
+            _, _, fz = push_pull_profile(t, push_force, pull_force, period)
+            z = np.where(np.mod(t, period) / period >= 0.8, -pull_force / stiffness, fz / stiffness)
+            fz = fz + rng.normal(0.0, SIM_NOISE, len(t))
+            timestamps = ns_to_timestamps(((t0 + t) * 1e9).astype(np.int64))
+            with conn:
+                conn.executemany('''INSERT INTO test_results (fx, fy, fz, timestamp, session_id, z)
+                                    VALUES (0, 0, ?, ?, ?, ?)''',
+                                 ((f, ts, session_id, position)
+                                  for f, ts, position in zip(fz.tolist(), timestamps, z.tolist())))
+
+        ids = []
+        for i in range(sessions):
+            t0 = start + i * span
+            with conn:
+                ids.append(conn.execute('''INSERT INTO sessions (kind, name, pinned, status, started_at, ended_at)
+                                           VALUES ('test', ?, ?, ?, ?, ?)''',
+                                        (f"session {i}", int(i >= sessions // 2),
+                                         'open' if i == sessions - 1 else 'closed',
+                                         format_timestamp(t0), format_timestamp(t0 + span))).lastrowid)
+            append(ids[-1], t0, 0.0, span)
+        compactor.compact(conn)  # Pinned sessions keep their raw rows
+
+        def cold(workers):
+            with conn:
+                conn.execute("DELETE FROM adhesion_cycles")
+                conn.execute("DELETE FROM adhesion_progress")
+            started = time.perf_counter()
+            summaries = analyze(db_path, workers=workers)
+            return time.perf_counter() - started, summaries
+
+        serial_s, serial = cold(1)
+        parallel_s, summaries = cold(None)
+        started = time.perf_counter()
+        analyze(db_path)
+        unchanged_s = time.perf_counter() - started
+        open_id = ids[-1]
+        append(open_id, start + (sessions - 1) * span, span, 60)
+        started = time.perf_counter()
+        after = analyze(db_path)
+        incremental_s = time.perf_counter() - started
+        conn.close()
+
+        expected = {"preload": push_force, "peak_adhesion": pull_force, "adhesion_coefficient": pull_force / push_force,
+                    "work_of_detachment": pull_force ** 2 / (2 * stiffness)}
+        within = all(abs(summary[metric][bound] - value) <= tolerance * value
+                     for summary in after.values() for metric, value in expected.items() for bound in ('min', 'max'))
+        new_cycles = after[open_id]["cycles"] - summaries[open_id]["cycles"]
+        return {
+            "sessions": sessions,
+            "rows": sessions * span * rate,
+            "archived_rows": compactor.rows_compacted,
+            "cycles": sum(summary["cycles"] for summary in after.values()),
+            "workers": os.cpu_count(),
+            "cold_serial_ms": serial_s * 1e3,
+            "cold_parallel_ms": parallel_s * 1e3,
+            "parallel_speedup": serial_s / parallel_s,
+            "unchanged_ms": unchanged_s * 1e3,
+            "incremental_ms": incremental_s * 1e3,
+            "new_cycles": new_cycles,
+            "metrics": {metric: {"expected": value, "mean": float(np.mean([s[metric]["mean"] for s in after.values()]))}
+                        for metric, value in expected.items()},
+            "ok": (within and serial == summaries and new_cycles == 60 // period
+                   and all(summary["cycles"] == summary["detached"] == span // period
+                           for session_id, summary in summaries.items() if session_id != open_id)),
+        }
+
+
+def table_mb(conn, table):
+    # Pages held by a table and its indexes; without the dbstat table, the whole file stands in for it
+    try:
+        return conn.execute('''SELECT COALESCE(SUM(pgsize), 0) FROM dbstat
+                               WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name = ?)''',
+                            (table,)).fetchone()[0] / 1e6
+    except sqlite3.OperationalError:
+        return os.path.getsize(conn.execute("PRAGMA database_list").fetchone()[2]) / 1e6
+
+
+def bench_retention(days=60, rows_per_day=50000, test_fraction=0.3, growth_tolerance=0.1):
+    # Replays months of operation a day at a time, compacting after each, and checks that the database
+    # size and query latency level off once the oldest data starts being rolled up and archived
+    with tempfile.TemporaryDirectory(prefix='gecko-retention-') as root:
+        db_path = os.path.join(root, 'retention.db')
+        init_incremental_vacuum(db_path)
+        conn = connect(db_path)
+        create_results_table(conn)
+        compactor = Compactor(db_path, name='bench')
+        SessionStore(db_path)
+        rng = np.random.default_rng(0)
+        start = time.time() - days * 86400
+        interval = 86400 / rows_per_day
+        sizes, raw_sizes, windows, pages, aggregates = [], [], [], [], []
+        for day in range(days):
+            t0 = start + day * 86400
+            # Each day has one test session covering part of it; the rest is idle data
+            with conn:
+                session_id = conn.execute('''INSERT INTO sessions (kind, name, status, started_at, ended_at)
+                                             VALUES ('test', ?, 'closed', ?, ?)''',
+                                          (f"day {day}", format_timestamp(t0),
+                                           format_timestamp(t0 + test_fraction * 86400))).lastrowid
+                idle_id = conn.execute('''INSERT INTO sessions (kind, name, status, started_at)
+                                          VALUES ('idle', 'Idle', 'closed', ?)''',
+                                       (format_timestamp(t0 + test_fraction * 86400),)).lastrowid
+                forces = rng.normal(0.0, 1.0, (rows_per_day, 3)).tolist()
+                conn.executemany("INSERT INTO test_results (fx, fy, fz, timestamp, session_id) VALUES (?, ?, ?, ?, ?)",
+                                 ((fx, fy, fz, format_timestamp(t0 + i * interval),
+                                   session_id if i < test_fraction * rows_per_day else idle_id)
+                                  for i, (fx, fy, fz) in enumerate(forces)))
+            compactor.compact(conn, now=t0 + 86400)
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            sizes.append(os.path.getsize(db_path) / 1e6)
+            raw_sizes.append(table_mb(conn, 'test_results'))
+            windows.append(compactor.max_window_ms)
+            started = time.perf_counter()
+            conn.execute("SELECT id, fx, fy, fz, timestamp FROM test_results ORDER BY id DESC LIMIT 1000").fetchall()
+            pages.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            aggregate(conn, format_timestamp(t0), format_timestamp(t0 + 86400), 500)
+            aggregates.append(time.perf_counter() - started)
+        raw_rows = conn.execute("SELECT COUNT(*) FROM test_results").fetchone()[0]
+        rollup_rows = conn.execute("SELECT COUNT(*) FROM test_results_rollup").fetchone()[0]
+        conn.close()
+        archive_bytes = sum(os.path.getsize(os.path.join(path, name))
+                            for path, _, names in os.walk(compactor.archive_dir) for name in names)
+        # Steady state is reached once the longest retention has passed; compare the last stretch against it.
+        # Rollups and the archive index are kept for good and grow by a few percent of the raw volume a day,
+        # so the gate is on the raw rows and their indexes, which retention is meant to bound.
+        settled = min(int(compactor.params["test_raw_days"]) + 1, days - 1)
+        return {
+            "days": days,
+            "rows_per_day": rows_per_day,
+            "raw_rows": raw_rows,
+            "rollup_rows": rollup_rows,
+            "db_mb_steady": sizes[settled],
+            "db_mb_final": sizes[-1],
+            "raw_mb_steady": raw_sizes[settled],
+            "raw_mb_final": raw_sizes[-1],
+            "kept_mb_per_day": (sizes[-1] - raw_sizes[-1] - sizes[settled] + raw_sizes[settled]) / (days - 1 - settled),
+            "archive_mb": archive_bytes / 1e6,
+            "rows_compacted": compactor.rows_compacted,
+            "max_compaction_window_ms": max(windows),
+            "newest_page_final_ms": pages[-1] * 1e3,
+            "aggregate_day_final_ms": aggregates[-1] * 1e3,
+            "ok": raw_sizes[-1] <= raw_sizes[settled] * (1 + growth_tolerance),
+        }
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(results, baseline, threshold=0.1):
+    # Metrics that moved the wrong way by more than threshold, as a fraction of the baseline
+    current, previous = flatten(results), flatten(baseline)
+    regressions = []
+    for name, value in sorted(current.items()):
+        old = previous.get(name)
+        if not old:
+            continue
+        if name.endswith(HIGHER_IS_BETTER):
+            change = (old - value) / old
+        elif name.endswith(LOWER_IS_BETTER):
+            change = (value - old) / old
+        else:
+            continue
+        if change > threshold:
+            regressions.append({"metric": name, "baseline": old, "current": value, "worse_by": change})
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Gecko testbed benchmarks against simulated hardware")
+    parser.add_argument('--suite', action='append', choices=SUITES, help="Run only this suite (repeatable)")
+    parser.add_argument('--frames', type=int, default=100000)
+    parser.add_argument('--chunk', type=int, default=4096, help="Bytes handed to the parser per read")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 100000, 1000000],
+                        help="Table sizes for the /results latency runs")
+    parser.add_argument('--requests', type=int, default=200, help="Requests per API latency run")
+    parser.add_argument('--steps', type=int, default=8000, help="Length of the move_axis accuracy run")
+    parser.add_argument('--rigs', type=int, default=4, help="Simulated rigs to run side by side")
+    parser.add_argument('--rig-rate', type=int, default=1000, help="Samples/s from each simulated amplifier")
+    parser.add_argument('--rig-seconds', type=float, default=5.0)
+    parser.add_argument('--clients', type=int, default=200, help="Concurrent HTTP clients for the stress run")
+    parser.add_argument('--stress-seconds', type=float, default=10.0)
+    parser.add_argument('--days', type=int, default=60, help="Simulated days of operation for the retention run")
+    parser.add_argument('--rows-per-day', type=int, default=50000)
+    parser.add_argument('--output', help="Write results to this JSON file instead of stdout")
+    parser.add_argument('--compare', help="Baseline JSON from an earlier run; exits non-zero on regressions")
+    parser.add_argument('--threshold', type=float, default=0.1, help="Allowed slowdown as a fraction of the baseline")
+    args = parser.parse_args()
+    runners = {
+        'decode': lambda: bench_decode(args.frames, args.chunk),
+        'sensor': bench_sensor,
+        'acquisition': bench_acquisition,
+        'storage': bench_storage,
+        'api': lambda: bench_api(args.rows, args.requests),
+        'wire': bench_wire,
+        'motion': lambda: bench_motion(args.steps),
+        'control': bench_control,
+        'rigs': lambda: bench_rigs(args.rigs, args.rig_rate, args.rig_seconds),
+        'stress': lambda: bench_stress(args.clients, args.stress_seconds),
+        'retention': lambda: bench_retention(args.days, args.rows_per_day),
+        'analysis': bench_analysis,
+    }
+    results = {}
+    for suite in args.suite or SUITES:
+        results[suite] = runners[suite]()
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, {suite: baseline[suite] for suite in results if suite in baseline},
+                              args.threshold)
+    results["meta"] = {"commit": git_commit(), "python": platform.python_version(), "machine": platform.machine(),
+                       "time": format_timestamp(time.time())}
+    if args.compare:
+        results["regressions"] = regressions
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    for regression in regressions:
+        logging.warning(f"{regression['metric']}: {regression['baseline']:.4g} -> {regression['current']:.4g} "
+                        f"({regression['worse_by']:.0%} worse)")
+    if regressions or not all(results.get(suite, {}).get("ok", True)
+                              for suite in ('sensor', 'control', 'rigs', 'stress', 'retention', 'analysis')):
+        sys.exit(1)
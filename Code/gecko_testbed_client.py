@@ -0,0 +1,147 @@
+import itertools
+import json
+import logging
+from collections import namedtuple
+import requests
+from requests.adapters import HTTPAdapter
+from PyQt5.QtCore import QObject, QRunnable, QThread, QThreadPool, Qt, pyqtSignal, pyqtSlot
+from gecko_testbed_wire import PACKED_MEDIA_TYPE, decode_columns
+
+DEFAULT_TIMEOUT = 5.0  # Seconds
+STREAM_READ_TIMEOUT = 30.0  # Twice the server keepalive interval
+STREAM_RECONNECT_MS = 1000
+SHUTDOWN_WAIT_MS = 500  # Running requests get this long to finish when the client shuts down
+
+ApiResponse = namedtuple('ApiResponse', 'status_code data text')
+# Sent by bulk requests; JSON stays acceptable so older servers keep working
+BULK_HEADERS = {'Accept': f"{PACKED_MEDIA_TYPE}, application/json;q=0.5"}
+
+
+class _RequestTask(QRunnable):
+    def __init__(self, client, request_id, method, url, kwargs):
+        super().__init__()
+        self.client = client
+        self.request_id = request_id
+        self.method = method
+        self.url = url
+        self.kwargs = kwargs
+
+    def run(self):
+        try:
+            response = self.client.session.request(self.method, self.url, **self.kwargs)
+            # Decoded here so the GUI thread never parses; requests has already undone any gzip/zstd
+            if response.headers.get('Content-Type', '').startswith(PACKED_MEDIA_TYPE):
+                data = decode_columns(response.content)
+                text = ''
+            else:
+                try:
+                    data = response.json()
+                except ValueError:
+                    data = None
+                text = response.text
+            self.client._finished.emit(self.request_id, ApiResponse(response.status_code, data, text), None)
+        except Exception as e:
+            self.client._finished.emit(self.request_id, None, str(e))
+
+
+# Runs API requests on a thread pool over one keep-alive session; callbacks fire on the GUI thread
+class ApiClient(QObject):
+    _finished = pyqtSignal(int, object, object)
+
+    def __init__(self, base_url, max_workers=4, parent=None):
+        super().__init__(parent)
+        self.base_url = base_url
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_workers)
+        self._ids = itertools.count(1)
+        self._pending = {}  # Request id -> (key, on_success, on_error)
+        self._in_flight = set()  # Keys of requests that must not overlap
+        self._finished.connect(self._dispatch, Qt.QueuedConnection)
+
+    def request(self, method, path, on_success=None, on_error=None, timeout=DEFAULT_TIMEOUT, key=None, **kwargs):
+        # A keyed request is dropped while the previous one with the same key is still running
+        if key is not None:
+            if key in self._in_flight:
+                logging.debug(f"Dropping {method} {path}: previous '{key}' request still in flight")
+                return None
+            self._in_flight.add(key)
+        request_id = next(self._ids)
+        self._pending[request_id] = (key, on_success, on_error)
+        kwargs['timeout'] = timeout
+        self.pool.start(_RequestTask(self, request_id, method, f"{self.base_url}{path}", kwargs))
+        return request_id
+
+    def get(self, path, on_success=None, on_error=None, **kwargs):
+        return self.request('GET', path, on_success, on_error, **kwargs)
+
+    def post(self, path, on_success=None, on_error=None, **kwargs):
+        return self.request('POST', path, on_success, on_error, **kwargs)
+
+    def in_flight(self, key):
+        return key in self._in_flight
+
+    @pyqtSlot(int, object, object)
+    def _dispatch(self, request_id, response, error):
+        key, on_success, on_error = self._pending.pop(request_id)
+        self._in_flight.discard(key)
+        if error is not None:
+            if on_error is not None:
+                on_error(error)
+            else:
+                logging.error(f"Request failed: {error}")
+        elif on_success is not None:
+            on_success(response)
+
+    def shutdown(self):
+        # Queued requests are dropped; running ones get a moment to finish, then the session is closed under
+        # them rather than keeping the window open for a request stuck in its timeout
+        self.pool.clear()
+        self.pool.waitForDone(SHUTDOWN_WAIT_MS)
+        self.session.close()
+
+
+# Subscribes to the /stream server-sent events and emits each batch of samples as parallel arrays
+class ForceStream(QThread):
+    samples = pyqtSignal(object)
+
+    def __init__(self, base_url, rate=None, decimate=1, parent=None):
+        super().__init__(parent)
+        self.base_url = base_url
+        self.params = {"decimate": decimate}
+        if rate:
+            self.params["rate"] = rate
+        self._running = False
+        self._response = None
+
+    def run(self):
+        self._running = True
+        session = requests.Session()
+        while self._running:
+            try:
+                with session.get(f"{self.base_url}/stream", params=self.params, stream=True,
+                                 timeout=(DEFAULT_TIMEOUT, STREAM_READ_TIMEOUT)) as response:
+                    self._response = response
+                    # chunk_size=None hands over each event as soon as it arrives
+                    for line in response.iter_lines(chunk_size=None):
+                        if not self._running:
+                            break
+                        if line.startswith(b'data: '):
+                            self.samples.emit(json.loads(line[6:]))
+            except Exception as e:
+                if self._running:
+                    logging.warning(f"Force stream disconnected: {str(e)}")
+            self._response = None
+            if self._running:
+                self.msleep(STREAM_RECONNECT_MS)
+        session.close()
+
+    def stop(self):
+        self._running = False
+        response = self._response
+        if response is not None:
+            response.close()
+        self.wait(int(DEFAULT_TIMEOUT * 1000))
@@ -0,0 +1,241 @@
+import time
+import logging
+import numpy as np
+from gecko_testbed_motion import MotionJob
+
+LOOP_RATE = 500  # Hz, upper bound on control updates
+CONTROL_DEFAULTS = {
+    "gain": 150.0,  # Steps/s per N of force error
+    "max_rate": 2000,  # Steps/s
+    "approach_rate": 400,  # Steps/s while looking for contact
+    "max_force": 35.0,  # N; stays inside the amplifier's +/-40 N range so the loop never works on a clipped reading
+    "contact_force": 0.3,  # N; above this the pad is touching the substrate
+    "deadband": 0.05,  # N of error left uncorrected, so the axis does not dither
+    "settle_band": 0.05,  # Fraction of the preload the force must stay within...
+    "settle_time": 0.1,  # ...for this many seconds to count as reached
+    "hold_time": 1.0,  # Seconds held at the preload, or at the pull limit without detaching
+    "pull_rate": 5.0,  # N/s the setpoint ramps down while pulling
+    "max_overshoot": 0.2,  # Fraction of the preload; beyond it the pad is backed off and the job aborted
+    "detach_fraction": 0.3,  # Detached once tension falls below this fraction of its peak
+    "retract_steps": 200,  # Backed off after detaching or overshooting
+    "max_travel": 4000,  # Steps the axis may move in one phase before giving up
+    "stale_after": 0.05,  # Seconds without a fresh sample before the loop aborts
+}
+
+
+class ControlAbort(Exception):
+    pass
+
+
+# Closed-loop push or pull on one axis, run on the motion thread so nothing else drives the pins meanwhile.
+# Every fresh sample from the buffer updates the step rate; loop period and sample-to-step latency are recorded.
+class ForceControlJob(MotionJob):
+    closed_loop = True
+
+    def __init__(self, buffer, axis, mode, force, params=None):
+        super().__init__(deltas={axis: 0})
+        self.buffer = buffer
+        self.axis = axis
+        self.mode = mode  # 'push': approach, preload and hold; 'pull': ramp into tension until detachment
+        self.force = force
+        self.params = dict(CONTROL_DEFAULTS, **(params or {}))
+        self.phase = 'queued'
+        self.net_steps = 0
+        self.result = {}
+        self.periods = []
+        self.latencies = []
+        self.overruns = 0
+        self.stepper = None
+        self.pins = None
+
+    def progress(self):
+        return {self.axis: self.net_steps}
+
+    def loop_stats(self):
+        if not self.periods:
+            return {"iterations": 0}
+        periods = np.asarray(self.periods) * 1e3
+        latencies = np.asarray(self.latencies) * 1e3
+        return {
+            "iterations": len(periods),
+            "rate_hz": 1e3 / periods.mean(),
+            "period_p50_ms": float(np.percentile(periods, 50)),
+            "period_p99_ms": float(np.percentile(periods, 99)),
+            "period_max_ms": float(periods.max()),
+            "latency_p50_ms": float(np.percentile(latencies, 50)),
+            "latency_p99_ms": float(np.percentile(latencies, 99)),
+            "latency_max_ms": float(latencies.max()),
+            "overruns": self.overruns,
+        }
+
+    def to_dict(self):
+        data = super().to_dict()
+        data.update({
+            "mode": self.mode,
+            "force": self.force,
+            "phase": self.phase,
+            "result": self.result,
+            "loop": self.loop_stats(),
+        })
+        return data
+
+    def run(self, stepper, axes):
+        self.stepper = stepper
+        self.pins = axes[self.axis]
+        try:
+            if self.mode == 'push':
+                self._push()
+            else:
+                self._pull()
+            self.finish('cancelled' if self.cancelled else 'done')
+        except ControlAbort as e:
+            logging.warning(f"Force control job {self.id} aborted: {str(e)}")
+            self.finish('aborted', str(e))
+        finally:
+            stats = self.loop_stats()
+            if stats["iterations"]:
+                logging.info(f"Force control job {self.id}: {stats['iterations']} iterations at "
+                             f"{stats['rate_hz']:.0f} Hz, latency p99 {stats['latency_p99_ms']:.2f} ms, "
+                             f"max period {stats['period_max_ms']:.2f} ms, {self.overruns} overruns")
+
+    def _step(self, count, rate):
+        # Signed steps spread at the commanded rate; the first goes out immediately
+        if not count:
+            return
+        step_pin, dir_pin = self.pins
+        self.stepper.write(dir_pin, count > 0)
+        before = self.steps_done
+        interval = 1.0 / abs(rate)
+        self.stepper.run(self, [(i * interval, (step_pin,)) for i in range(abs(count))])
+        moved = self.steps_done - before
+        self.net_steps += moved if count > 0 else -moved
+        self.deltas[self.axis] = self.net_steps
+
+    def _regulate(self, setpoint, fz):
+        error = setpoint - fz
+        if abs(error) < self.params["deadband"]:
+            return 0.0
+        return self.params["gain"] * error
+
+    def _loop(self, control):
+        # control(fz, dt) returns a step rate, or None once its phase is over
+        p = self.params
+        period = 1.0 / LOOP_RATE
+        seq = self.buffer.seq
+        start_steps = self.net_steps
+        carry = 0.0
+        last = time.perf_counter()
+        while not self.cancelled:
+            sample = self.buffer.wait_next(seq, timeout=p["stale_after"])
+            if sample is None:
+                raise ControlAbort("Force samples stopped arriving")
+            seq = sample.seq
+            now = time.perf_counter()
+            elapsed = now - last
+            last = now
+            self.periods.append(elapsed)
+            if elapsed > 2 * period:
+                self.overruns += 1
+            rate = control(sample.fz, elapsed)
+            if rate is None:
+                return
+            rate = max(-p["max_rate"], min(p["max_rate"], rate))
+            carry += rate * min(elapsed, 2 * period)  # A late iteration must not turn into a burst of steps
+            steps = int(carry)
+            carry -= steps
+            self.latencies.append(time.time() - sample.timestamp)
+            self._step(steps, rate)
+            if abs(self.net_steps - start_steps) > p["max_travel"]:
+                raise ControlAbort(f"{self.axis} travel limit reached in {self.phase}")
+            remaining = period - (time.perf_counter() - now)
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def _push(self):
+        p = self.params
+        target = self.force
+        if target <= p["contact_force"]:
+            raise ControlAbort(f"Preload must exceed the {p['contact_force']} N contact force")
+        if target * (1 + p["max_overshoot"]) > p["max_force"]:
+            raise ControlAbort(f"Preload {target:.2f} N is too close to the {p['max_force']} N force limit")
+        limit = target * (1 + p["max_overshoot"])
+        max_force = 0.0
+        settled = 0.0
+        held = 0.0
+        forces = []
+
+        def approach(fz, dt):
+            return None if fz >= p["contact_force"] else p["approach_rate"]
+
+        def check_overshoot(fz):
+            nonlocal max_force
+            max_force = max(max_force, fz)
+            if fz > limit:
+                self._step(-p["retract_steps"], p["max_rate"])
+                raise ControlAbort(f"Force {fz:.2f} N overshot the {target:.2f} N preload")
+
+        def preload(fz, dt):
+            nonlocal settled
+            check_overshoot(fz)
+            if abs(target - fz) <= p["settle_band"] * target:
+                settled += dt
+                if settled >= p["settle_time"]:
+                    return None
+            else:
+                settled = 0.0
+            return self._regulate(target, fz)
+
+        def hold(fz, dt):
+            nonlocal held
+            held += dt
+            if held >= p["hold_time"]:
+                return None
+            check_overshoot(fz)
+            forces.append(fz)
+            return self._regulate(target, fz)
+
+        started = time.perf_counter()
+        self.phase = 'approach'
+        self._loop(approach)
+        self.phase = 'preload'
+        self._loop(preload)
+        self.result["settle_s"] = time.perf_counter() - started
+        self.phase = 'hold'
+        self._loop(hold)
+        self.result.update({
+            "preload": float(np.mean(forces)) if forces else None,
+            "max_force": max_force,
+            "overshoot": max(max_force - target, 0.0),
+        })
+
+    def _pull(self):
+        p = self.params
+        sample = self.buffer.latest()
+        if sample is None or sample.fz < p["contact_force"]:
+            raise ControlAbort("Pad is not preloaded against the substrate")
+        if self.force > p["max_force"]:
+            raise ControlAbort(f"Pull {self.force:.2f} N is beyond the {p['max_force']} N force limit")
+        setpoint = sample.fz
+        min_fz = sample.fz
+        at_limit = 0.0
+        detached = False
+
+        def pull(fz, dt):
+            nonlocal setpoint, min_fz, at_limit, detached
+            min_fz = min(min_fz, fz)
+            if min_fz < -p["contact_force"] and fz > min_fz * p["detach_fraction"]:
+                detached = True
+                return None
+            setpoint = max(setpoint - p["pull_rate"] * dt, -self.force)
+            if setpoint <= -self.force:
+                at_limit += dt
+                if at_limit >= p["hold_time"]:
+                    return None
+            return self._regulate(setpoint, fz)
+
+        self.phase = 'pull'
+        self._loop(pull)
+        self.result.update({"peak_adhesion": max(-min_fz, 0.0), "detached": detached})
+        if detached:
+            self.phase = 'retract'
+            self._step(-p["retract_steps"], p["max_rate"])
@@ -0,0 +1,273 @@
+import os
+import glob
+import json
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import serial
+from gecko_testbed_motion import SimulatedGPIO
+from gecko_testbed_sensor import (CMD_CONFIGURE, CMD_START, CMD_STOP, FRAME_DTYPE, FRAME_HEADER, FRAME_SIZE,
+                                  calibration_matrix, find_frames)
+
+HARDWARE = os.environ.get('GECKO_HARDWARE', 'pi')  # 'pi' for the real rig, 'sim' for the simulator
+SIM_RATE = 1000  # Frames/s from the simulated amplifier
+SIM_SPEED = float(os.environ.get('GECKO_SIM_SPEED', 1.0))  # Simulated seconds per real second; 0 means unpaced
+SIM_NOISE = 0.02  # N, standard deviation on every channel
+MAX_READ_FRAMES = 4096  # Largest burst an unpaced read hands back
+SERIAL_PATTERNS = ('/dev/ttyUSB*', '/dev/ttyACM*', '/dev/ttyS0')
+PORT_CACHE = os.environ.get('GECKO_PORT_CACHE', '.gecko_ports.json')  # Rig id -> port that last answered
+PROBE_TIMEOUT = 1.0  # Seconds a port gets to start streaming frames
+PROBE_FRAMES = 5  # Confirmed frames that identify the amplifier
+
+_port_lock = threading.Lock()
+
+
+def push_pull_profile(t, push_force=10.0, pull_force=5.0, period=4.0):
+    # One adhesion test per period: rest, preload ramp, hold, unload, pull to peak adhesion, detach and ring down
+    phase = np.mod(t, period) / period
+    fz = np.zeros_like(phase)
+    preload = (phase >= 0.1) & (phase < 0.3)
+    fz[preload] = push_force * (phase[preload] - 0.1) / 0.2
+    fz[(phase >= 0.3) & (phase < 0.45)] = push_force
+    unload = (phase >= 0.45) & (phase < 0.55)
+    fz[unload] = push_force * (0.55 - phase[unload]) / 0.1
+    pull = (phase >= 0.55) & (phase < 0.8)
+    fz[pull] = -pull_force * ((phase[pull] - 0.55) / 0.25) ** 1.5
+    ring = phase >= 0.8
+    since = (phase[ring] - 0.8) * period
+    fz[ring] = -0.2 * pull_force * np.exp(-since / 0.05) * np.cos(2 * np.pi * 25 * since)
+    # Gecko adhesion only holds under shear, so drag the pad along X while pulling
+    fx = np.where(pull, 0.5 * pull_force * np.minimum((phase - 0.55) / 0.05, 1.0), 0.0)
+    fy = 0.05 * fz  # Small crosstalk-like coupling
+    return fx, fy, fz
+
+
+# Pad on a linear spring: compresses as Z steps down past the contact point, sticks in tension until the
+# pull exceeds its adhesion, then snaps free until it touches again. Driven by step pulses on a SimulatedGPIO.
+class SpringContactPlant:
+    def __init__(self, gpio, step_pin, dir_pin, stiffness=20.0, steps_per_mm=200, contact_at=400,
+                 adhesion_coefficient=0.5, max_adhesion=8.0):
+        self.gpio = gpio
+        self.dir_pin = dir_pin
+        self.newtons_per_step = stiffness / steps_per_mm
+        self.contact_at = contact_at  # Steps below the start position where the pad meets the substrate
+        self.adhesion_coefficient = adhesion_coefficient  # Adhesion gained per N of preload
+        self.max_adhesion = max_adhesion
+        self.z = 0  # Steps, positive is down into the substrate
+        self.attached = False
+        self.peak_preload = 0.0
+        self.detachments = 0
+        gpio.watch(step_pin, self._on_step)
+
+    def _on_step(self, level):
+        if not level:
+            return
+        self.z += 1 if self.gpio.input(self.dir_pin) else -1
+        force = self.force()
+        if self.z >= self.contact_at and not self.attached:
+            self.attached = True
+            self.peak_preload = 0.0
+        if self.attached:
+            self.peak_preload = max(self.peak_preload, force)
+            if force < -self.adhesion():
+                self.attached = False
+                self.detachments += 1
+
+    def adhesion(self):
+        return min(self.adhesion_coefficient * self.peak_preload, self.max_adhesion)
+
+    def force(self):
+        compression = (self.z - self.contact_at) * self.newtons_per_step
+        if compression >= 0:
+            return compression
+        return compression if self.attached else 0.0
+
+    def profile(self, t):
+        fz = np.full(len(t), self.force())
+        return np.zeros_like(fz), np.zeros_like(fz), fz
+
+
+# Serial-port stand-in for the force amplifier: answers the start/stop commands and streams 0xA5 frames
+class SimulatedAmplifier:
+    def __init__(self, rate=SIM_RATE, profile=push_pull_profile, calibration=None, noise=SIM_NOISE,
+                 speed=SIM_SPEED, seed=0, junk=0.0):
+        self.rate = rate
+        self.profile = profile
+        self.inverse = np.linalg.inv(calibration_matrix(calibration or {'Fx': 20.0, 'Fy': 20.0, 'Fz': 20.0}))
+        self.noise = noise
+        self.speed = speed
+        self.junk = junk  # Chance of a burst of line noise after each read
+        self.rng = np.random.default_rng(seed)
+        self.junk_rng = random.Random(seed)
+        self.index = 0  # Frames emitted since power-up; the profile keeps running across restarts
+        self.t0 = time.time()
+        self._started = None
+        self._start_index = 0
+
+    def write(self, data):
+        if data == CMD_START:
+            self._started = time.monotonic()
+            self._start_index = self.index
+            self.t0 = time.time() - self.index / self.rate  # Line the simulated clock up with the wall clock
+        elif data == CMD_STOP:
+            self._started = None
+        return len(data)
+
+    def reset_input_buffer(self):
+        pass
+
+    def close(self):
+        self._started = None
+
+    def clock(self):
+        # Simulated wall-clock time of the newest frame, so fast replays still get realistic timestamps
+        return self.t0 + self.index / self.rate
+
+    def _due(self):
+        if self._started is None:
+            return 0
+        if self.speed <= 0:
+            return MAX_READ_FRAMES
+        elapsed = (time.monotonic() - self._started) * self.speed
+        return int(elapsed * self.rate) - (self.index - self._start_index)
+
+    @property
+    def in_waiting(self):
+        return max(self._due(), 0) * FRAME_SIZE
+
+    def read(self, size=1):
+        # Blocks like a serial read with a short timeout when no frame is due yet
+        deadline = time.monotonic() + 0.1
+        while self._due() <= 0 and time.monotonic() < deadline:
+            time.sleep(0.01 if self._started is None else 1.0 / (self.rate * self.speed))
+        count = min(self._due(), max(size // FRAME_SIZE, 1))
+        if count <= 0:
+            return b''
+        data = self.frames(self.index, count)
+        self.index += count
+        if self.junk and self.junk_rng.random() < self.junk:
+            data += bytes(self.junk_rng.randrange(256) for _ in range(self.junk_rng.randrange(1, 8)))
+        return data
+
+    def frames(self, start, count):
+        t = (start + np.arange(count)) / self.rate
+        forces = np.column_stack(self.profile(t))
+        if self.noise:
+            forces += self.rng.normal(0.0, self.noise, forces.shape)
+        raw = np.clip(np.rint(forces @ self.inverse.T / 2.0 * 32768 + 32768), 0, 65535)
+        frames = np.zeros(count, dtype=FRAME_DTYPE)
+        frames['header'] = FRAME_HEADER
+        frames['fx'], frames['fy'], frames['fz'] = raw.T
+        return frames.tobytes()
+
+
+def handshake(path, baudrate, timeout=PROBE_TIMEOUT):
+    # True only if the port answers the configure/start sequence with a stream of 0xA5 frames
+    try:
+        port = serial.Serial(path, baudrate, timeout=0.05, exclusive=True)
+    except Exception as e:
+        logging.debug(f"Cannot open {path}: {str(e)}")
+        return False
+    try:
+        port.write(CMD_STOP)
+        time.sleep(0.05)
+        port.reset_input_buffer()
+        port.write(CMD_CONFIGURE)
+        time.sleep(0.05)
+        port.write(CMD_START)
+        rx = bytearray()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            rx += port.read(max(port.in_waiting, FRAME_SIZE))
+            if len(find_frames(np.frombuffer(bytes(rx), dtype=np.uint8))) >= PROBE_FRAMES:
+                return True
+        return False
+    except Exception as e:
+        logging.debug(f"Handshake on {path} failed: {str(e)}")
+        return False
+    finally:
+        try:
+            port.write(CMD_STOP)
+            port.close()
+        except Exception:
+            pass
+
+
+def probe_serial_ports(candidates, baudrate, timeout=PROBE_TIMEOUT):
+    # Handshakes with every candidate at once, so discovery costs one timeout rather than one per port
+    candidates = list(candidates)
+    if not candidates:
+        return []
+    with ThreadPoolExecutor(max_workers=len(candidates)) as pool:
+        answered = list(pool.map(lambda path: handshake(path, baudrate, timeout), candidates))
+    return [path for path, ok in zip(candidates, answered) if ok]
+
+
+def load_port_cache(path=None):
+    try:
+        with open(path or PORT_CACHE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_port_cache(cache, path=None):
+    try:
+        with open(path or PORT_CACHE, 'w') as f:
+            json.dump(cache, f, indent=2)
+    except OSError as e:
+        logging.warning(f"Cannot write serial port cache: {str(e)}")
+
+
+def find_serial_port(rig_id, baudrate, exclude=()):
+    # Tries the port this rig used last, then probes every other candidate in parallel
+    with _port_lock:  # Rigs resolve one at a time so two never claim the same amplifier
+        cache = load_port_cache()
+        cached = cache.get(rig_id)
+        if cached and cached not in exclude and os.path.exists(cached) and handshake(cached, baudrate):
+            logging.info(f"Rig {rig_id} found its amplifier on cached port {cached}")
+            return cached
+        claimed = set(exclude) | {port for other, port in cache.items() if other != rig_id}
+        candidates = sorted({port for pattern in SERIAL_PATTERNS for port in glob.glob(pattern)})
+        # Ports cached for other rigs go last rather than being skipped, since devices can be renumbered
+        candidates = [port for port in candidates if port not in exclude and port != cached]
+        candidates.sort(key=lambda port: port in claimed)
+        found = probe_serial_ports(candidates, baudrate)
+        if not found:
+            logging.error(f"No amplifier answered on {', '.join(candidates) or 'any serial port'}")
+            return None
+        port = found[0]
+        cache = {other: path for other, path in cache.items() if path != port}
+        cache[rig_id] = port
+        save_port_cache(cache)
+        logging.info(f"Rig {rig_id} found its amplifier on {port}")
+        return port
+
+
+def open_gpio(config):
+    if config.get("hardware", HARDWARE) == 'sim':
+        return SimulatedGPIO()
+    # Only the real rig needs RPi.GPIO, so importing this module works anywhere
+    import RPi.GPIO as GPIO
+    GPIO.setmode(GPIO.BCM)
+    return GPIO
+
+
+def open_amplifier(config, gpio=None):
+    if config.get("hardware", HARDWARE) == 'sim':
+        logging.info(f"Rig {config['id']} using the simulated amplifier")
+        profile = push_pull_profile
+        plant = config.get("sim_plant")
+        if plant and isinstance(gpio, SimulatedGPIO):
+            # Close the loop: the simulated force follows the Z axis instead of a fixed profile
+            step_pin, dir_pin = config["axes"]["Z"]
+            profile = SpringContactPlant(gpio, step_pin, dir_pin, steps_per_mm=config["steps_per_mm"],
+                                         **(plant if isinstance(plant, dict) else {})).profile
+        return SimulatedAmplifier(rate=config.get("sim_rate", SIM_RATE), profile=profile,
+                                  calibration=config["calibration"], speed=config.get("sim_speed", SIM_SPEED),
+                                  seed=config.get("sim_seed", 0))
+    # Exclusive, so a probe from another rig can never talk to an amplifier that is already streaming
+    return serial.Serial(config["serial_port"], config["baudrate"], timeout=1, exclusive=True)
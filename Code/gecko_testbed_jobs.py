@@ -0,0 +1,210 @@
+import time
+import queue
+import logging
+import threading
+from gecko_testbed_storage import connect, format_timestamp
+
+FLUSH_CYCLES = 50  # Persist partial results at least this often...
+FLUSH_INTERVAL = 0.5  # ...or after this many seconds
+
+
+class AutomationJob:
+    def __init__(self, job_id, steps, push_force, pull_force):
+        self.id = job_id
+        self.steps = steps
+        self.push_force = push_force
+        self.pull_force = pull_force
+        self.status = 'queued'
+        self.cycles_done = 0
+        self.last_result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancelled = False
+        self.state = {}  # Scratch space for the cycle function
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "steps": self.steps,
+            "push_force": self.push_force,
+            "pull_force": self.pull_force,
+            "cycles_done": self.cycles_done,
+            "progress": self.cycles_done / self.steps if self.steps else 1.0,
+            "last_result": self.last_result,
+            "error": self.error,
+            # Same timestamp strings as the persisted rows
+            "created_at": format_timestamp(self.created_at),
+            "started_at": format_timestamp(self.started_at) if self.started_at else None,
+            "finished_at": format_timestamp(self.finished_at) if self.finished_at else None,
+        }
+
+
+# Runs automation jobs one at a time off the request threads, persisting each cycle as it completes
+class JobScheduler:
+    def __init__(self, db_path, run_cycle, on_status=None):
+        self.db_path = db_path
+        self.run_cycle = run_cycle  # run_cycle(job) -> (push_result, pull_result)
+        self.on_status = on_status  # Called with the job when it starts running and when it finishes
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self.create_tables()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def create_tables(self):
+        conn = connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''CREATE TABLE IF NOT EXISTS automation_jobs
+                         (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                          status TEXT, steps INTEGER, push_force REAL, pull_force REAL,
+                          cycles_done INTEGER DEFAULT 0, error TEXT,
+                          created_at DATETIME, started_at DATETIME, finished_at DATETIME)''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS automation_results
+                         (job_id INTEGER, cycle INTEGER,
+                          push_result REAL, pull_result REAL,
+                          started_at DATETIME, finished_at DATETIME,
+                          PRIMARY KEY (job_id, cycle))''')
+        # Jobs cut off by a restart will never finish
+        cursor.execute("UPDATE automation_jobs SET status = 'interrupted' WHERE status IN ('queued', 'running')")
+        conn.commit()
+        conn.close()
+
+    def reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = connect(self.db_path)
+        return conn
+
+    def submit(self, steps, push_force, pull_force):
+        conn = self.reader()
+        with conn:
+            cursor = conn.execute('''INSERT INTO automation_jobs (status, steps, push_force, pull_force, created_at)
+                                     VALUES ('queued', ?, ?, ?, ?)''',
+                                  (steps, push_force, pull_force, format_timestamp(time.time())))
+        job = AutomationJob(cursor.lastrowid, steps, push_force, pull_force)
+        with self._lock:
+            self.jobs[job.id] = job
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        row = self.reader().execute('''SELECT id, status, steps, push_force, pull_force, cycles_done, error,
+                                              created_at, started_at, finished_at
+                                       FROM automation_jobs WHERE id = ?''', (job_id,)).fetchone()
+        if row is None:
+            return None
+        keys = ("id", "status", "steps", "push_force", "pull_force", "cycles_done", "error",
+                "created_at", "started_at", "finished_at")
+        job = dict(zip(keys, row))
+        job["progress"] = job["cycles_done"] / job["steps"] if job["steps"] else 1.0
+        return job
+
+    def busy(self):
+        with self._lock:
+            return bool(self.jobs)
+
+    def recent(self, limit=20):
+        rows = self.reader().execute("SELECT id FROM automation_jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [self.get(row[0]) for row in rows]
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return False
+        job.cancelled = True
+        return True
+
+    def results(self, job_id, since_cycle=-1, limit=1000):
+        rows = self.reader().execute('''SELECT cycle, push_result, pull_result, started_at, finished_at
+                                        FROM automation_results WHERE job_id = ? AND cycle > ?
+                                        ORDER BY cycle LIMIT ?''', (job_id, since_cycle, limit)).fetchall()
+        return [{"cycle": r[0], "push_result": r[1], "pull_result": r[2], "started_at": r[3], "finished_at": r[4]}
+                for r in rows]
+
+    def stop(self):
+        with self._lock:
+            for job in self.jobs.values():
+                job.cancelled = True
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        conn = connect(self.db_path)
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            try:
+                self._execute(conn, job)
+            except Exception as e:
+                logging.error(f"Error in automation job {job.id}: {str(e)}")
+                job.error = str(e)
+                self._finish(conn, job, 'failed')
+            with self._lock:
+                self.jobs.pop(job.id, None)
+        conn.close()
+
+    def _execute(self, conn, job):
+        if job.cancelled:
+            self._finish(conn, job, 'cancelled')
+            return
+        job.status = 'running'
+        job.started_at = time.time()
+        with conn:
+            conn.execute("UPDATE automation_jobs SET status = 'running', started_at = ? WHERE id = ?",
+                         (format_timestamp(job.started_at), job.id))
+        if self.on_status is not None:
+            self.on_status(job)
+        pending = []
+        last_flush = time.monotonic()
+        for cycle in range(job.steps):
+            if job.cancelled:
+                break
+            started = time.time()
+            try:
+                push_result, pull_result = self.run_cycle(job)
+            except Exception:
+                self._flush(conn, job, pending, job.cycles_done + len(pending))  # Keep the cycles that did complete
+                raise
+            pending.append((job.id, cycle, push_result, pull_result,
+                            format_timestamp(started), format_timestamp(time.time())))
+            job.last_result = {"cycle": cycle, "push_result": push_result, "pull_result": pull_result}
+            if len(pending) >= FLUSH_CYCLES or time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                self._flush(conn, job, pending, cycle + 1)
+                pending = []
+                last_flush = time.monotonic()
+        self._flush(conn, job, pending, job.cycles_done + len(pending))
+        self._finish(conn, job, 'cancelled' if job.cancelled else 'done')
+
+    def _flush(self, conn, job, pending, cycles_done):
+        with conn:
+            conn.executemany('''INSERT INTO automation_results
+                                (job_id, cycle, push_result, pull_result, started_at, finished_at)
+                                VALUES (?, ?, ?, ?, ?, ?)''', pending)
+            conn.execute("UPDATE automation_jobs SET cycles_done = ? WHERE id = ?", (cycles_done, job.id))
+        # Progress only advances once the cycles are on disk
+        job.cycles_done = cycles_done
+
+    def _finish(self, conn, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        with conn:
+            conn.execute("UPDATE automation_jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                         (status, job.error, format_timestamp(job.finished_at), job.id))
+        if self.on_status is not None and job.started_at is not None:
+            self.on_status(job)
+        job._done.set()
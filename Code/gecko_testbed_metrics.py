@@ -0,0 +1,187 @@
+import time
+import bisect
+import logging
+import threading
+
+# Latency buckets in seconds, from sub-millisecond hot paths up to slow queries
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+LOG_INTERVAL = 10.0  # Seconds between repeats of the same throttled log message
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.label_names), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, _format_labels(self.label_names, key), value) for key, value in items]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # Label values -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        out = []
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                out.append((f"{self.name}_bucket",
+                            _format_labels(self.label_names, key, [('le', _format_value(float(bound)))]), cumulative))
+            out.append((f"{self.name}_sum", _format_labels(self.label_names, key), counts[-1]))
+            out.append((f"{self.name}_count", _format_labels(self.label_names, key), cumulative))
+        return out
+
+
+# Holds every metric plus callbacks that read existing counters at scrape time, and renders the
+# Prometheus text format. Hot paths only ever touch a dict under a lock.
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def register_collector(self, collect):
+        # collect() updates gauges/counters from state other objects already keep
+        with self._lock:
+            self.collectors.append(collect)
+
+    def unregister_collector(self, collect):
+        with self._lock:
+            if collect in self.collectors:
+                self.collectors.remove(collect)
+
+    def render(self):
+        with self._lock:
+            collectors = list(self.collectors)
+            metrics = list(self.metrics.values())
+        for collect in collectors:
+            try:
+                collect()
+            except Exception as e:
+                log_throttled('metrics-collector', logging.ERROR, f"Error collecting metrics: {str(e)}")
+        lines = []
+        for metric in sorted(metrics, key=lambda m: m.name):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# Acquisition
+SENSOR_FRAMES = REGISTRY.counter('gecko_sensor_frames_total', "Frames decoded from the amplifier", ('rig',))
+SENSOR_RESYNCS = REGISTRY.counter('gecko_sensor_resyncs_total', "Times the frame parser lost sync", ('rig',))
+SENSOR_DROPPED = REGISTRY.counter('gecko_sensor_dropped_bytes_total', "Bytes skipped while resyncing", ('rig',))
+SENSOR_STALLS = REGISTRY.counter('gecko_sensor_stalls_total', "Amplifier reconfigurations after a stall", ('rig',))
+SERIAL_READ = REGISTRY.histogram('gecko_serial_read_seconds', "Time spent in each serial read", ('rig',))
+# Storage
+WRITER_QUEUE = REGISTRY.gauge('gecko_writer_queue_depth', "Rows waiting for the result writer", ('rig',))
+WRITER_ROWS = REGISTRY.counter('gecko_writer_rows_total', "Rows committed by the result writer", ('rig',))
+WRITER_ERRORS = REGISTRY.counter('gecko_writer_errors_total', "Result batches that failed to commit", ('rig',))
+WRITER_COMMIT = REGISTRY.histogram('gecko_writer_commit_seconds', "Result writer batch commit time", ('rig',))
+DB_SIZE = REGISTRY.gauge('gecko_db_size_bytes', "Size of the rig's database including its WAL", ('rig',))
+COMPACTED_ROWS = REGISTRY.counter('gecko_compacted_rows_total', "Raw rows rolled up and archived", ('rig',))
+COMPACTION_WINDOW = REGISTRY.histogram('gecko_compaction_window_seconds', "Write lock held per compacted window",
+                                       ('rig',))
+# Motion
+STEPS_ISSUED = REGISTRY.counter('gecko_stepper_steps_total', "Step pulses issued", ('rig',))
+STEPS_LATE = REGISTRY.counter('gecko_stepper_steps_late_total', "Step pulses issued later than the lateness budget",
+                              ('rig',))
+STEPS_MISSED = REGISTRY.counter('gecko_stepper_steps_missed_total', "Planned steps never issued by failed moves",
+                                ('rig',))
+# HTTP
+HTTP_REQUESTS = REGISTRY.histogram('gecko_http_request_seconds', "HTTP request latency by route",
+                                   ('route', 'method', 'status'))
+RESULTS_ROWS = REGISTRY.counter('gecko_results_rows_total', "Rows returned by result queries", ('rig',))
+
+
+_throttle = {}
+_throttle_lock = threading.Lock()
+
+
+def log_throttled(key, level, message, interval=LOG_INTERVAL):
+    # Logs the first occurrence, then at most once per interval with a count of what was suppressed
+    now = time.monotonic()
+    with _throttle_lock:
+        last, suppressed = _throttle.get(key, (None, 0))
+        if last is not None and now - last < interval:
+            _throttle[key] = (last, suppressed + 1)
+            return
+        _throttle[key] = (now, 0)
+    if suppressed:
+        message = f"{message} ({suppressed} similar messages suppressed)"
+    logging.log(level, message)
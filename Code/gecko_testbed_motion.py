@@ -0,0 +1,514 @@
+import math
+import bisect
+import time
+import logging
+import threading
+import itertools
+import queue
+import collections
+from gecko_testbed_metrics import STEPS_ISSUED, STEPS_LATE, STEPS_MISSED
+
+PULSE_WIDTH = 10e-6  # Seconds the step pin is held high
+PIGPIO_CHUNK = 2000  # Steps per DMA waveform, well under pigpio's pulse limit
+BUSY_WAIT = 0.002  # Spin instead of sleeping when a step is this close
+LATE_STEP = 100e-6  # Seconds past its planned time before a step counts as late
+MAX_QUEUED_JOBS = 32  # Moves waiting behind the running one before new requests are turned away
+
+
+# Acceleration ramps as (velocity fraction r(u), distance fraction R(u)) over normalised ramp time u in [0, 1]
+def _trapezoid_ramp(u):
+    return u, u * u / 2
+
+
+def _s_curve_ramp(u):
+    return (1 - math.cos(math.pi * u)) / 2, u / 2 - math.sin(math.pi * u) / (2 * math.pi)
+
+
+PROFILES = {'trapezoid': _trapezoid_ramp, 's_curve': _s_curve_ramp}
+
+
+def step_times(steps, max_rate, accel, profile='trapezoid'):
+    # Time of each step (seconds from the start of the move) for a symmetric accelerate/cruise/decelerate move
+    if steps <= 0:
+        return []
+    ramp = PROFILES[profile]
+    rate = min(max_rate, math.sqrt(accel * steps))  # Short moves never reach full speed
+    ramp_time = rate / accel
+    ramp_steps = rate * ramp_time / 2
+    total = 2 * ramp_time + (steps - 2 * ramp_steps) / rate
+
+    def time_to_reach(position):
+        # Invert the ramp's distance curve with Newton's method, bracketed so it cannot escape [0, 1]
+        target = position / (rate * ramp_time)
+        u = math.sqrt(2 * target)
+        low, high = 0.0, 1.0
+        for _ in range(20):
+            r, distance = ramp(u)
+            error = distance - target
+            if abs(error) < 1e-12:
+                break
+            if error > 0:
+                high = u
+            else:
+                low = u
+            u = u - error / r if r > 0 else (low + high) / 2
+            if not low <= u <= high:
+                u = (low + high) / 2
+        return u * ramp_time
+
+    times = []
+    for k in range(1, steps + 1):
+        if k <= ramp_steps:
+            times.append(time_to_reach(k))
+        elif k <= steps - ramp_steps:
+            times.append(ramp_time + (k - ramp_steps) / rate)
+        else:
+            times.append(total - time_to_reach(steps - k))
+    return times
+
+
+# Stand-in for RPi.GPIO. Once record() is called it logs every level change with a perf_counter timestamp;
+# a sim rig left running for hours is not asked to, so its log never grows.
+class SimulatedGPIO:
+    BCM = 'BCM'
+    OUT = 'OUT'
+    IN = 'IN'
+    HIGH = 1
+    LOW = 0
+
+    def __init__(self):
+        self.levels = {}
+        self.events = []
+        self.recording = False
+        self.watchers = {}  # Pin -> callbacks run on every level change, e.g. a simulated plant counting steps
+        self._lock = threading.Lock()
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, mode, initial=0):
+        self.levels[pin] = initial
+
+    def output(self, pin, level):
+        with self._lock:
+            self.levels[pin] = level
+            if self.recording:
+                self.events.append((time.perf_counter(), pin, level))
+        for callback in self.watchers.get(pin, ()):
+            callback(level)
+
+    def watch(self, pin, callback):
+        self.watchers.setdefault(pin, []).append(callback)
+
+    def input(self, pin):
+        return self.levels.get(pin, 0)
+
+    def cleanup(self, pins=None):
+        if pins is None:
+            self.levels.clear()
+        for pin in pins or ():
+            self.levels.pop(pin, None)
+
+    def rising_edges(self, pin):
+        with self._lock:
+            return [t for t, p, level in self.events if p == pin and level]
+
+    def record(self):
+        # Starts a fresh log of level changes
+        with self._lock:
+            self.events.clear()
+            self.recording = True
+
+
+# Stand-in for a pigpio connection on top of a SimulatedGPIO: plays waveforms on its own thread with their
+# pulse timing, so the DMA backend's chunking and step accounting can run against the simulated plant
+class SimulatedPigpio:
+    WAVE_MODE_ONE_SHOT_SYNC = 3
+    NO_TX_WAVE = 9999
+    pulse = collections.namedtuple('pulse', 'gpio_on gpio_off delay')
+
+    def __init__(self, gpio):
+        self.gpio = gpio
+        self.connected = True
+        self.waves = {}
+        self._building = []
+        self._ids = itertools.count()
+        self._pending = collections.deque()
+        self._current = None
+        self._stops = 0  # Bumped by wave_tx_stop so the player abandons the wave it is on
+        self._stopped_at = None
+        self._at = None  # Where on the timeline the next wave starts
+        self._cond = threading.Condition()
+        threading.Thread(target=self._play, daemon=True).start()
+
+    def write(self, pin, level):
+        self.gpio.output(pin, self.gpio.HIGH if level else self.gpio.LOW)
+
+    def wave_clear(self):
+        with self._cond:
+            self.waves.clear()
+            self._building = []
+
+    def wave_add_generic(self, pulses):
+        self._building.extend(pulses)
+        return len(self._building)
+
+    def wave_create(self):
+        wave = next(self._ids)
+        self.waves[wave] = [([pin for pin in range(64) if p.gpio_on >> pin & 1],
+                             [pin for pin in range(64) if p.gpio_off >> pin & 1], p.delay * 1e-6)
+                            for p in self._building]
+        self._building = []
+        return wave
+
+    def wave_delete(self, wave):
+        self.waves.pop(wave, None)
+
+    def wave_send_using_mode(self, wave, mode):
+        # Sync mode: the wave starts when the one playing ends, or straight away when nothing is
+        with self._cond:
+            if self._current is None and not self._pending:
+                self._at = time.perf_counter()
+            self._pending.append((wave, self.waves[wave]))
+            self._cond.notify()
+
+    def wave_tx_at(self):
+        current = self._current
+        return self.NO_TX_WAVE if current is None else current
+
+    def wave_tx_busy(self):
+        with self._cond:
+            return self._current is not None or bool(self._pending)
+
+    def wave_tx_stop(self):
+        with self._cond:
+            self._pending.clear()
+            self._current = None
+            self._stops += 1
+            self._stopped_at = time.perf_counter()
+
+    def _play(self):
+        # Pulses keep their place on the timeline from the first send, as DMA would; a pulse this thread gets to
+        # late still goes out if it was due before a stop, so the simulated pins never lag the schedule
+        gpio = self.gpio
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._current = None
+                    self._cond.wait()
+                wave, pulses = self._pending.popleft()
+                self._current = wave
+                stops = self._stops
+                at = self._at
+            for on, off, delay in pulses:
+                if self._stops != stops and at >= self._stopped_at:
+                    break
+                for pin in on:
+                    gpio.output(pin, gpio.HIGH)
+                for pin in off:
+                    gpio.output(pin, gpio.LOW)
+                at += delay
+                remaining = at - time.perf_counter()
+                if remaining > BUSY_WAIT:
+                    time.sleep(remaining - BUSY_WAIT)
+                while time.perf_counter() < at and self._stops == stops:
+                    pass
+            with self._cond:
+                self._at = at
+
+
+# Plays step trains from a dedicated thread, sleeping coarsely and spinning for the last couple of milliseconds
+class ThreadedStepper:
+    def __init__(self, gpio):
+        self.gpio = gpio
+
+    def write(self, pin, level):
+        self.gpio.output(pin, self.gpio.HIGH if level else self.gpio.LOW)
+
+    def run(self, job, train):
+        gpio = self.gpio
+        start = time.perf_counter()
+        for t, pins in train:
+            if job.cancelled:
+                break
+            target = start + t
+            remaining = target - time.perf_counter()
+            if remaining > BUSY_WAIT:
+                time.sleep(remaining - BUSY_WAIT)
+            while time.perf_counter() < target:
+                pass
+            job.record_lateness(time.perf_counter() - target)
+            for pin in pins:
+                gpio.output(pin, gpio.HIGH)
+            high_until = time.perf_counter() + PULSE_WIDTH
+            while time.perf_counter() < high_until:
+                pass
+            for pin in pins:
+                gpio.output(pin, gpio.LOW)
+            job.steps_done += 1
+
+
+# Hands step trains to the pigpio daemon as DMA-timed waveforms, double-buffered in chunks
+class PigpioStepper:
+    def __init__(self, pi, pigpio=None):
+        if pigpio is None:
+            import pigpio
+        self.pigpio = pigpio
+        self.pi = pi
+        pi.wave_clear()  # Once: runs only delete their own waves, and closed-loop jobs call run() every iteration
+
+    def write(self, pin, level):
+        self.pi.write(pin, 1 if level else 0)
+
+    def _pulses(self, train, start, next_time):
+        # Gaps are taken between step times rounded to whole microseconds, not rounded one by one, so a long
+        # wave keeps to the planned timetable instead of drifting ahead of it
+        width = int(PULSE_WIDTH * 1e6)
+        pulses = []
+        for i, (t, pins) in enumerate(train):
+            mask = 0
+            for pin in pins:
+                mask |= 1 << pin
+            following = train[i + 1][0] if i + 1 < len(train) else next_time
+            pulses.append(self.pigpio.pulse(mask, 0, width))
+            pulses.append(self.pigpio.pulse(0, mask, max(round(following * 1e6) - round(t * 1e6) - width, 1)))
+        if start > 0:
+            pulses.insert(0, self.pigpio.pulse(0, 0, round(start * 1e6)))
+        return pulses
+
+    def run(self, job, train):
+        # Adds to job.steps_done rather than setting it, since closed-loop jobs call this once per step burst
+        pi = self.pi
+        start = job.steps_done
+        started = None
+        queued = 0
+        previous = None
+        for offset in range(0, len(train), PIGPIO_CHUNK):
+            if job.cancelled:
+                break
+            chunk = train[offset:offset + PIGPIO_CHUNK]
+            following = train[offset + PIGPIO_CHUNK][0] if offset + PIGPIO_CHUNK < len(train) else chunk[-1][0]
+            pi.wave_add_generic(self._pulses(chunk, train[0][0] if offset == 0 else 0, following))
+            wave = pi.wave_create()
+            pi.wave_send_using_mode(wave, self.pigpio.WAVE_MODE_ONE_SHOT_SYNC)
+            if started is None:
+                started = time.perf_counter()
+            queued = offset + len(chunk)
+            if previous is not None:
+                # Wait until the daemon switches to the new wave before freeing the old one
+                while pi.wave_tx_at() == previous:
+                    time.sleep(0.001)
+                pi.wave_delete(previous)
+                job.steps_done = start + offset
+            previous = wave
+        while pi.wave_tx_busy() and not job.cancelled:
+            time.sleep(0.001)
+        if pi.wave_tx_busy():
+            # Cancelled mid-wave. The waves play back to back from the first send, so the train's own timetable
+            # says how many steps are already out; crediting only whole chunks would leave the position short.
+            elapsed = time.perf_counter() - started
+            pi.wave_tx_stop()
+            queued = min(queued, bisect.bisect_right([t for t, _ in train], elapsed))  # No key= before 3.10
+        job.steps_done = start + queued
+        if previous is not None:
+            pi.wave_delete(previous)
+
+
+def create_stepper(gpio, backend='auto'):
+    if backend == 'pigpio' and isinstance(gpio, SimulatedGPIO):
+        pi = SimulatedPigpio(gpio)
+        return PigpioStepper(pi, pigpio=pi)
+    if backend in ('auto', 'pigpio'):
+        try:
+            import pigpio
+            pi = pigpio.pi()
+            if pi.connected:
+                logging.info("Using pigpio DMA waveforms for step generation")
+                return PigpioStepper(pi)
+            logging.warning("pigpio daemon not reachable, falling back to threaded step generation")
+        except ImportError:
+            if backend == 'pigpio':
+                logging.warning("pigpio not installed, falling back to threaded step generation")
+    return ThreadedStepper(gpio)
+
+
+class MotionJob:
+    _ids = itertools.count(1)
+    closed_loop = False  # Closed-loop jobs drive the stepper themselves instead of playing a planned train
+
+    def __init__(self, deltas=None, targets=None):
+        self.id = next(self._ids)
+        self.deltas = deltas or {}  # Axis -> signed steps
+        self.targets = targets  # Axis -> absolute step position, resolved into deltas when the job starts
+        self.steps = 0  # Length of the step train, i.e. the longest axis move
+        self.duration = None
+        self.steps_done = 0
+        self.status = 'queued'
+        self.error = None
+        self.max_lateness = 0.0
+        self.late_steps = 0
+        self.started_at = None
+        self.finished_at = None
+        self.cancelled = False
+        self._done = threading.Event()
+
+    def record_lateness(self, lateness):
+        if lateness > self.max_lateness:
+            self.max_lateness = lateness
+        if lateness > LATE_STEP:
+            self.late_steps += 1
+
+    def cancel(self):
+        self.cancelled = True
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def done(self):
+        return self._done.is_set()
+
+    def finish(self, status, error=None):
+        self.status = status
+        self.error = error
+        self.finished_at = time.time()
+        self._done.set()
+
+    def progress(self):
+        # Signed steps each axis has taken so far; axes are interpolated along the longest one
+        if not self.steps:
+            return {axis: 0 for axis in self.deltas}
+        done = min(self.steps_done, self.steps)
+        return {axis: (1 if delta >= 0 else -1) * (done * abs(delta) // self.steps)
+                for axis, delta in self.deltas.items()}
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "axes": self.deltas,
+            "targets": self.targets,
+            "steps": self.steps,
+            "steps_done": self.steps_done,
+            "status": self.status,
+            "error": self.error,
+            "duration": self.duration,
+            "max_lateness_us": self.max_lateness * 1e6,
+            "late_steps": self.late_steps,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+def interpolate(deltas, axes, times):
+    # Merge per-axis steps onto the longest axis's timeline so every axis finishes together
+    steps = len(times)
+    pins = [[] for _ in range(steps)]
+    for axis, delta in deltas.items():
+        count = abs(delta)
+        step_pin = axes[axis][0]
+        for k in range(1, count + 1):
+            pins[(k * steps + count - 1) // count - 1].append(step_pin)
+    return [(t, tuple(p)) for t, p in zip(times, pins)]
+
+
+# Plans coordinated moves and runs them one after another on a dedicated motion thread. That thread is the
+# only code that drives the step and direction pins; callers just queue jobs and get a handle back.
+class MotionController:
+    def __init__(self, stepper, axes, max_rate, accel, profile='trapezoid', history=100, name='default',
+                 max_queued=MAX_QUEUED_JOBS):
+        self.stepper = stepper
+        self.name = name  # Rig label on the exported metrics
+        self.axes = axes
+        self.max_rate = max_rate
+        self.accel = accel
+        self.profile = profile
+        self.history = history
+        self.jobs = {}
+        self.position = {axis: 0 for axis in axes}  # Absolute steps since start-up
+        self._current = None
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def move(self, axis, steps):
+        return self._submit(MotionJob(deltas={axis: steps}))
+
+    def move_to(self, targets):
+        return self._submit(MotionJob(targets=dict(targets)))
+
+    def run(self, job):
+        # Queues a closed-loop job behind any moves already planned, so only one job ever drives the pins
+        return self._submit(job)
+
+    def busy(self):
+        return self._current is not None or not self._queue.empty()
+
+    def positions(self):
+        with self._lock:
+            position = dict(self.position)
+            job = self._current
+        if job is not None:
+            for axis, done in job.progress().items():
+                position[axis] += done
+        return position
+
+    def _submit(self, job):
+        # Raises queue.Full rather than letting a burst of requests queue minutes of motion
+        with self._lock:
+            self._queue.put_nowait(job)
+            self.jobs[job.id] = job
+            for old in list(self.jobs)[:-self.history]:
+                del self.jobs[old]
+        return job
+
+    def _plan(self, job):
+        if job.targets is not None:
+            job.deltas = {axis: target - self.position[axis] for axis, target in job.targets.items()}
+        job.deltas = {axis: delta for axis, delta in job.deltas.items() if delta}
+        longest = max((abs(delta) for delta in job.deltas.values()), default=0)
+        times = step_times(longest, self.max_rate, self.accel, self.profile)
+        job.steps = longest
+        job.duration = times[-1] if times else 0.0
+        return interpolate(job.deltas, self.axes, times)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            if job.cancelled:
+                job.finish('cancelled')
+                continue
+            job.status = 'running'
+            job.started_at = time.time()
+            try:
+                if job.closed_loop:
+                    with self._lock:
+                        self._current = job
+                    job.run(self.stepper, self.axes)
+                else:
+                    train = self._plan(job)
+                    with self._lock:
+                        self._current = job
+                    for axis, delta in job.deltas.items():
+                        self.stepper.write(self.axes[axis][1], delta >= 0)
+                    self.stepper.run(job, train)
+                    job.finish('cancelled' if job.cancelled else 'done')
+            except Exception as e:
+                logging.error(f"Error running motion job {job.id}: {str(e)}")
+                job.finish('failed', str(e))
+            finally:
+                with self._lock:
+                    for axis, done in job.progress().items():
+                        self.position[axis] += done
+                    self._current = None
+                STEPS_ISSUED.inc(job.steps_done, rig=self.name)
+                STEPS_LATE.inc(job.late_steps, rig=self.name)
+                if job.status == 'failed':
+                    STEPS_MISSED.inc(max(job.steps - job.steps_done, 0), rig=self.name)
+
+    def stop(self):
+        for job in list(self.jobs.values()):
+            job.cancel()
+        self._queue.put(None)
+        self._thread.join(timeout=5)
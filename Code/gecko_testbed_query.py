@@ -0,0 +1,205 @@
+import math
+import numpy as np
+from gecko_testbed_storage import format_timestamp, parse_timestamp
+
+CHANNELS = ('fx', 'fy', 'fz')
+# Seconds since the start of the range, computed per row by SQLite
+_OFFSET = "(julianday(timestamp) - julianday(:start)) * 86400.0"
+_ROLLUP_OFFSET = "(julianday(bucket_start) - julianday(:start)) * 86400.0"
+LTTB_OVERSAMPLE = 8  # Min/max buckets per LTTB output point; more follows the raw trace closer but costs more rows
+
+
+def resolve_range(conn, start=None, end=None):
+    # Missing bounds default to the oldest/newest stored sample or rollup bucket; end is exclusive
+    if start is None or end is None:
+        bounds = conn.execute('''SELECT MIN(timestamp), MAX(timestamp) FROM test_results UNION ALL
+                                 SELECT MIN(bucket_start), MAX(bucket_start) FROM test_results_rollup''').fetchall()
+        bounds = [(str(first), str(last)) for first, last in bounds if first is not None]
+        if not bounds:
+            return None
+        start = start or min(first for first, _ in bounds)
+        end = end or format_timestamp(parse_timestamp(max(last for _, last in bounds)) + 0.001)
+    start_s, end_s = parse_timestamp(start), parse_timestamp(end)
+    if end_s <= start_s:
+        raise ValueError("end must be after start")
+    return start, end, start_s, end_s
+
+
+def aggregate(conn, start=None, end=None, buckets=100):
+    # Per-bucket count/min/max/mean/RMS of each channel, computed entirely in SQL. Ranges the compactor has
+    # already rolled up count through their rollup buckets, each landing in the bucket it starts in.
+    resolved = resolve_range(conn, start, end)
+    if resolved is None:
+        return {"bucket_start": [], "count": []}
+    start, end, start_s, end_s = resolved
+    width = (end_s - start_s) / buckets
+    raw = ", ".join(f"MIN({c}) AS {c}_min, MAX({c}) AS {c}_max, SUM({c}) AS {c}_sum, SUM({c} * {c}) AS {c}_sumsq"
+                    for c in CHANNELS)
+    rolled = ", ".join(f"MIN({c}_min), MAX({c}_max), SUM({c}_sum), SUM({c}_sumsq)" for c in CHANNELS)
+    rows = conn.execute(f'''SELECT bucket, SUM(n), {rolled} FROM (
+                                SELECT CAST({_OFFSET} / :width AS INTEGER) AS bucket, COUNT(*) AS n, {raw}
+                                FROM test_results WHERE timestamp >= :start AND timestamp < :end GROUP BY bucket
+                                UNION ALL
+                                SELECT CAST({_ROLLUP_OFFSET} / :width AS INTEGER) AS bucket, SUM(count), {rolled}
+                                FROM test_results_rollup WHERE bucket_start >= :start AND bucket_start < :end
+                                GROUP BY bucket)
+                            GROUP BY bucket ORDER BY bucket''',
+                        {"start": start, "end": end, "width": width}).fetchall()
+    result = {
+        "start": start,
+        "end": end,
+        "bucket_seconds": width,
+        "bucket_start": [format_timestamp(start_s + r[0] * width) for r in rows],
+        "count": [r[1] for r in rows],
+    }
+    for i, channel in enumerate(CHANNELS):
+        base = 2 + i * 4
+        result[channel] = {
+            "min": [r[base] for r in rows],
+            "max": [r[base + 1] for r in rows],
+            "mean": [r[base + 2] / r[1] for r in rows],
+            "rms": [math.sqrt(r[base + 3] / r[1]) for r in rows],
+        }
+    return result
+
+
+def _columnar(rows):
+    ids, fx, fy, fz, timestamps = (list(col) for col in zip(*rows)) if rows else ([], [], [], [], [])
+    return {"id": ids, "fx": fx, "fy": fy, "fz": fz, "timestamp": [str(t) for t in timestamps]}
+
+
+def downsample_minmax(conn, start=None, end=None, points=1000, channel='fz'):
+    if channel not in CHANNELS:
+        raise ValueError(f"Unknown channel {channel}")
+    resolved = resolve_range(conn, start, end)
+    if resolved is None:
+        return _columnar([])
+    start, end, start_s, end_s = resolved
+    params = {"start": start, "end": end, "width": (end_s - start_s) / max(points // 2, 1)}
+    rows = _merge([row[:5] for row in _extremes(conn, params, channel)], _rollup_points(conn, params, channel))
+    return _columnar(rows)
+
+
+def _extremes(conn, params, channel):
+    # The rows holding each bucket's min and max of one channel, in id order, with their epoch seconds last.
+    # SQLite returns the other columns from the row that produced MIN()/MAX(), so no other raw rows leave it.
+    rows = {}
+    for extreme in ("MIN", "MAX"):
+        for row in conn.execute(f'''SELECT id, fx, fy, fz, timestamp, (julianday(timestamp) - 2440587.5) * 86400.0,
+                                           {extreme}({channel})
+                                    FROM test_results WHERE timestamp >= :start AND timestamp < :end
+                                    GROUP BY CAST({_OFFSET} / :width AS INTEGER)''', params):
+            rows[row[0]] = row[:6]
+    return [rows[i] for i in sorted(rows)]
+
+
+def _rollup_points(conn, params, channel):
+    # Min and max points for the compacted part of a range, picked from the rollup buckets like the raw rows
+    # are: one bucket of params["width"] seconds at a time. A rollup only knows its bucket, not when in it the
+    # extreme happened, so both points sit at the bucket's start with the other channels at their means.
+    # Their id is 0, since no stored row stands behind them.
+    points = []
+    for extreme in ("min", "max"):
+        values = ", ".join(f"{c}_{extreme}" if c == channel else f"{c}_sum / count" for c in CHANNELS)
+        points += conn.execute(f'''SELECT 0, {values}, bucket_start, {extreme.upper()}({channel}_{extreme})
+                                   FROM test_results_rollup WHERE bucket_start >= :start AND bucket_start < :end
+                                   GROUP BY CAST({_ROLLUP_OFFSET} / :width AS INTEGER)''', params).fetchall()
+    return [point[:5] for point in points]
+
+
+def _merge(rows, points):
+    # Raw rows come in id order, which is time order; rollup points slot in by timestamp
+    if not points:
+        return rows
+    return sorted(rows + points, key=lambda row: str(row[4]))
+
+
+def lttb(x, y, points):
+    # Largest-Triangle-Three-Buckets: indices of the points that best preserve the trace's shape
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, points - 1).astype(np.intp)
+    selected = np.empty(points, dtype=np.intp)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        next_lo = hi
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[next_lo:max(next_hi, next_lo + 1)].mean()
+        next_y = y[next_lo:max(next_hi, next_lo + 1)].mean()
+        area = np.abs((x[a] - next_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample_lttb(conn, start=None, end=None, points=1000, channel='fz'):
+    # LTTB runs over the min/max rows of LTTB_OVERSAMPLE buckets per output point rather than over every raw
+    # row, so a long full-rate session costs a GROUP BY in SQLite instead of millions of Python tuples
+    if channel not in CHANNELS:
+        raise ValueError(f"Unknown channel {channel}")
+    resolved = resolve_range(conn, start, end)
+    if resolved is None:
+        return _columnar([])
+    start, end, start_s, end_s = resolved
+    params = {"start": start, "end": end, "width": (end_s - start_s) / max(points * LTTB_OVERSAMPLE // 2, 1)}
+    # Compacted stretches join as their rollup min/max points at the same resolution
+    rolled = [point + (parse_timestamp(point[4]),) for point in _rollup_points(conn, params, channel)]
+    rows = _merge(_extremes(conn, params, channel), rolled)
+    if not rows:
+        return _columnar([])
+    x = np.fromiter((r[5] for r in rows), dtype=np.float64, count=len(rows))
+    y = np.fromiter((r[1 + CHANNELS.index(channel)] for r in rows), dtype=np.float64, count=len(rows))
+    return _columnar([rows[i][:5] for i in lttb(x, y, points).tolist()])
+
+
+def cycle_peaks(conn, job_id):
+    # Peak adhesion is the most negative Fz seen during the cycle: logged samples plus the cycle's own reading
+    rows = conn.execute('''SELECT r.cycle, MIN(t.fz), MAX(t.fz), COUNT(t.id), r.push_result, r.pull_result
+                           FROM automation_results r
+                           LEFT JOIN test_results t ON t.timestamp >= r.started_at AND t.timestamp <= r.finished_at
+                           WHERE r.job_id = ? GROUP BY r.cycle ORDER BY r.cycle''', (job_id,)).fetchall()
+    min_fz = [min(r[1], r[4]) if r[1] is not None else r[4] for r in rows]
+    return {
+        "cycle": [r[0] for r in rows],
+        "min_fz": min_fz,
+        "max_fz": [max(r[2], r[4]) if r[2] is not None else r[4] for r in rows],
+        "peak_adhesion": [max(-fz, 0.0) for fz in min_fz],
+        "samples": [r[3] for r in rows],
+        "push_result": [r[4] for r in rows],
+        "pull_result": [r[5] for r in rows],
+    }
+
+
+def rollups(conn, session_id=None, start=None, end=None, limit=10000):
+    # Summaries left behind by compaction, for ranges whose raw rows have been archived
+    clauses, params = [], []
+    if session_id is not None:
+        clauses.append("session_id = ?")
+        params.append(session_id)
+    if start is not None:
+        clauses.append("bucket_start >= ?")
+        params.append(start)
+    if end is not None:
+        clauses.append("bucket_start < ?")
+        params.append(end)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    columns = ", ".join(f"{c}_min, {c}_max, {c}_sum, {c}_sumsq" for c in CHANNELS)
+    rows = conn.execute(f'''SELECT session_id, bucket_start, count, {columns} FROM test_results_rollup {where}
+                            ORDER BY bucket_start, session_id LIMIT ?''', params + [limit]).fetchall()
+    result = {
+        "session_id": [r[0] for r in rows],
+        "bucket_start": [r[1] for r in rows],
+        "count": [r[2] for r in rows],
+    }
+    for i, channel in enumerate(CHANNELS):
+        base = 3 + i * 4
+        result[channel] = {
+            "min": [r[base] for r in rows],
+            "max": [r[base + 1] for r in rows],
+            "mean": [r[base + 2] / r[2] for r in rows],
+            "rms": [math.sqrt(r[base + 3] / r[2]) for r in rows],
+        }
+    return result
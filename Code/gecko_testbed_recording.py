@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import sqlite3
+import logging
+import numpy as np
+from gecko_testbed_storage import create_results_table
+
+# Column name -> on-disk dtype; every chunk stores one flat little-endian file per column
+COLUMNS = {'ts': '<i8', 'fx': '<f4', 'fy': '<f4', 'fz': '<f4'}
+CHUNK_SIZE = 1 << 20  # Samples per chunk
+INDEX_FILE = 'index.json'
+
+
+def _chunk_path(root, chunk, column):
+    return os.path.join(root, f"{chunk:06d}.{column}")
+
+
+def timestamps_to_ns(timestamps):
+    # Stored timestamp strings are UTC in SQLite's CURRENT_TIMESTAMP layout
+    return np.array(timestamps, dtype='datetime64[ns]').astype('<i8')
+
+
+def ns_to_timestamps(ns):
+    return [str(t).replace('T', ' ') for t in np.asarray(ns).astype('datetime64[ns]').astype('datetime64[ms]')]
+
+
+# Appends samples into chunked per-column files; the index only ever covers data already on disk
+class ColumnarRecorder:
+    def __init__(self, root, chunk_size=CHUNK_SIZE):
+        self.root = root
+        self.chunk_size = chunk_size
+        os.makedirs(root, exist_ok=True)
+        index_path = os.path.join(root, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self.index = json.load(f)
+        else:
+            self.index = {"columns": COLUMNS, "chunk_size": chunk_size, "chunks": []}
+        self._pending = {column: [] for column in COLUMNS}
+
+    def append(self, ts_ns, fx, fy, fz):
+        self._pending['ts'].append(ts_ns)
+        self._pending['fx'].append(fx)
+        self._pending['fy'].append(fy)
+        self._pending['fz'].append(fz)
+
+    def append_many(self, ts_ns, fx, fy, fz):
+        self._pending['ts'].extend(ts_ns)
+        self._pending['fx'].extend(fx)
+        self._pending['fy'].extend(fy)
+        self._pending['fz'].extend(fz)
+
+    def __len__(self):
+        return sum(chunk['count'] for chunk in self.index['chunks']) + len(self._pending['ts'])
+
+    def flush(self):
+        arrays = {column: np.asarray(values, dtype=COLUMNS[column]) for column, values in self._pending.items()}
+        self._pending = {column: [] for column in COLUMNS}
+        offset = 0
+        total = len(arrays['ts'])
+        while offset < total:
+            chunks = self.index['chunks']
+            if not chunks or chunks[-1]['count'] >= self.chunk_size:
+                chunks.append({"id": len(chunks), "count": 0, "t_start": None, "t_end": None})
+            chunk = chunks[-1]
+            take = min(self.chunk_size - chunk['count'], total - offset)
+            for column, values in arrays.items():
+                with open(_chunk_path(self.root, chunk['id'], column), 'r+b' if chunk['count'] else 'wb') as f:
+                    # Overwrite anything past the indexed count left behind by an interrupted flush
+                    f.seek(chunk['count'] * values.itemsize)
+                    values[offset:offset + take].tofile(f)
+                    f.truncate()
+            ts = arrays['ts'][offset:offset + take]
+            if chunk['t_start'] is None:
+                chunk['t_start'] = int(ts[0])
+            chunk['t_end'] = int(ts[-1])
+            chunk['count'] += take
+            offset += take
+        if total:
+            self._write_index()
+
+    def _write_index(self):
+        tmp_path = os.path.join(self.root, INDEX_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, os.path.join(self.root, INDEX_FILE))
+
+    def close(self):
+        self.flush()
+
+
+# Memory-maps a recording; per-chunk and time-range reads are views onto the files, not copies
+class ColumnarReader:
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self.chunks = [chunk for chunk in self.index['chunks'] if chunk['count']]
+
+    def __len__(self):
+        return sum(chunk['count'] for chunk in self.chunks)
+
+    def chunk(self, i):
+        chunk = self.chunks[i]
+        return {column: np.memmap(_chunk_path(self.root, chunk['id'], column), dtype=dtype, mode='r',
+                                  shape=(chunk['count'],))
+                for column, dtype in COLUMNS.items()}
+
+    def iter_chunks(self):
+        for i in range(len(self.chunks)):
+            yield self.chunk(i)
+
+    def column(self, name):
+        # A single-chunk recording is returned as-is; longer ones have to be concatenated
+        parts = [chunk[name] for chunk in self.iter_chunks()]
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=COLUMNS[name])
+
+    def range(self, t_start_ns, t_end_ns):
+        # Yields one dict of views per chunk overlapping [t_start_ns, t_end_ns)
+        for i, chunk in enumerate(self.chunks):
+            if chunk['t_end'] < t_start_ns or chunk['t_start'] >= t_end_ns:
+                continue
+            columns = self.chunk(i)
+            lo, hi = np.searchsorted(columns['ts'], [t_start_ns, t_end_ns])
+            yield {column: values[lo:hi] for column, values in columns.items()}
+
+
+def export_to_sqlite(recording, db_path, batch=50000):
+    reader = ColumnarReader(recording)
+    conn = sqlite3.connect(db_path)
+    create_results_table(conn)
+    rows = 0
+    for columns in reader.iter_chunks():
+        for start in range(0, len(columns['ts']), batch):
+            part = slice(start, start + batch)
+            with conn:
+                conn.executemany("INSERT INTO test_results (fx, fy, fz, timestamp) VALUES (?, ?, ?, ?)",
+                                 zip(columns['fx'][part].tolist(), columns['fy'][part].tolist(),
+                                     columns['fz'][part].tolist(), ns_to_timestamps(columns['ts'][part])))
+            rows += len(columns['ts'][part])
+    conn.close()
+    return rows
+
+
+def import_from_sqlite(db_path, recording, since_id=0, batch=50000):
+    recorder = ColumnarRecorder(recording)
+    conn = sqlite3.connect(db_path)
+    rows = 0
+    while True:
+        fetched = conn.execute('''SELECT id, fx, fy, fz, timestamp FROM test_results
+                                  WHERE id > ? ORDER BY id LIMIT ?''', (since_id, batch)).fetchall()
+        if not fetched:
+            break
+        ids, fx, fy, fz, timestamps = zip(*fetched)
+        recorder.append_many(timestamps_to_ns(timestamps).tolist(), fx, fy, fz)
+        recorder.flush()
+        since_id = ids[-1]
+        rows += len(fetched)
+    conn.close()
+    return rows
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) != 4 or sys.argv[1] not in ('export', 'import'):
+        print("Usage: gecko_testbed_recording.py export <recording_dir> <db_path>\n"
+              "       gecko_testbed_recording.py import <db_path> <recording_dir>")
+        sys.exit(1)
+    if sys.argv[1] == 'export':
+        logging.info(f"Exported {export_to_sqlite(sys.argv[2], sys.argv[3])} samples")
+    else:
+        logging.info(f"Imported {import_from_sqlite(sys.argv[2], sys.argv[3])} samples")
@@ -0,0 +1,319 @@
+import os
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+import numpy as np
+from gecko_testbed_metrics import COMPACTED_ROWS, COMPACTION_WINDOW, log_throttled
+from gecko_testbed_recording import timestamps_to_ns
+from gecko_testbed_storage import connect, format_timestamp, parse_timestamp
+
+RETENTION_DEFAULTS = {
+    "idle_deadband": 0.1,  # N; while idle, a sample this close to the last stored one is skipped...
+    "idle_heartbeat": 10.0,  # ...unless nothing has been stored for this many seconds
+    "idle_raw_days": 1.0,  # Raw rows of idle sessions are rolled up and archived after this long...
+    "test_raw_days": 30.0,  # ...and of test and automation sessions after this long, unless pinned
+    "archive_days": None,  # Archive files are deleted after this long; None keeps them forever
+    "rollup_seconds": 60,  # Width of each summary bucket
+    "window_seconds": 600,  # Raw data compacted per transaction, so the writer is never locked out for long
+    "compact_interval": 300.0,  # Seconds between compaction passes
+    "purge_batch": 10000,  # Rows deleted per transaction when a session is deleted
+    "vacuum_pages": 1000,  # Pages handed back to the filesystem per incremental vacuum step
+    "archive_dir": None,  # Defaults to <database name>_archive next to the database
+}
+CHANNELS = ('fx', 'fy', 'fz')
+# Sums rather than means, so a bucket compacted in two passes merges exactly
+UPSERT_ROLLUP = f'''INSERT INTO test_results_rollup VALUES ({', '.join('?' * (3 + 4 * len(CHANNELS)))})
+                    ON CONFLICT (session_id, bucket_start) DO UPDATE SET count = count + excluded.count, ''' + \
+    ', '.join(f"{c}_min = MIN({c}_min, excluded.{c}_min), {c}_max = MAX({c}_max, excluded.{c}_max), "
+              f"{c}_sum = {c}_sum + excluded.{c}_sum, {c}_sumsq = {c}_sumsq + excluded.{c}_sumsq" for c in CHANNELS)
+
+
+# Background retention for one database: raw samples older than their session's retention are rolled up
+# into per-bucket summaries and moved to compressed archive files, then the freed pages are vacuumed away.
+# The raw table therefore only ever holds the retention window, whatever the rig's uptime.
+class Compactor:
+    def __init__(self, db_path, params=None, name='default', on_purge=None):
+        self.db_path = db_path
+        self.params = dict(RETENTION_DEFAULTS, **(params or {}))
+        self.on_purge = on_purge  # Called as on_purge(conn, session_id) in the transaction deleting a session
+        self.archive_dir = self.params["archive_dir"] or os.path.splitext(db_path)[0] + '_archive'
+        self.name = name  # Rig label on the exported metrics
+        self.passes = 0
+        self.rows_compacted = 0
+        self.rows_purged = 0
+        self.archives_written = 0
+        self.pages_vacuumed = 0
+        self.last_pass = None
+        self.max_window_ms = 0.0
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self.create_tables()
+
+    def create_tables(self):
+        conn = connect(self.db_path)
+        cursor = conn.cursor()
+        channels = ", ".join(f"{c}_min REAL, {c}_max REAL, {c}_sum REAL, {c}_sumsq REAL" for c in CHANNELS)
+        cursor.execute(f'''CREATE TABLE IF NOT EXISTS test_results_rollup
+                          (session_id INTEGER, bucket_start DATETIME, count INTEGER, {channels},
+                           PRIMARY KEY (session_id, bucket_start))''')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS result_archives
+                         (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                          session_id INTEGER, path TEXT, rows INTEGER, first_id INTEGER, last_id INTEGER,
+                          t_start DATETIME, t_end DATETIME, created_at DATETIME)''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_result_archives_session ON result_archives (session_id, t_start)")
+        conn.commit()
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            logging.warning(f"{self.db_path} predates incremental vacuum: compaction frees pages for reuse, but the "
+                            f"file will not shrink until 'python gecko_testbed_retention.py "
+                            f"--enable-incremental-vacuum {self.db_path}' is run with the rig stopped")
+        conn.close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def trigger(self):
+        # Runs a pass now instead of at the next interval
+        self._wake.set()
+
+    def _run(self):
+        conn = connect(self.db_path)
+        while True:
+            self._wake.wait(self.params["compact_interval"])
+            self._wake.clear()
+            if self._stopped:
+                break
+            try:
+                self.compact(conn)
+            except Exception as e:
+                log_throttled(f"compactor-{self.name}", logging.ERROR, f"Error compacting {self.db_path}: {str(e)}")
+        conn.close()
+
+    def compact(self, conn, now=None):
+        # One full pass; every step works in bounded transactions so readers and the writer keep going
+        now = time.time() if now is None else now
+        started = time.perf_counter()
+        before = self.rows_compacted, self.rows_purged, self.archives_written
+        p = self.params
+        rollup = p["rollup_seconds"]
+        cutoffs = {kind: (now - p[f"{kind}_raw_days"] * 86400) // rollup * rollup for kind in ('idle', 'test')}
+        self._purge_deleted(conn)
+        sessions = conn.execute('''SELECT id, kind FROM sessions
+                                   WHERE status != 'deleting' AND NOT pinned AND started_at < ?''',
+                                (format_timestamp(cutoffs['idle']),)).fetchall()
+        # Rows stored before sessions existed count as idle data
+        for session_id, kind in [(None, 'idle')] + sessions:
+            cutoff = cutoffs['idle' if kind == 'idle' else 'test']
+            while not self._stopped and self._compact_window(conn, session_id, cutoff):
+                pass
+        if p["archive_days"] is not None:
+            self._expire_archives(conn, now - p["archive_days"] * 86400)
+        self._vacuum(conn)
+        self.passes += 1
+        self.last_pass = {
+            "finished_at": format_timestamp(time.time()),
+            "seconds": time.perf_counter() - started,
+            "rows_compacted": self.rows_compacted - before[0],
+            "rows_purged": self.rows_purged - before[1],
+            "archives_written": self.archives_written - before[2],
+        }
+        if self.last_pass["rows_compacted"] or self.last_pass["rows_purged"]:
+            logging.info(f"Compacted {self.last_pass['rows_compacted']} and purged {self.last_pass['rows_purged']} "
+                         f"rows from {self.db_path} in {self.last_pass['seconds']:.1f} s")
+        return self.last_pass
+
+    def _compact_window(self, conn, session_id, cutoff):
+        # Rolls up and archives the session's oldest window below the cutoff; False once there is none left
+        first = conn.execute("SELECT MIN(timestamp) FROM test_results WHERE session_id IS ?", (session_id,)).fetchone()[0]
+        if first is None or str(first) >= format_timestamp(cutoff):
+            return False
+        rollup = self.params["rollup_seconds"]
+        lo_s = parse_timestamp(first) // rollup * rollup
+        hi_s = min(lo_s + self.params["window_seconds"], cutoff)
+        lo, hi = format_timestamp(lo_s), format_timestamp(hi_s)
+        started = time.perf_counter()
+        # Take the write lock first so no row can land in the window between reading and deleting it
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute('''SELECT id, fx, fy, fz, timestamp, z FROM test_results
+                                   WHERE session_id IS ? AND timestamp >= ? AND timestamp < ? ORDER BY id''',
+                                (session_id, lo, hi)).fetchall()
+            if not rows:
+                conn.commit()
+                return False
+            ids, fx, fy, fz, timestamps, z = zip(*rows)
+            columns = {
+                "id": np.array(ids, dtype='<i8'),
+                "ts": timestamps_to_ns([str(t) for t in timestamps]),
+                "fx": np.array(fx, dtype='<f8'),
+                "fy": np.array(fy, dtype='<f8'),
+                "fz": np.array(fz, dtype='<f8'),
+                "z": np.array(z, dtype='<f8'),  # NaN where no position was recorded
+            }
+            key = session_id or 0
+            path = self._archive(key, lo_s, columns)
+            conn.executemany(UPSERT_ROLLUP, rollup_rows(key, columns, rollup))
+            conn.execute('''INSERT INTO result_archives
+                            (session_id, path, rows, first_id, last_id, t_start, t_end, created_at)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                         (key, path, len(rows), int(columns["id"].min()), int(columns["id"].max()),
+                          str(min(timestamps)), str(max(timestamps)), format_timestamp(time.time())))
+            conn.execute("DELETE FROM test_results WHERE session_id IS ? AND timestamp >= ? AND timestamp < ?",
+                         (session_id, lo, hi))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        elapsed = time.perf_counter() - started
+        COMPACTION_WINDOW.observe(elapsed, rig=self.name)
+        COMPACTED_ROWS.inc(len(rows), rig=self.name)
+        self.max_window_ms = max(self.max_window_ms, elapsed * 1e3)
+        self.rows_compacted += len(rows)
+        self.archives_written += 1
+        return True
+
+    def _archive(self, session_id, lo_s, columns):
+        # One compressed file per window; the first id keeps late rows compacted later from overwriting it
+        directory = os.path.join(self.archive_dir, f"session-{session_id:06d}")
+        os.makedirs(directory, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S', time.gmtime(lo_s))}-{int(columns['id'][0])}.npz"
+        path = os.path.join(directory, name)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez_compressed(f, **columns)
+        os.replace(path + '.tmp', path)
+        return path
+
+    def _purge_deleted(self, conn):
+        for (session_id,) in conn.execute("SELECT id FROM sessions WHERE status = 'deleting'").fetchall():
+            while not self._stopped:
+                with conn:
+                    deleted = conn.execute('''DELETE FROM test_results WHERE id IN
+                                              (SELECT id FROM test_results WHERE session_id = ? LIMIT ?)''',
+                                           (session_id, self.params["purge_batch"])).rowcount
+                self.rows_purged += deleted
+                if not deleted:
+                    break
+            if self._stopped:
+                return
+            paths = [row[0] for row in conn.execute("SELECT path FROM result_archives WHERE session_id = ?",
+                                                    (session_id,))]
+            with conn:
+                conn.execute("DELETE FROM test_results_rollup WHERE session_id = ?", (session_id,))
+                conn.execute("DELETE FROM result_archives WHERE session_id = ?", (session_id,))
+                if self.on_purge is not None:
+                    self.on_purge(conn, session_id)
+                conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            for path in paths:
+                remove_file(path)
+            logging.info(f"Deleted session {session_id} from {self.db_path}")
+
+    def _expire_archives(self, conn, cutoff):
+        # Oldest tier: only the rollups are kept
+        expired = conn.execute("SELECT id, path FROM result_archives WHERE t_end < ?",
+                               (format_timestamp(cutoff),)).fetchall()
+        for archive_id, path in expired:
+            remove_file(path)
+            with conn:
+                conn.execute("DELETE FROM result_archives WHERE id = ?", (archive_id,))
+
+    def _vacuum(self, conn):
+        # Needs auto_vacuum=INCREMENTAL; small steps so no single one holds the write lock for long
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        while free and not self._stopped:
+            conn.execute(f"PRAGMA incremental_vacuum({self.params['vacuum_pages']})").fetchall()
+            remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if remaining >= free:
+                break
+            self.pages_vacuumed += free - remaining
+            free = remaining
+
+    def stats(self):
+        return {
+            "params": self.params,
+            "archive_dir": self.archive_dir,
+            "passes": self.passes,
+            "rows_compacted": self.rows_compacted,
+            "rows_purged": self.rows_purged,
+            "archives_written": self.archives_written,
+            "pages_vacuumed": self.pages_vacuumed,
+            "max_window_ms": self.max_window_ms,
+            "last_pass": self.last_pass,
+        }
+
+
+def init_incremental_vacuum(db_path):
+    # A database created from now on starts in incremental auto-vacuum, so compaction can hand freed pages back.
+    # It has to be set before anything writes the file, WAL mode included.
+    if os.path.exists(db_path) and os.path.getsize(db_path) > 0:
+        return
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.close()
+
+
+def enable_incremental_vacuum(db_path):
+    # Switching an existing database over rebuilds the whole file under the write lock, which can take minutes
+    # on a large one, so it is a maintenance step rather than something the rig does at start-up
+    conn = connect(db_path, timeout=60.0)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+    finally:
+        conn.close()
+
+
+def rollup_rows(session_id, columns, rollup_seconds):
+    # Per-bucket count/min/max/sum/sum of squares for every channel, grouped with NumPy
+    bucket = columns["ts"] // (rollup_seconds * 1_000_000_000)
+    order = np.argsort(bucket, kind='stable')
+    buckets, starts = np.unique(bucket[order], return_index=True)
+    counts = np.diff(np.append(starts, len(order)))
+    stats = []
+    for channel in CHANNELS:
+        values = columns[channel][order]
+        stats += [np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts),
+                  np.add.reduceat(values, starts), np.add.reduceat(values * values, starts)]
+    return [(session_id, format_timestamp(int(b) * rollup_seconds), int(n), *(float(s[i]) for s in stats))
+            for i, (b, n) in enumerate(zip(buckets, counts))]
+
+
+def read_archive(path):
+    with np.load(path) as archive:
+        return {column: archive[column] for column in archive.files}
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.warning(f"Cannot remove archive {path}: {str(e)}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Retention maintenance for rig databases")
+    parser.add_argument('databases', nargs='+', help="Rig databases to maintain")
+    parser.add_argument('--enable-incremental-vacuum', action='store_true', required=True,
+                        help="Rebuild each database once so compaction can shrink it; run with the rig stopped")
+    args = parser.parse_args()
+    for db_path in args.databases:
+        started = time.perf_counter()
+        if enable_incremental_vacuum(db_path):
+            logging.info(f"Rebuilt {db_path} with incremental vacuum in {time.perf_counter() - started:.1f} s")
+        else:
+            logging.info(f"{db_path} already uses incremental vacuum")
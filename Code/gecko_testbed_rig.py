@@ -0,0 +1,450 @@
+import os
+import json
+import time
+import logging
+import threading
+from gecko_testbed_analysis import AdhesionAnalyzer, purge_session
+from gecko_testbed_control import ForceControlJob
+from gecko_testbed_hardware import HARDWARE, find_serial_port, open_amplifier, open_gpio
+from gecko_testbed_jobs import JobScheduler
+from gecko_testbed_metrics import DB_SIZE, REGISTRY, RESULTS_ROWS, WRITER_QUEUE, log_throttled
+from gecko_testbed_motion import MotionController, create_stepper
+from gecko_testbed_recording import ColumnarRecorder
+from gecko_testbed_retention import RETENTION_DEFAULTS, Compactor, init_incremental_vacuum
+from gecko_testbed_sensor import SAMPLE_RATE, SampleBuffer, SensorStream
+from gecko_testbed_sessions import SessionStore
+from gecko_testbed_storage import ResultWriter, connect, create_results_table
+
+# Defaults for any setting a rig's config entry leaves out
+AXES = {
+    "X": (16, 26),  # Step, Dir pins
+    "Y": (24, 25),
+    "Z": (27, 17)
+}
+MAX_STEP_RATE = 4000  # Steps/s at cruise, placeholder, tune for the drivers
+STEP_ACCEL = 8000  # Steps/s^2
+MOTION_PROFILE = os.environ.get('GECKO_MOTION_PROFILE', 'trapezoid')  # 'trapezoid' or 's_curve'
+STEPS_PER_MM = 200  # Placeholder, calibrate based on motor resolution
+BAUDRATE = 115200
+CALIBRATION_FACTORS = {'Fx': 20.0, 'Fy': 20.0, 'Fz': 20.0}  # Placeholder, calibrate
+ZERO_OFFSET = (0.0, 0.0, 0.0)  # mV/V read with the sensor unloaded
+DB_PATH = "gecko_testbed.db"
+RECORDING_DIR = os.environ.get('GECKO_RECORDING_DIR')  # Set to also record every sample to columnar files
+RIGS_CONFIG = os.environ.get('GECKO_RIGS_CONFIG', 'rigs.json')
+RESULTS_LIMIT = 1000  # Default page size for /results
+START_RETRY = 2.0  # Seconds before a failed rig start is retried, doubling each time...
+START_RETRY_MAX = 60.0  # ...up to this
+STALE_PERIODS = 20  # Frame periods the newest sample may age before a reading is refused as stale
+STORE_INTERVAL = 0.05  # Seconds between passes of the storage loop; idle data keeps at most one sample per pass
+
+
+def default_config(rig_id='default'):
+    return {
+        "id": rig_id,
+        "hardware": HARDWARE,  # 'pi' or 'sim'
+        "serial_port": None,  # None finds the amplifier by probing the serial ports at start-up
+        "baudrate": BAUDRATE,
+        "calibration": CALIBRATION_FACTORS,  # Per-channel factors, or a 3x3 N per mV/V matrix including crosstalk
+        "zero_offset": ZERO_OFFSET,
+        "axes": AXES,
+        "steps_per_mm": STEPS_PER_MM,
+        "max_step_rate": MAX_STEP_RATE,
+        "step_accel": STEP_ACCEL,
+        "motion_profile": MOTION_PROFILE,
+        "db_path": DB_PATH,
+        "recording_dir": RECORDING_DIR,
+    }
+
+
+def load_rig_configs(path=None):
+    # A missing config file means a single rig with the module defaults, as before multi-rig support
+    path = path or RIGS_CONFIG
+    if not os.path.exists(path):
+        return [default_config()]
+    with open(path) as f:
+        entries = json.load(f)
+    if isinstance(entries, dict):
+        entries = entries["rigs"]
+    configs = []
+    for entry in entries:
+        config = default_config(str(entry["id"]))
+        if len(entries) > 1:
+            # Rigs never share a database or recording directory unless told to
+            config["db_path"] = f"gecko_testbed_{config['id']}.db"
+            if RECORDING_DIR:
+                config["recording_dir"] = os.path.join(RECORDING_DIR, config["id"])
+        config.update(entry)
+        config["axes"] = {axis: tuple(pins) for axis, pins in config["axes"].items()}
+        configs.append(config)
+    ids = [config["id"] for config in configs]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"Duplicate rig ids in {path}")
+    pins = [pin for config in configs for axis_pins in config["axes"].values() for pin in axis_pins]
+    if len(set(pins)) != len(pins):
+        raise ValueError(f"Rigs in {path} share GPIO pins")
+    ports = [config["serial_port"] for config in configs if config["serial_port"]]
+    if len(set(ports)) != len(ports):
+        raise ValueError(f"Rigs in {path} share a serial port")
+    return configs
+
+
+# One fixture: its own amplifier, sample buffer, database, axes and worker threads, sharing nothing with other rigs
+class GeckoTestbed:
+    def __init__(self, config, gpio=None, port=None, motion_backend='auto'):
+        self.id = config["id"]
+        self.config = config
+        self.gpio = gpio = gpio if gpio is not None else open_gpio(config)
+        self.axes = config["axes"]
+        self.steps_per_mm = config["steps_per_mm"]
+        self.db_path = config["db_path"]
+        self._local = threading.local()
+        self._stopped = threading.Event()  # Ends the storage and recording loops
+        # Everything cleanup() releases starts out None, so a start that fails halfway can be unwound
+        self.ser = self.sensor_stream = self.writer = self.compactor = self.analyzer = self.jobs = self.motion = None
+        self.sensor_thread = self.recorder = self.recording_thread = None
+        try:
+            for step_pin, dir_pin in self.axes.values():
+                gpio.setup(step_pin, gpio.OUT, initial=gpio.LOW)
+                gpio.setup(dir_pin, gpio.OUT, initial=gpio.LOW)
+            self.ser = port if port is not None else open_amplifier(config, gpio)
+            # The acquisition engine is the only code that talks to the amplifier; everything else reads the buffer
+            self.buffer = SampleBuffer()
+            self.sensor_stream = SensorStream(self.ser, self.buffer, config["calibration"], config["zero_offset"],
+                                              clock=getattr(self.ser, 'clock', time.time), name=self.id,
+                                              rate=getattr(self.ser, 'rate', SAMPLE_RATE))
+            self.sensor_stream.start()
+            self.create_db()
+            self.retention = dict(RETENTION_DEFAULTS, **(config.get("retention") or {}))
+            self.compactor = Compactor(self.db_path, self.retention, name=self.id, on_purge=purge_session)
+            self.sessions = SessionStore(self.db_path)
+            self.analyzer = AdhesionAnalyzer(self.db_path, name=self.id)
+            self._automation_session = None
+            self.writer = ResultWriter(self.db_path, name=self.id)
+            self.writer.start()
+            self.compactor.start()
+            self.analyzer.start()
+            self.jobs = JobScheduler(self.db_path, self.automation_cycle, self.automation_status)
+            if config["hardware"] == 'sim' and motion_backend != 'pigpio':
+                motion_backend = 'thread'  # Asking for pigpio explicitly runs its waveforms on the simulated pins
+            self.motion = MotionController(create_stepper(gpio, motion_backend), self.axes, config["max_step_rate"],
+                                           config["step_accel"], config["motion_profile"], name=self.id)
+            self.sensor_thread = threading.Thread(target=self._sensor_loop, daemon=True)
+            self.sensor_thread.start()
+            if config["recording_dir"]:
+                self.recorder = ColumnarRecorder(os.path.join(config["recording_dir"],
+                                                              time.strftime('%Y%m%d-%H%M%S')))
+                self.recording_thread = threading.Thread(target=self._recording_loop, daemon=True)
+                self.recording_thread.start()
+            REGISTRY.register_collector(self.collect_metrics)
+        except Exception:
+            # Whatever did come up is released, the exclusive serial port above all, so a retry can succeed
+            try:
+                self.cleanup()
+            except Exception as e:
+                logging.error(f"Error cleaning up rig {self.id} after a failed start: {str(e)}")
+            raise
+
+    def collect_metrics(self):
+        # Gauges are sampled at scrape time; the hot paths only bump counters
+        WRITER_QUEUE.set(self.writer.queue.qsize(), rig=self.id)
+        DB_SIZE.set(sum(os.path.getsize(path) for path in (self.db_path, self.db_path + '-wal')
+                        if os.path.exists(path)), rig=self.id)
+
+    def create_db(self):
+        # Compaction frees pages continuously; incremental mode lets it hand them back a few at a time. Only a
+        # new database gets it here, since switching an existing one over means rebuilding the whole file.
+        init_incremental_vacuum(self.db_path)
+        conn = connect(self.db_path)
+        create_results_table(conn)
+        conn.close()
+
+    def reader(self):
+        # Each request thread reads through its own connection so it never shares one with the writer
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = connect(self.db_path)
+        return conn
+
+    def read_sensor(self, timeout=1.0):
+        # The buffer keeps its last sample when the amplifier stops, so a reading that has gone stale is refused
+        # rather than passed off as the current force
+        max_age = STALE_PERIODS / self.sensor_stream.rate
+        sample = self.buffer.latest() or self.buffer.wait_next(0, timeout)
+        if sample is not None and self.sensor_stream.clock() - sample.timestamp > max_age:
+            sample = self.buffer.wait_next(sample.seq, max_age)
+        if sample is None:
+            log_throttled(f"read-sensor-{self.id}", logging.ERROR,
+                          f"Error reading sensor on rig {self.id}: no fresh samples from amplifier")
+            raise SensorStale(f"No force samples from the amplifier of rig {self.id} in the last {max_age:.3f} s")
+        return sample_to_force(sample)
+
+    def automation_cycle(self, job):
+        # Each cycle waits for a fresh sample rather than re-reading the latest one
+        sample = self.buffer.wait_next(job.state.get('seq', self.buffer.seq), timeout=1.0)
+        if sample is None:
+            # Failing the job beats storing a stalled amplifier as 0 N cycles
+            raise SensorStale(f"No force samples from the amplifier of rig {self.id} in the last 1.000 s")
+        job.state['seq'] = sample.seq
+        force_data = sample_to_force(sample)
+        return force_data['Fz'], -force_data['Fz']
+
+    def automation_status(self, job):
+        # An automation job gets its own session unless it runs inside one the operator started
+        if job.status == 'running':
+            if self.sessions.current["kind"] == 'idle':
+                self._automation_session = self.sessions.start(
+                    'automation', f"Automation job {job.id}",
+                    {"job_id": job.id, "steps": job.steps, "push_force": job.push_force, "pull_force": job.pull_force})
+        elif self._automation_session is not None:
+            self.sessions.end(self._automation_session)
+            self._automation_session = None
+
+    def recording_active(self):
+        # Full-rate storage during tests, moves and automation; otherwise only changes and a heartbeat
+        return self.sessions.current["kind"] != 'idle' or self.jobs.busy() or self.motion.busy()
+
+    def _sensor_loop(self):
+        # While recording, every sample since the last pass is stored, with the Z position interpolated over the
+        # pass so force can be integrated over displacement. Idle, only the newest sample of each pass is looked
+        # at, and kept if it moved beyond the deadband or the heartbeat is due.
+        seq = self.buffer.seq
+        last = None
+        last_stored = 0.0
+        z_at = None
+        while not self._stopped.is_set():
+            samples = self.buffer.wait_since(seq, timeout=1.0)
+            now = time.monotonic()
+            z = (self.sensor_stream.clock(), self.positions().get("Z"))
+            if samples:
+                seq = samples[-1].seq
+                sample = samples[-1]
+                if self.recording_active():
+                    session_id = self.sessions.current["id"]
+                    for s in samples:
+                        self.writer.submit(s.fx, s.fy, s.fz, s.timestamp, session_id,
+                                           interpolate_z(z_at, z, s.timestamp))
+                    last = (sample.fx, sample.fy, sample.fz)
+                    last_stored = now
+                elif (last is None or now - last_stored >= self.retention["idle_heartbeat"]
+                      or max(abs(sample.fx - last[0]), abs(sample.fy - last[1]),
+                             abs(sample.fz - last[2])) > self.retention["idle_deadband"]):
+                    self.store_result(sample.fx, sample.fy, sample.fz, sample.timestamp)
+                    last = (sample.fx, sample.fy, sample.fz)
+                    last_stored = now
+            z_at = z
+            time.sleep(STORE_INTERVAL)
+
+    def _recording_loop(self):
+        # Records the full-rate stream, not just the samples kept in SQLite
+        seq = self.buffer.seq
+        while not self._stopped.is_set():
+            samples = self.buffer.wait_since(seq, timeout=1.0)
+            if samples:
+                seq = samples[-1].seq
+                for sample in samples:
+                    self.recorder.append(int(sample.timestamp * 1e9), sample.fx, sample.fy, sample.fz)
+            try:
+                self.recorder.flush()
+            except Exception as e:
+                logging.error(f"Error writing recording: {str(e)}")
+            time.sleep(0.5)
+
+    def store_result(self, fx, fy, fz, timestamp=None):
+        # The Z position goes with every sample so offline analysis can integrate force over displacement
+        self.writer.submit(fx, fy, fz, timestamp, self.sessions.current["id"], self.positions().get("Z"))
+
+    def query_results(self, since_id=None, before_id=None, start=None, end=None, session_id=None,
+                      limit=RESULTS_LIMIT):
+        clauses, params = [], []
+        if session_id is not None:
+            clauses.append("session_id = ?")
+            params.append(session_id)
+        if since_id is not None:
+            clauses.append("id > ?")
+            params.append(since_id)
+        if before_id is not None:
+            clauses.append("id < ?")
+            params.append(before_id)
+        if start is not None:
+            clauses.append("timestamp >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("timestamp < ?")
+            params.append(end)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        # Cursor and range queries page forward from their start; otherwise return the newest page
+        forward = since_id is not None or start is not None
+        order = "ASC" if forward else "DESC"
+        cursor = self.reader().cursor()
+        cursor.execute(f"SELECT id, fx, fy, fz, timestamp FROM test_results {where} ORDER BY id {order} LIMIT ?",
+                       params + [limit])
+        rows = cursor.fetchall()
+        RESULTS_ROWS.inc(len(rows), rig=self.id)
+        return rows if forward else rows[::-1]
+
+    def get_results(self, **query):
+        try:
+            rows = self.query_results(**query)
+            return [{"id": r[0], "fx": r[1], "fy": r[2], "fz": r[3], "timestamp": str(r[4])} for r in rows]
+        except Exception as e:
+            logging.error(f"Error fetching results: {str(e)}")
+            return []
+
+    def move_axis(self, axis, steps):
+        # Returns a job handle straight away; the motion thread plays the precomputed step train
+        if axis not in self.axes:
+            return None
+        return self.motion.move(axis, steps)
+
+    def move_to(self, targets):
+        # Absolute targets in mm; all named axes run together and finish at the same time
+        if not targets or any(axis not in self.axes for axis in targets):
+            return None
+        return self.motion.move_to({axis: int(round(mm * self.steps_per_mm)) for axis, mm in targets.items()})
+
+    def apply_force(self, mode, force):
+        # Closed-loop push or pull on Z, queued on the motion thread like any other move
+        if "Z" not in self.axes:
+            return None
+        return self.motion.run(ForceControlJob(self.buffer, "Z", mode, force, self.config.get("force_control")))
+
+    def positions(self):
+        return {axis: steps / self.steps_per_mm for axis, steps in self.motion.positions().items()}
+
+    def info(self):
+        return {
+            "id": self.id,
+            "hardware": self.config["hardware"],
+            "serial_port": self.config["serial_port"],
+            "db_path": self.db_path,
+            "axes": list(self.axes),
+            "samples": self.buffer.seq,
+        }
+
+    def cleanup(self):
+        # Also unwinds a constructor that failed partway, so every part may still be missing
+        REGISTRY.unregister_collector(self.collect_metrics)
+        self._stopped.set()
+        for part in (self.jobs, self.compactor, self.analyzer, self.motion):
+            if part is not None:
+                part.stop()
+        # Only release this rig's pins; other rigs may still be driving theirs
+        self.gpio.cleanup([pin for pins in self.axes.values() for pin in pins])
+        if self.sensor_stream is not None:
+            self.sensor_stream.stop()
+        for thread in (self.sensor_thread, self.recording_thread):
+            if thread is not None:
+                thread.join(timeout=2)
+        if self.writer is not None:
+            self.writer.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.ser is not None:
+            self.ser.close()
+
+
+# Brings a rig's hardware up on a background thread, so the API can serve (and report health) while serial
+# ports are probed and the amplifier starts streaming. The testbed attribute stays None until it is ready.
+# A failed start, say with the amplifier not yet powered, is retried with backoff until it succeeds.
+class LazyTestbed:
+    def __init__(self, config, motion_backend='auto', exclude_ports=()):
+        self.id = config["id"]
+        self.config = config
+        self.motion_backend = motion_backend
+        self.exclude_ports = set(exclude_ports)  # Ports other rigs are configured to use
+        self.testbed = None
+        self.status = 'pending'
+        self.error = None
+        self.attempts = 0
+        self.retry_at = None
+        self.started_at = None
+        self.ready_at = None
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self.started_at = time.time()
+                self.status = 'starting'
+                self._thread = threading.Thread(target=self._start, daemon=True)
+                self._thread.start()
+        return self
+
+    def _start(self):
+        delay = START_RETRY
+        while not self._stop.is_set():
+            self.attempts += 1
+            try:
+                config = dict(self.config)
+                if config["hardware"] != 'sim' and not config["serial_port"]:
+                    config["serial_port"] = find_serial_port(self.id, config["baudrate"], self.exclude_ports)
+                    if config["serial_port"] is None:
+                        raise RuntimeError("No amplifier answered on any serial port")
+                self.testbed = GeckoTestbed(config, motion_backend=self.motion_backend)
+                self.ready_at = time.time()
+                self.status = 'ready'
+                self.error = None
+                self.retry_at = None
+                logging.info(f"Rig {self.id} ready after {self.ready_at - self.started_at:.2f} s")
+                self._ready.set()
+                return
+            except Exception as e:
+                logging.error(f"Error starting rig {self.id} (attempt {self.attempts}), retrying in {delay:.0f} s: "
+                              f"{str(e)}")
+                self.error = str(e)
+                self.status = 'failed'
+                self.retry_at = time.time() + delay
+                self._ready.set()  # Waiters hear about the failure now rather than after every retry
+            if self._stop.wait(delay):
+                break
+            delay = min(delay * 2, START_RETRY_MAX)
+            self._ready.clear()
+            self.status = 'starting'
+
+    def wait(self, timeout=None):
+        # Starts the rig if nothing has yet, then blocks until it is ready or has failed
+        self.start()
+        self._ready.wait(timeout)
+        return self.testbed
+
+    def health(self):
+        health = {
+            "id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "serial_port": self.testbed.config["serial_port"] if self.testbed else self.config["serial_port"],
+            "startup_s": self.ready_at - self.started_at if self.ready_at else None,
+            "attempts": self.attempts,
+            "retry_in_s": max(self.retry_at - time.time(), 0.0) if self.status == 'failed' else None,
+        }
+        if self.testbed is not None:
+            # A rig can come up and later lose its amplifier, so also report how fresh the data is
+            sample = self.testbed.buffer.latest()
+            health["sample_age_s"] = self.testbed.sensor_stream.clock() - sample.timestamp if sample else None
+            health["streaming"] = sample is not None and health["sample_age_s"] < self.testbed.sensor_stream.stall_timeout
+        return health
+
+    def cleanup(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.testbed is not None:
+            self.testbed.cleanup()
+
+
+class SensorStale(Exception):
+    pass
+
+
+def interpolate_z(start, end, t):
+    # Z at time t from the (time, Z) read at the previous and the current pass of the storage loop
+    if start is None or start[1] is None or end[1] is None or end[0] <= start[0]:
+        return end[1]
+    return start[1] + (end[1] - start[1]) * min(max((t - start[0]) / (end[0] - start[0]), 0.0), 1.0)
+
+
+def sample_to_force(sample):
+    return {'Fx': sample.fx, 'Fy': sample.fy, 'Fz': sample.fz}
@@ -0,0 +1,262 @@
+import struct
+import time
+import logging
+import threading
+from collections import deque, namedtuple
+from itertools import islice
+import numpy as np
+from gecko_testbed_metrics import SENSOR_DROPPED, SENSOR_FRAMES, SENSOR_RESYNCS, SENSOR_STALLS, SERIAL_READ, log_throttled
+
+# Amplifier protocol
+FRAME_HEADER = 0xA5
+FRAME_SIZE = 11
+CMD_STOP = b'\x23'
+CMD_CONFIGURE = b'\x26\x01\x62\x65\x72\x6C\x69\x6E'
+CMD_START = b'\x24'
+SAMPLE_RATE = 1000  # Frames/s the amplifier streams at, placeholder, check against its configuration
+BATCH_MIN_BYTES = 1024  # Below this the per-frame parser beats NumPy's call overhead
+
+Sample = namedtuple('Sample', 'seq timestamp fx fy fz')
+
+# Header, three big-endian channel readings, then four bytes the decoder ignores
+FRAME_DTYPE = np.dtype([('header', 'u1'), ('fx', '>u2'), ('fy', '>u2'), ('fz', '>u2'), ('trailer', 'V4')])
+
+
+def raw_to_mv_v(raw, scale=2.0):
+    return (raw - 32768) / 32768 * scale
+
+
+def decode_frame(frame, calibration):
+    fx_raw, fy_raw, fz_raw = struct.unpack_from('>HHH', frame, 1)
+    return (raw_to_mv_v(fx_raw) * calibration['Fx'],
+            raw_to_mv_v(fy_raw) * calibration['Fy'],
+            raw_to_mv_v(fz_raw) * calibration['Fz'])
+
+
+def calibration_matrix(calibration):
+    # Per-axis factors become a diagonal matrix; a full 3x3 matrix also carries the channel crosstalk
+    if isinstance(calibration, dict):
+        return np.diag([calibration['Fx'], calibration['Fy'], calibration['Fz']]).astype(np.float64)
+    return np.asarray(calibration, dtype=np.float64).reshape(3, 3)
+
+
+def parse_frames(rx, calibration, gap=False):
+    # Reference per-frame parser; returns (forces, bytes consumed, resyncs, dropped bytes, ended in a gap).
+    # A resync is one run of skipped bytes; gap says the previous read ended inside one, so it is counted once
+    forces = []
+    resyncs = dropped = 0
+    i = 0
+    n = len(rx)
+    # A frame is only accepted once the following header has arrived to confirm it
+    while n - i > FRAME_SIZE:
+        if rx[i] != FRAME_HEADER:
+            j = rx.find(FRAME_HEADER, i)
+            resyncs += not gap
+            gap = True
+            dropped += (n if j < 0 else j) - i
+            if j < 0:
+                i = n
+                break
+            i = j
+            continue
+        if rx[i + FRAME_SIZE] != FRAME_HEADER:
+            resyncs += not gap
+            gap = True
+            dropped += 1
+            i += 1
+            continue
+        forces.append(decode_frame(rx[i:i + FRAME_SIZE], calibration))
+        gap = False
+        i += FRAME_SIZE
+    return forces, i, resyncs, dropped, gap
+
+
+def find_frames(buf):
+    # Offsets of every header confirmed by another header one frame later
+    n = len(buf)
+    if n <= FRAME_SIZE:
+        return np.empty(0, dtype=np.intp)
+    offsets = np.flatnonzero((buf[:n - FRAME_SIZE] == FRAME_HEADER) & (buf[FRAME_SIZE:] == FRAME_HEADER))
+    if len(offsets) < 2 or np.all(np.diff(offsets) >= FRAME_SIZE):
+        return offsets
+    # Rare: a payload byte also looked like a header, so drop candidates overlapping an accepted frame
+    keep = []
+    end = 0
+    for offset in offsets.tolist():
+        if offset >= end:
+            keep.append(offset)
+            end = offset + FRAME_SIZE
+    return np.array(keep, dtype=np.intp)
+
+
+def decode_frames(buf, offsets, matrix, zero_offset=None, scale=2.0):
+    frames = buf[offsets[:, None] + np.arange(FRAME_SIZE)].view(FRAME_DTYPE).ravel()
+    raw = np.column_stack((frames['fx'], frames['fy'], frames['fz'])).astype(np.float64)
+    mv_v = (raw - 32768) / 32768 * scale
+    if zero_offset is not None:
+        mv_v -= zero_offset
+    return mv_v @ matrix.T
+
+
+def parse_frames_batch(rx, matrix, zero_offset=None, gap=False):
+    # Vectorized equivalent of parse_frames, returning an (n, 3) array of Fx/Fy/Fz
+    buf = np.frombuffer(rx, dtype=np.uint8)
+    n = len(buf)
+    offsets = find_frames(buf)
+    end = int(offsets[-1]) + FRAME_SIZE if len(offsets) else 0
+    # Keep the tail from its first header on: headers in the last frame's worth of bytes are still unconfirmed
+    tail = max(end, n - FRAME_SIZE, 0)
+    headers = np.flatnonzero(buf[tail:] == FRAME_HEADER)
+    consumed = tail + (int(headers[0]) if len(headers) else n - tail)
+    dropped = consumed - len(offsets) * FRAME_SIZE
+    starts = np.concatenate(([0], offsets[:-1] + FRAME_SIZE)) if len(offsets) else np.empty(0, dtype=np.intp)
+    # One resync per run of skipped bytes: before a frame, or after the last one; a run that carries on from the
+    # previous call was counted there
+    gaps = offsets != starts
+    leading = bool(gaps[0]) if len(offsets) else consumed > 0
+    resyncs = int(np.count_nonzero(gaps)) + (1 if consumed > end else 0) - (1 if gap and leading else 0)
+    ends_in_gap = consumed > end or (gap and not len(offsets))
+    forces = decode_frames(buf, offsets, matrix, zero_offset) if len(offsets) else np.empty((0, 3))
+    return forces, consumed, resyncs, dropped, ends_in_gap
+
+
+# Fixed-size ring of the most recent samples, shared by all consumers
+class SampleBuffer:
+    def __init__(self, size=4096):
+        self._samples = deque(maxlen=size)
+        self._cond = threading.Condition()
+        self.seq = 0  # Sequence number of the newest sample
+
+    def publish(self, samples):
+        with self._cond:
+            for timestamp, fx, fy, fz in samples:
+                self.seq += 1
+                self._samples.append(Sample(self.seq, timestamp, fx, fy, fz))
+            self._cond.notify_all()
+
+    def latest(self):
+        with self._cond:
+            return self._samples[-1] if self._samples else None
+
+    def since(self, seq):
+        # Samples newer than seq, oldest first; anything already overwritten is lost
+        with self._cond:
+            count = min(self.seq - seq, len(self._samples))
+            if count <= 0:
+                return []
+            return list(islice(reversed(self._samples), count))[::-1]
+
+    def wait_since(self, seq, timeout=None):
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq > seq, timeout)
+        return self.since(seq)
+
+    def wait_next(self, seq, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.seq > seq, timeout):
+                return None
+            return self._samples[-1]
+
+
+# Owns the amplifier port: configures it once, then parses the frame stream into a SampleBuffer
+class SensorStream:
+    def __init__(self, port, buffer, calibration, zero_offset=None, stall_timeout=2.0, clock=time.time, name='default',
+                 rate=SAMPLE_RATE):
+        self.port = port
+        self.name = name  # Rig label on the exported metrics
+        self.buffer = buffer
+        self.matrix = calibration_matrix(calibration)
+        self.zero_offset = np.asarray(zero_offset, dtype=np.float64) if np.any(zero_offset) else None  # mV/V
+        # Small reads with a plain diagonal calibration can take the per-frame path
+        self._diagonal = np.count_nonzero(self.matrix - np.diag(np.diag(self.matrix))) == 0
+        self._factors = dict(zip(('Fx', 'Fy', 'Fz'), np.diag(self.matrix).tolist()))
+        self.stall_timeout = stall_timeout
+        self.clock = clock  # Timestamps samples; a simulated amplifier supplies its own
+        self.rate = rate  # Frames/s, to space out the samples of one read
+        self._last = None  # Timestamp of the newest sample handed out
+        self.frames = 0
+        self.resyncs = 0
+        self.dropped_bytes = 0
+        self._rx = bytearray()
+        self._gap = False  # The last read ended inside a run of skipped bytes
+        self._running = False
+        self._thread = None
+
+    def configure(self):
+        self.port.write(CMD_STOP)
+        time.sleep(0.1)
+        if hasattr(self.port, 'reset_input_buffer'):
+            self.port.reset_input_buffer()
+        self.port.write(CMD_CONFIGURE)
+        time.sleep(0.1)
+        self.port.write(CMD_START)
+        self._rx.clear()
+        self._gap = False
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=self.stall_timeout + 1)
+        try:
+            self.port.write(CMD_STOP)
+        except Exception as e:
+            logging.error(f"Error stopping sensor stream: {str(e)}")
+
+    def _run(self):
+        while self._running:
+            try:
+                self.configure()
+                last_data = time.monotonic()
+                while self._running:
+                    started = time.perf_counter()
+                    chunk = self.port.read(max(getattr(self.port, 'in_waiting', 0), FRAME_SIZE))
+                    SERIAL_READ.observe(time.perf_counter() - started, rig=self.name)
+                    if chunk:
+                        last_data = time.monotonic()
+                        samples = self.feed(chunk)
+                        if samples:
+                            self.buffer.publish(samples)
+                    elif time.monotonic() - last_data > self.stall_timeout:
+                        SENSOR_STALLS.inc(rig=self.name)
+                        log_throttled(f"sensor-stall-{self.name}", logging.WARNING,
+                                      f"Sensor stream on rig {self.name} stalled, reconfiguring amplifier")
+                        break
+            except Exception as e:
+                log_throttled(f"sensor-error-{self.name}", logging.ERROR, f"Error in sensor stream: {str(e)}")
+                time.sleep(1)
+
+    def feed(self, data):
+        rx = self._rx
+        rx += data
+        now = self.clock()
+        if len(rx) >= BATCH_MIN_BYTES or self.zero_offset is not None or not self._diagonal:
+            forces, consumed, resyncs, dropped, self._gap = parse_frames_batch(rx, self.matrix, self.zero_offset,
+                                                                              self._gap)
+            forces = forces.tolist()
+        else:
+            forces, consumed, resyncs, dropped, self._gap = parse_frames(rx, self._factors, self._gap)
+        del rx[:consumed]
+        self.resyncs += resyncs
+        self.dropped_bytes += dropped
+        self.frames += len(forces)
+        SENSOR_FRAMES.inc(len(forces), rig=self.name)
+        if resyncs:
+            SENSOR_RESYNCS.inc(resyncs, rig=self.name)
+            SENSOR_DROPPED.inc(dropped, rig=self.name)
+        if not forces:
+            return []
+        # A read returns every frame that arrived since the last one, so the newest gets the clock and the older
+        # ones are back-dated a frame period apiece; should that reach back past the previous read (the amplifier
+        # ran fast, or the reads bunched up), the frames are spread evenly over the time since then instead
+        step = 1.0 / self.rate
+        first = now - (len(forces) - 1) * step
+        if self._last is not None and first <= self._last < now:
+            step = (now - self._last) / len(forces)
+            first = self._last + step
+        self._last = now
+        return [(first + i * step, fx, fy, fz) for i, (fx, fy, fz) in enumerate(forces)]
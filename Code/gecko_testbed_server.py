@@ -0,0 +1,119 @@
+import io
+import os
+import time
+import select
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+SERVER_THREADS = int(os.environ.get('GECKO_SERVER_THREADS', 64))  # Requests handled at once
+LISTEN_BACKLOG = 1024  # Connections the kernel queues while every worker is busy; Werkzeug's default is 128
+REQUEST_TIMEOUT = 30.0  # Seconds a worker waits on a silent client in the middle of a request
+KEEPALIVE_TIMEOUT = 5.0  # Seconds an idle kept-alive connection may hold its worker before it is closed
+
+
+class PooledRequestHandler(WSGIRequestHandler):
+    # HTTP/1.1 with keep-alive, so the client's and UI's persistent sessions reuse their connections. A kept-alive
+    # connection only holds its worker while requests keep coming: it is closed after KEEPALIVE_TIMEOUT of silence,
+    # or straight away once other connections are waiting for a worker.
+    protocol_version = 'HTTP/1.1'
+    timeout = REQUEST_TIMEOUT
+    keep_alive = False
+    served = 0
+
+    def handle_one_request(self):
+        if self.served and not self._next_request():
+            self.close_connection = True
+            return
+        self.served += 1
+        super().handle_one_request()
+
+    def _next_request(self):
+        deadline = time.monotonic() + KEEPALIVE_TIMEOUT
+        while not self.server.saturated and not self.server.closing:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if select.select([self.connection], [], [], min(remaining, 0.1))[0]:
+                return True
+        return False
+
+    def run_wsgi(self):
+        # Werkzeug closes every connection, and after each response drains whatever is left on the socket, which
+        # on a kept-alive connection would swallow the client's next request. So the body is read up front and
+        # the app (and the drain) get a buffer instead. Bodies announced with 100-continue or sent chunked take
+        # Werkzeug's own path and close the connection afterwards.
+        length = self.headers.get('Content-Length')
+        self.keep_alive = (self.request_version == 'HTTP/1.1' and not self.close_connection
+                           and not self.server.saturated and not self.server.closing
+                           and 'Transfer-Encoding' not in self.headers
+                           and self.headers.get('Expect', '').lower() != '100-continue')
+        if not self.keep_alive:
+            return super().run_wsgi()
+        rfile = self.rfile
+        self.rfile = io.BytesIO(rfile.read(int(length)) if length else b'')
+        try:
+            super().run_wsgi()
+        finally:
+            self.rfile = rfile
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'connection' and self.keep_alive:
+            value = 'keep-alive'
+        super().send_header(keyword, value)
+
+
+# Werkzeug's threaded server starts a thread per connection with no upper bound. This one hands each accepted
+# connection to a fixed pool, and the per-thread SQLite readers the rigs keep are reused across requests instead
+# of reopened for every connection. Connections are only accepted while a worker is free, so a burst of clients
+# waits in the kernel's listen backlog rather than in an unbounded queue here.
+class PooledWSGIServer(BaseWSGIServer):
+    multithread = True
+    request_queue_size = LISTEN_BACKLOG
+
+    def __init__(self, host, port, app, threads=SERVER_THREADS, **kwargs):
+        kwargs.setdefault('handler', PooledRequestHandler)
+        super().__init__(host, port, app, **kwargs)
+        self.threads = threads
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='gecko-http')
+        self.slots = threading.BoundedSemaphore(threads)
+        self.saturated = False  # Set while a connection waits for a worker; kept-alive connections then let go
+        self.closing = False
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            self.saturated = True
+            while not self.slots.acquire(timeout=0.1):
+                if self.closing:
+                    self.shutdown_request(request)
+                    return
+            self.saturated = False
+        self.executor.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def shutdown(self):
+        self.closing = True
+        super().shutdown()
+
+    def server_close(self):
+        self.closing = True
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def serve(app, host='0.0.0.0', port=5000, threads=SERVER_THREADS):
+    server = PooledWSGIServer(host, port, app, threads=threads)
+    logging.info(f"Serving on http://{host}:{server.server_port} with {threads} worker threads")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
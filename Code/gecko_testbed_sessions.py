@@ -0,0 +1,113 @@
+import json
+import time
+import threading
+from gecko_testbed_storage import connect, format_timestamp
+
+SESSION_KINDS = ('idle', 'test', 'automation')
+SESSION_KEYS = ("id", "kind", "name", "notes", "pinned", "status", "started_at", "ended_at")
+
+
+# Every stored sample belongs to a session. An idle session is always open when nothing else is, so the
+# rig keeps a record of what it measured between tests and retention can treat the two differently.
+class SessionStore:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.current = None  # {"id", "kind"} of the open session; swapped whole so readers never see half of it
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.create_tables()
+        self.start('idle', "Idle")
+
+    def create_tables(self):
+        conn = connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''CREATE TABLE IF NOT EXISTS sessions
+                         (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                          kind TEXT, name TEXT, notes TEXT, pinned INTEGER DEFAULT 0,
+                          status TEXT, started_at DATETIME, ended_at DATETIME)''')
+        # Sessions left open by a restart end with their last stored sample
+        cursor.execute('''UPDATE sessions SET status = 'interrupted',
+                          ended_at = COALESCE((SELECT MAX(timestamp) FROM test_results
+                                               WHERE session_id = sessions.id), started_at)
+                          WHERE status = 'open' ''')
+        conn.commit()
+        conn.close()
+
+    def reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = connect(self.db_path)
+        return conn
+
+    def start(self, kind, name=None, notes=None, pinned=False):
+        # Closes whatever session is open; samples stored from now on belong to the new one
+        if kind not in SESSION_KINDS:
+            raise ValueError(f"Unknown session kind {kind}")
+        with self._lock:
+            return self._open(kind, name, notes, pinned)
+
+    def end(self, session_id):
+        # Only the open, non-idle session can be ended; the rig drops back to a fresh idle session
+        with self._lock:
+            if self.current["id"] != session_id or self.current["kind"] == 'idle':
+                return False
+            self._open('idle', "Idle")
+            return True
+
+    def _open(self, kind, name=None, notes=None, pinned=False):
+        # Callers hold _lock, so checking the open session and replacing it happen as one step
+        conn = self.reader()
+        now = format_timestamp(time.time())
+        with conn:
+            if self.current is not None:
+                conn.execute("UPDATE sessions SET status = 'closed', ended_at = ? WHERE id = ?",
+                             (now, self.current["id"]))
+            cursor = conn.execute('''INSERT INTO sessions (kind, name, notes, pinned, status, started_at)
+                                     VALUES (?, ?, ?, ?, 'open', ?)''',
+                                  (kind, name, json.dumps(notes) if notes is not None else None, int(pinned), now))
+        self.current = {"id": cursor.lastrowid, "kind": kind}
+        return cursor.lastrowid
+
+    def get(self, session_id, counts=False):
+        # The row counts scan the session's data, so only the single-session view asks for them
+        conn = self.reader()
+        row = conn.execute(f"SELECT {', '.join(SESSION_KEYS)} FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        session = session_from_row(row)
+        if counts:
+            session["raw_rows"] = conn.execute("SELECT COUNT(*) FROM test_results WHERE session_id = ?",
+                                               (session_id,)).fetchone()[0]
+            session["rollup_buckets"] = conn.execute("SELECT COUNT(*) FROM test_results_rollup WHERE session_id = ?",
+                                                     (session_id,)).fetchone()[0]
+            archives, archived_rows = conn.execute('''SELECT COUNT(*), COALESCE(SUM(rows), 0) FROM result_archives
+                                                      WHERE session_id = ?''', (session_id,)).fetchone()
+            session["archives"] = archives
+            session["archived_rows"] = archived_rows
+        return session
+
+    def recent(self, limit=20, kind=None):
+        query = f"SELECT {', '.join(SESSION_KEYS)} FROM sessions"
+        params = []
+        if kind is not None:
+            query += " WHERE kind = ?"
+            params.append(kind)
+        rows = self.reader().execute(f"{query} ORDER BY id DESC LIMIT ?", params + [limit]).fetchall()
+        return [session_from_row(row) for row in rows]
+
+    def delete(self, session_id):
+        # Marks a finished session for removal; the compactor purges its rows and archives in bounded batches
+        if self.current["id"] == session_id:
+            return False
+        conn = self.reader()
+        with conn:
+            cursor = conn.execute("UPDATE sessions SET status = 'deleting' WHERE id = ? AND status != 'open'",
+                                  (session_id,))
+        return cursor.rowcount > 0
+
+
+def session_from_row(row):
+    session = dict(zip(SESSION_KEYS, row))
+    session["notes"] = json.loads(session["notes"]) if session["notes"] else None
+    session["pinned"] = bool(session["pinned"])
+    return session
@@ -0,0 +1,131 @@
+import sqlite3
+import calendar
+import queue
+import threading
+import time
+import logging
+from gecko_testbed_metrics import WRITER_COMMIT, WRITER_ERRORS, WRITER_ROWS, log_throttled
+
+_STOP = object()
+
+
+def connect(db_path, timeout=5.0):
+    conn = sqlite3.connect(db_path, timeout=timeout)
+    # WAL lets readers run alongside the writer; NORMAL only fsyncs at checkpoints
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def create_results_table(conn):
+    # Also brings older databases up to date; their rows keep a NULL session_id and Z position
+    conn.execute('''CREATE TABLE IF NOT EXISTS test_results
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     fx REAL, fy REAL, fz REAL,
+                     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                     session_id INTEGER, z REAL)''')
+    columns = [column[1] for column in conn.execute("PRAGMA table_info(test_results)")]
+    if 'session_id' not in columns:
+        conn.execute("ALTER TABLE test_results ADD COLUMN session_id INTEGER")
+    if 'z' not in columns:
+        conn.execute("ALTER TABLE test_results ADD COLUMN z REAL")  # Z stage position in mm
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_test_results_timestamp ON test_results (timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_test_results_session ON test_results (session_id, timestamp)")
+    conn.commit()
+
+
+def format_timestamp(t):
+    # Same layout as SQLite's CURRENT_TIMESTAMP, with milliseconds
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t)) + f".{int(t % 1 * 1000):03d}"
+
+
+def parse_timestamp(value):
+    # Inverse of format_timestamp, back to epoch seconds
+    base, _, fraction = str(value).partition('.')
+    return calendar.timegm(time.strptime(base, '%Y-%m-%d %H:%M:%S')) + (float('0.' + fraction) if fraction else 0.0)
+
+
+# Drains queued samples on its own connection and inserts them in bounded batches
+class ResultWriter:
+    def __init__(self, db_path, max_batch=500, max_delay=0.25, name='default'):
+        self.db_path = db_path
+        self.name = name  # Rig label on the exported metrics
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.rows_written = 0
+        self.last_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self.queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, fx, fy, fz, timestamp=None, session_id=None, z=None):
+        self.queue.put((fx, fy, fz, format_timestamp(time.time() if timestamp is None else timestamp), session_id, z))
+
+    def _run(self):
+        conn = connect(self.db_path)
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                running = False
+                batch = [row for row in batch if row is not _STOP]
+                while not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+            if batch:
+                self._flush(conn, batch)
+        conn.close()
+
+    def _flush(self, conn, batch):
+        start = time.perf_counter()
+        try:
+            with conn:
+                conn.executemany('''INSERT INTO test_results (fx, fy, fz, timestamp, session_id, z)
+                                    VALUES (?, ?, ?, ?, ?, ?)''', batch)
+        except Exception as e:
+            WRITER_ERRORS.inc(rig=self.name)
+            log_throttled(f"writer-{self.name}", logging.ERROR, f"Error storing {len(batch)} results: {str(e)}")
+            return
+        elapsed = time.perf_counter() - start
+        WRITER_COMMIT.observe(elapsed, rig=self.name)
+        WRITER_ROWS.inc(len(batch), rig=self.name)
+        elapsed_ms = elapsed * 1000
+        self.batches += 1
+        self.rows_written += len(batch)
+        self.last_batch_size = len(batch)
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "batches": self.batches,
+            "rows_written": self.rows_written,
+            "last_batch_size": self.last_batch_size,
+            "avg_batch_size": self.rows_written / self.batches if self.batches else 0.0,
+            "last_flush_ms": self.last_flush_ms,
+            "max_flush_ms": self.max_flush_ms,
+            "avg_flush_ms": self.total_flush_ms / self.batches if self.batches else 0.0,
+        }
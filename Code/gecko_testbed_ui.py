@@ -1,17 +1,184 @@
 import sys
-from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QLineEdit, QTableWidget, QTableWidgetItem, QProgressBar
-from PyQt5.QtCore import Qt, QTimer
-from PyQt5.QtGui import QFont, QFontDatabase, QPalette, QColor
-import requests
+from collections import deque
+from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QLineEdit, QTableView, QHeaderView, QProgressBar
+from PyQt5.QtCore import Qt, QTimer, QAbstractTableModel, QModelIndex, QPointF
+from PyQt5.QtGui import QFont, QFontDatabase, QPalette, QColor, QPainter, QPen, QPolygonF
 import logging
+from gecko_testbed_client import BULK_HEADERS, ApiClient, ForceStream
+from gecko_testbed_wire import timestamps
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
+RESULTS_POLL_LIMIT = 1000  # Max new rows pulled per request; a full page is followed up straight away
+RESULTS_PAGE_SIZE = 500  # Rows per history page when scrolling back
+RESULTS_WINDOW = 5000  # Rows kept in memory by the table model
+POLL_TIMEOUT = 2.0  # Seconds
+MOVE_TIMEOUT = 120.0
+AUTOMATION_POLL_MS = 500
+STREAM_RATE = 60  # Samples/s requested from /stream for the live view
+PLOT_POINTS = 600  # Samples shown in the live plot
+
+def columnar_rows(data):
+    # Packed responses arrive as NumPy arrays; float32 scalars print at their own precision, so only ids are converted
+    ids = data['id'].tolist() if hasattr(data['id'], 'tolist') else data['id']
+    return list(zip(ids, data['fx'], data['fy'], data['fz'], timestamps(data['timestamp'])))
+
+# Bounded window over test_results, newest row first; older pages are loaded lazily on scroll. While it
+# follows the live data the oldest rows are trimmed; once history pages fill it, it stops following instead,
+# so the rows being read are never trimmed (and refetched) under the user until they scroll back to the top.
+class ResultsTableModel(QAbstractTableModel):
+    HEADERS = ["ID", "Fx (N)", "Fy (N)", "Fz (N)", "Timestamp"]
+
+    def __init__(self, fetch_history, max_rows=RESULTS_WINDOW, page_size=RESULTS_PAGE_SIZE):
+        super().__init__()
+        self.fetch_history = fetch_history
+        self.max_rows = max_rows
+        self.page_size = page_size
+        self.following = True  # False while the window is parked on history and live rows are not taken
+        self._rows = []  # Stored oldest first, displayed in reverse
+        self._history_exhausted = False
+        self._loading_history = False
+        self.generation = 0  # Bumped whenever the window is dropped, so replies to earlier requests are ignored
+
+    @property
+    def last_id(self):
+        return self._rows[-1][0] if self._rows else None
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        return str(self._rows[len(self._rows) - 1 - index.row()][index.column()])
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def append_rows(self, rows, generation=None):
+        if not self.following or generation not in (None, self.generation):
+            return
+        if self._rows:
+            rows = [row for row in rows if row[0] > self._rows[-1][0]]
+        if not rows:
+            return
+        self.beginInsertRows(QModelIndex(), 0, len(rows) - 1)
+        self._rows.extend(rows)
+        self.endInsertRows()
+        excess = len(self._rows) - self.max_rows
+        if excess > 0:
+            self.beginRemoveRows(QModelIndex(), self.max_rows, len(self._rows) - 1)
+            del self._rows[:excess]
+            self.endRemoveRows()
+            self._history_exhausted = False
+
+    def follow_live(self):
+        # Back at the top: drop the parked window so the next poll starts again from the newest rows
+        if not self.following:
+            self.restart()
+
+    def restart(self):
+        # Empties the window; pages still in flight belong to the old generation and are dropped on arrival
+        self.beginResetModel()
+        self._rows = []
+        self.following = True
+        self._history_exhausted = False
+        self._loading_history = False
+        self.generation += 1
+        self.endResetModel()
+
+    def canFetchMore(self, parent):
+        return (not parent.isValid() and bool(self._rows)
+                and not self._history_exhausted and not self._loading_history)
+
+    def fetchMore(self, parent):
+        if parent.isValid() or not self._rows or self._loading_history:
+            return
+        # The page arrives asynchronously through prepend_history
+        self._loading_history = True
+        generation = self.generation
+        if self.fetch_history(self._rows[0][0], self.page_size,
+                              lambda rows: self.prepend_history(rows, generation)) is None:
+            self._loading_history = False  # The client dropped it: a page of an earlier generation is still out
+
+    def prepend_history(self, rows, generation=None):
+        if generation not in (None, self.generation):
+            return
+        self._loading_history = False
+        if rows is None:
+            return
+        if len(rows) < self.page_size:
+            self._history_exhausted = True
+        if self._rows:
+            rows = [row for row in rows if row[0] < self._rows[0][0]]
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self._rows), len(self._rows) + len(rows) - 1)
+            self._rows[:0] = rows
+            self.endInsertRows()
+        excess = len(self._rows) - self.max_rows
+        if excess > 0:
+            # The window is full of history: give up its newest rows and stop following
+            self.beginRemoveRows(QModelIndex(), 0, excess - 1)
+            del self._rows[-excess:]
+            self.endRemoveRows()
+            self.following = False
+
+# Scrolling Fx/Fy/Fz trace drawn directly with QPainter, repainted at most ~30 times a second
+class ForcePlot(QWidget):
+    COLORS = {'Fx': '#00D4FF', 'Fy': '#00FF7F', 'Fz': '#FF4081'}
+
+    def __init__(self, points=PLOT_POINTS, parent=None):
+        super().__init__(parent)
+        self.points = points
+        self.traces = {name: deque(maxlen=points) for name in self.COLORS}
+        self.setMinimumHeight(160)
+        self._dirty = False
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self._refresh)
+        self._timer.start(33)
+
+    def add_samples(self, data):
+        for name, trace in self.traces.items():
+            trace.extend(data[name])
+        self._dirty = True
+
+    def _refresh(self):
+        if self._dirty:
+            self._dirty = False
+            self.update()
+
+    def paintEvent(self, event):
+        values = [v for trace in self.traces.values() for v in trace]
+        if not values:
+            return
+        low, high = min(values), max(values)
+        if high - low < 1e-6:
+            low, high = low - 1.0, high + 1.0
+        width, height = self.width(), self.height()
+        x_scale = width / max(self.points - 1, 1)
+        y_scale = height / (high - low)
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        for name, trace in self.traces.items():
+            offset = self.points - len(trace)
+            polygon = QPolygonF([QPointF((offset + i) * x_scale, height - (v - low) * y_scale)
+                                 for i, v in enumerate(trace)])
+            painter.setPen(QPen(QColor(self.COLORS[name]), 1.5))
+            painter.drawPolyline(polygon)
+        painter.end()
+
 class GeckoTestbedUI(QMainWindow):
-    def __init__(self):
+    def __init__(self, rig_id=None):
         super().__init__()
-        self.api_url = "http://localhost:5000"
+        # Without a rig id the UI drives the API's default rig
+        self.api_url = f"http://localhost:5000/rigs/{rig_id}" if rig_id else "http://localhost:5000"
+        self.client = ApiClient(self.api_url, parent=self)
         self.init_fonts()
         self.initUI()
 
@@ -53,7 +220,7 @@ class GeckoTestbedUI(QMainWindow):
             }
             QProgressBar { background: rgba(255, 255, 255, 0.1); border: 1px solid #00D4FF; color: #FFFFFF; }
             QProgressBar::chunk { background: #00D4FF; }
-            QTableWidget { background: rgba(255, 255, 255, 0.1); color: #FFFFFF; border: 1px solid #00D4FF; font-family: "Exo 2"; font-weight: 400; }
+            QTableView { background: rgba(255, 255, 255, 0.1); color: #FFFFFF; border: 1px solid #00D4FF; font-family: "Exo 2"; font-weight: 400; }
         """)
 
         widget = QWidget()
@@ -84,6 +251,7 @@ class GeckoTestbedUI(QMainWindow):
         self.auto_input = QLineEdit("100")
         self.auto_input.setAlignment(Qt.AlignRight)
         self.auto_button = QPushButton("Run Automation")
+        self.cancel_auto_button = QPushButton("Cancel Automation")
         self.progress = QProgressBar()
         self.progress.setValue(0)
 
@@ -115,6 +283,7 @@ class GeckoTestbedUI(QMainWindow):
         left_layout.addWidget(self.auto_input)
         left_layout.addWidget(self.progress)
         left_layout.addWidget(self.auto_button)
+        left_layout.addWidget(self.cancel_auto_button)
         left_layout.addWidget(self.align_label)
         left_layout.addWidget(self.x_label)
         left_layout.addWidget(self.x_input)
@@ -138,14 +307,20 @@ class GeckoTestbedUI(QMainWindow):
         self.fx_label = QLabel("Fx: -- N")
         self.fy_label = QLabel("Fy: -- N")
         self.fz_label = QLabel("Fz: -- N")
-        self.data_table = QTableWidget()
-        self.data_table.setColumnCount(5)
-        self.data_table.setHorizontalHeaderLabels(["ID", "Fx (N)", "Fy (N)", "Fz (N)", "Timestamp"])
+        self.force_plot = ForcePlot()
+        self.results_model = ResultsTableModel(self.fetch_history)
+        self.catch_up_pages = 0  # Full /results pages in a row; the table is that far behind the live data
+        self.data_table = QTableView()
+        self.data_table.setModel(self.results_model)
+        self.data_table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.data_table.verticalHeader().setVisible(False)
+        self.data_table.verticalScrollBar().valueChanged.connect(self.on_table_scrolled)
 
         right_layout.addWidget(self.force_label)
         right_layout.addWidget(self.fx_label)
         right_layout.addWidget(self.fy_label)
         right_layout.addWidget(self.fz_label)
+        right_layout.addWidget(self.force_plot)
         right_layout.addWidget(self.data_table)
         right_layout.addStretch()
 
@@ -156,6 +331,7 @@ class GeckoTestbedUI(QMainWindow):
         self.push_button.clicked.connect(self.apply_push)
         self.pull_button.clicked.connect(self.apply_pull)
         self.auto_button.clicked.connect(self.run_automation)
+        self.cancel_auto_button.clicked.connect(self.cancel_automation)
         self.x_button.clicked.connect(self.move_x)
         self.y_button.clicked.connect(self.move_y)
         self.z_button.clicked.connect(self.move_z)
@@ -166,177 +342,234 @@ class GeckoTestbedUI(QMainWindow):
         self.timer.timeout.connect(self.update_data)
         self.timer.start(1000)  # Update every 1 second
 
+        # Progress polling for the running automation job
+        self.automation_job = None
+        self.automation_timer = QTimer()
+        self.automation_timer.timeout.connect(self.poll_automation)
+
+        # Live forces are pushed by the API instead of polled
+        self.force_stream = ForceStream(self.api_url, rate=STREAM_RATE, parent=self)
+        self.force_stream.samples.connect(self.on_stream_samples)
+        self.force_stream.start()
+
     def update_data(self):
-        try:
-            logging.debug(f"Fetching data from {self.api_url}/results")
-            response = requests.get(f"{self.api_url}/results")
+        # Polls are keyed, so a tick is skipped while the previous poll is still in flight
+        if not self.results_model.following:
+            return
+        logging.debug(f"Fetching data from {self.api_url}/results")
+        params = {"format": "columnar", "limit": RESULTS_POLL_LIMIT}
+        if self.results_model.last_id is not None:
+            params["since_id"] = self.results_model.last_id
+        generation = self.results_model.generation
+        self.client.get("/results", lambda response: self.on_results(response, generation), self.on_poll_error,
+                        params=params, key="results", timeout=POLL_TIMEOUT, headers=BULK_HEADERS)
+
+    def on_results(self, response, generation=None):
+        if response.status_code == 200:
+            data = response.data
+            if isinstance(data, dict) and 'id' in data:
+                rows = columnar_rows(data)
+                self.results_model.append_rows(rows, generation)
+                logging.debug(f"Data updated successfully: {len(rows)} new rows")
+                if len(rows) < RESULTS_POLL_LIMIT or generation != self.results_model.generation:
+                    self.catch_up_pages = 0
+                    return
+                # A full page means more rows are waiting, so the next one is fetched now rather than a tick
+                # later. Once the backlog is more than the window keeps anyway, skip straight to the newest rows.
+                self.catch_up_pages += 1
+                if self.catch_up_pages * RESULTS_POLL_LIMIT >= RESULTS_WINDOW:
+                    logging.warning(f"Results view fell {self.catch_up_pages * RESULTS_POLL_LIMIT}+ rows behind, "
+                                    f"jumping to the newest rows")
+                    self.catch_up_pages = 0
+                    self.results_model.restart()
+                self.update_data()
+            else:
+                logging.error(f"Unexpected data format: {data}")
+                self.push_result.setText("Error: Unexpected data format")
+        else:
+            logging.error(f"API returned status code: {response.status_code}, text: {response.text}")
+            self.push_result.setText(f"Error: API request failed (Status: {response.status_code})")
+
+    def on_stream_samples(self, data):
+        if data['Fz']:
+            self.fx_label.setText(f"Fx: {data['Fx'][-1]:.2f} N")
+            self.fy_label.setText(f"Fy: {data['Fy'][-1]:.2f} N")
+            self.fz_label.setText(f"Fz: {data['Fz'][-1]:.2f} N")
+            self.force_plot.add_samples(data)
+
+    def on_poll_error(self, error):
+        logging.error(f"Error updating data: {error}")
+        self.push_result.setText(f"Error: {error}")
+
+    def on_table_scrolled(self, value):
+        if value == self.data_table.verticalScrollBar().minimum():
+            self.results_model.follow_live()
+
+    def fetch_history(self, before_id, limit, callback):
+        def on_history(response):
             if response.status_code == 200:
-                data = response.json()
-                if isinstance(data, list):
-                    self.data_table.setRowCount(len(data))
-                    for i, row in enumerate(data):
-                        self.data_table.setItem(i, 0, QTableWidgetItem(str(row.get('id', ''))))
-                        self.data_table.setItem(i, 1, QTableWidgetItem(str(row.get('fx', ''))))
-                        self.data_table.setItem(i, 2, QTableWidgetItem(str(row.get('fy', ''))))
-                        self.data_table.setItem(i, 3, QTableWidgetItem(str(row.get('fz', ''))))
-                        self.data_table.setItem(i, 4, QTableWidgetItem(str(row.get('timestamp', ''))))
-                    logging.debug(f"Data updated successfully: {len(data)} rows")
-                else:
-                    logging.error(f"Unexpected data format: {data}")
-                    self.push_result.setText("Error: Unexpected data format")
+                callback(columnar_rows(response.data))
             else:
-                logging.error(f"API returned status code: {response.status_code}, text: {response.text}")
-                self.push_result.setText(f"Error: API request failed (Status: {response.status_code})")
-
-            # Update live force readings
-            force_response = requests.get(f"{self.api_url}/force")
-            if force_response.status_code == 200:
-                force_data = force_response.json()
-                self.fx_label.setText(f"Fx: {force_data.get('Fx', '--')} N")
-                self.fy_label.setText(f"Fy: {force_data.get('Fy', '--')} N")
-                self.fz_label.setText(f"Fz: {force_data.get('Fz', '--')} N")
+                logging.error(f"History fetch failed: {response.text}")
+                callback(None)
+
+        def on_error(error):
+            logging.error(f"Exception in fetch_history: {error}")
+            callback(None)
+
+        return self.client.get("/results", on_history, on_error, key="history", headers=BULK_HEADERS,
+                               params={"format": "columnar", "before_id": before_id, "limit": limit})
+
+    def show_force_result(self, label, name, response):
+        if response.status_code == 200:
+            data = response.data
+            if 'result' in data and data['result'] is None:
+                # The job finished without reporting a force
+                label.setText("Result: --")
+                logging.warning(f"{name} finished without a force result")
+            elif 'result' in data:
+                label.setText(f"Result: {data['result']:.2f} N")
+                logging.debug(f"{name} force applied: {data['result']:.2f} N")
+            elif 'error' in data:
+                label.setText(f"Error: {data['error']}")
+                logging.error(f"API error: {data['error']}")
             else:
-                logging.error(f"Force API error: {force_response.text}")
-        except Exception as e:
-            logging.error(f"Error updating data: {str(e)}")
-            self.push_result.setText(f"Error: {str(e)}")
+                label.setText("Error: Unknown response format")
+                logging.error("Unknown API response format")
+        else:
+            logging.error(f"API returned status code: {response.status_code}, text: {response.text}")
+            error = response.data.get('error') if isinstance(response.data, dict) else None
+            label.setText(f"Error: {error}" if error else f"Error: API request failed (Status: {response.status_code})")
 
     def apply_push(self):
         try:
             logging.debug(f"Applying push force: {self.push_input.text()}")
             force = float(self.push_input.text())
-            response = requests.post(f"{self.api_url}/apply_push", json={"force": force})
-            if response.status_code == 200:
-                data = response.json()
-                if 'result' in data:
-                    self.push_result.setText(f"Result: {data['result']:.2f} N")
-                    logging.debug(f"Push force applied: {data['result']:.2f} N")
-                elif 'error' in data:
-                    self.push_result.setText(f"Error: {data['error']}")
-                    logging.error(f"API error: {data['error']}")
-                else:
-                    self.push_result.setText("Error: Unknown response format")
-                    logging.error("Unknown API response format")
-            else:
-                logging.error(f"API returned status code: {response.status_code}, text: {response.text}")
-                self.push_result.setText(f"Error: API request failed (Status: {response.status_code})")
+            self.client.post("/apply_push",
+                             lambda response: self.show_force_result(self.push_result, "Push", response),
+                             lambda error: self.show_request_error(self.push_result, "apply_push", error),
+                             json={"force": force}, key="push", timeout=MOVE_TIMEOUT)
         except Exception as e:
-            logging.error(f"Exception in apply_push: {str(e)}")
-            self.push_result.setText(f"Error: {str(e)}")
+            self.show_request_error(self.push_result, "apply_push", str(e))
 
     def apply_pull(self):
         try:
             logging.debug(f"Applying pull force: {self.pull_input.text()}")
             force = float(self.pull_input.text())
-            response = requests.post(f"{self.api_url}/apply_pull", json={"force": force})
-            if response.status_code == 200:
-                data = response.json()
-                if 'result' in data:
-                    self.pull_result.setText(f"Result: {data['result']:.2f} N")
-                    logging.debug(f"Pull force applied: {data['result']:.2f} N")
-                elif 'error' in data:
-                    self.push_result.setText(f"Error: {data['error']}")
-                    logging.error(f"API error: {data['error']}")
-                else:
-                    self.push_result.setText("Error: Unknown response format")
-                    logging.error("Unknown API response format")
-            else:
-                logging.error(f"API returned status code: {response.status_code}, text: {response.text}")
-                self.pull_result.setText(f"Error: API request failed (Status: {response.status_code})")
+            self.client.post("/apply_pull",
+                             lambda response: self.show_force_result(self.pull_result, "Pull", response),
+                             lambda error: self.show_request_error(self.pull_result, "apply_pull", error),
+                             json={"force": force}, key="pull", timeout=MOVE_TIMEOUT)
         except Exception as e:
-            logging.error(f"Exception in apply_pull: {str(e)}")
-            self.pull_result.setText(f"Error: {str(e)}")
+            self.show_request_error(self.pull_result, "apply_pull", str(e))
+
+    def show_request_error(self, label, name, error):
+        logging.error(f"Exception in {name}: {error}")
+        label.setText(f"Error: {error}")
 
     def run_automation(self):
         try:
             logging.debug(f"Running automation with steps: {self.auto_input.text()}")
             steps = int(self.auto_input.text())
             self.progress.setMaximum(steps)
-            response = requests.post(f"{self.api_url}/automate", json={"steps": steps, "push_force": 10, "pull_force": 50})
-            if response.status_code == 200:
-                data = response.json()
-                if 'results' in data:
-                    results = data['results']
-                    self.progress.setValue(steps)
-                    self.push_result.setText(f"Last Push: {results[-1]['push_result']:.2f} N")
-                    self.pull_result.setText(f"Last Pull: {results[-1]['pull_result']:.2f} N")
-                    logging.debug(f"Automation completed: {len(results)} steps")
-                elif 'error' in data:
-                    self.push_result.setText(f"Error: {data['error']}")
-                    logging.error(f"API error: {data['error']}")
-                else:
-                    self.push_result.setText("Error: Unknown response format")
-                    logging.error("Unknown API response format")
-            else:
-                logging.error(f"API returned status code: {response.status_code}, text: {response.text}")
-                self.push_result.setText(f"Error: API request failed (Status: {response.status_code})")
+            self.progress.setValue(0)
+            self.client.post("/automate", self.on_automation_submitted,
+                             lambda error: self.show_request_error(self.push_result, "run_automation", error),
+                             json={"steps": steps, "push_force": 10, "pull_force": 50}, key="automate")
         except Exception as e:
-            logging.error(f"Exception in run_automation: {str(e)}")
-            self.push_result.setText(f"Error: {str(e)}")
+            self.show_request_error(self.push_result, "run_automation", str(e))
 
-    def move_x(self):
+    def on_automation_submitted(self, response):
+        if response.status_code == 202 and 'id' in (response.data or {}):
+            self.automation_job = response.data['id']
+            self.automation_timer.start(AUTOMATION_POLL_MS)
+            logging.debug(f"Automation job {self.automation_job} submitted")
+        elif response.data and 'error' in response.data:
+            self.push_result.setText(f"Error: {response.data['error']}")
+            logging.error(f"API error: {response.data['error']}")
+        else:
+            logging.error(f"API returned status code: {response.status_code}, text: {response.text}")
+            self.push_result.setText(f"Error: API request failed (Status: {response.status_code})")
+
+    def poll_automation(self):
+        if self.automation_job is not None:
+            self.client.get(f"/automate/{self.automation_job}", self.on_automation_status,
+                            lambda error: logging.error(f"Exception in poll_automation: {error}"),
+                            key="automation_status", timeout=POLL_TIMEOUT)
+
+    def on_automation_status(self, response):
+        if response.status_code != 200:
+            logging.error(f"Automation status failed: {response.text}")
+            return
+        job = response.data
+        self.progress.setValue(job['cycles_done'])
+        last = job.get('last_result')
+        if last:
+            self.push_result.setText(f"Last Push: {last['push_result']:.2f} N")
+            self.pull_result.setText(f"Last Pull: {last['pull_result']:.2f} N")
+        if job['status'] not in ('queued', 'running'):
+            self.automation_timer.stop()
+            self.automation_job = None
+            if job['status'] == 'failed':
+                self.push_result.setText(f"Error: {job.get('error')}")
+            logging.debug(f"Automation {job['status']}: {job['cycles_done']} steps")
+
+    def cancel_automation(self):
+        if self.automation_job is not None:
+            self.client.post(f"/automate/{self.automation_job}/cancel", None,
+                             lambda error: logging.error(f"Exception in cancel_automation: {error}"),
+                             key="automation_cancel")
+
+    def move_to(self, axis, position_input, limit):
         try:
-            logging.debug(f"Moving X to: {self.x_input.text()}")
-            position = float(self.x_input.text())
-            if 0 <= position <= 100:  # Range limit
-                response = requests.post(f"{self.api_url}/move/X", json={"position": position})
-                if response.status_code == 200:
-                    data = response.json()
-                    if 'status' in data:
-                        logging.debug(f"X moved to {position} mm")
-                else:
-                    logging.error(f"Move X failed: {response.text}")
+            logging.debug(f"Moving {axis} to: {position_input.text()}")
+            position = float(position_input.text())
+            if 0 <= position <= limit:  # Range limit
+                self.client.post(f"/move/{axis}",
+                                 lambda response: self.on_move(axis, position, response),
+                                 lambda error: logging.error(f"Exception in move_{axis.lower()}: {error}"),
+                                 json={"position": position}, key=f"move_{axis}", timeout=MOVE_TIMEOUT)
             else:
-                logging.error("X position out of range (0-100 mm)")
+                logging.error(f"{axis} position out of range (0-{limit} mm)")
         except Exception as e:
-            logging.error(f"Exception in move_x: {str(e)}")
+            logging.error(f"Exception in move_{axis.lower()}: {str(e)}")
+
+    def on_move(self, axis, position, response):
+        if response.status_code == 200:
+            if 'status' in (response.data or {}):
+                logging.debug(f"{axis} moved to {position} mm")
+        else:
+            logging.error(f"Move {axis} failed: {response.text}")
+
+    def move_x(self):
+        self.move_to('X', self.x_input, 100)
 
     def move_y(self):
-        try:
-            logging.debug(f"Moving Y to: {self.y_input.text()}")
-            position = float(self.y_input.text())
-            if 0 <= position <= 50:  # Range limit
-                response = requests.post(f"{self.api_url}/move/Y", json={"position": position})
-                if response.status_code == 200:
-                    data = response.json()
-                    if 'status' in data:
-                        logging.debug(f"Y moved to {position} mm")
-                else:
-                    logging.error(f"Move Y failed: {response.text}")
-            else:
-                logging.error("Y position out of range (0-50 mm)")
-        except Exception as e:
-            logging.error(f"Exception in move_y: {str(e)}")
+        self.move_to('Y', self.y_input, 50)
 
     def move_z(self):
-        try:
-            logging.debug(f"Moving Z to: {self.z_input.text()}")
-            position = float(self.z_input.text())
-            if 0 <= position <= 30:  # Range limit
-                response = requests.post(f"{self.api_url}/move/Z", json={"position": position})
-                if response.status_code == 200:
-                    data = response.json()
-                    if 'status' in data:
-                        logging.debug(f"Z moved to {position} mm")
-                else:
-                    logging.error(f"Move Z failed: {response.text}")
-            else:
-                logging.error("Z position out of range (0-30 mm)")
-        except Exception as e:
-            logging.error(f"Exception in move_z: {str(e)}")
+        self.move_to('Z', self.z_input, 30)
 
     def reset_alignment(self):
-        try:
-            logging.debug("Resetting alignment to (0, 0, 0)")
-            for axis in ['X', 'Y', 'Z']:
-                response = requests.post(f"{self.api_url}/move/{axis}", json={"position": 0})
-                if response.status_code != 200:
-                    logging.error(f"Reset {axis} failed: {response.text}")
-        except Exception as e:
-            logging.error(f"Exception in reset_alignment: {str(e)}")
+        # One coordinated move: all axes travel together instead of one after another
+        logging.debug("Resetting alignment to (0, 0, 0)")
+        self.client.post("/move", self.on_reset,
+                         lambda error: logging.error(f"Exception in reset_alignment: {error}"),
+                         json={"x": 0, "y": 0, "z": 0}, key="move_all", timeout=MOVE_TIMEOUT)
+
+    def on_reset(self, response):
+        if response.status_code != 200:
+            logging.error(f"Reset alignment failed: {response.text}")
+
+    def closeEvent(self, event):
+        self.timer.stop()
+        self.automation_timer.stop()
+        self.force_stream.stop()
+        self.client.shutdown()
+        super().closeEvent(event)
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
-    window = GeckoTestbedUI()
+    window = GeckoTestbedUI(sys.argv[1] if len(sys.argv) > 1 else None)
     window.show()
     sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,99 @@
+import gzip
+import json
+import struct
+import numpy as np
+from gecko_testbed_recording import ns_to_timestamps, timestamps_to_ns
+
+try:
+    import zstandard
+except ImportError:  # Optional; gzip is always available
+    zstandard = None
+
+# Packed column format for bulk responses:
+#   magic, u8 version, 3 pad bytes, u32 header length, JSON header, then one little-endian array per column.
+# The header lists rows, (name, dtype) per column and any scalar fields; everything is padded to 8 bytes
+# so the client can view each column in place with np.frombuffer.
+PACKED_MEDIA_TYPE = 'application/vnd.gecko.columns'
+MAGIC = b'GKCO'
+VERSION = 1
+PREFIX = struct.Struct('<4sB3xI')
+ALIGN = 8
+MIN_COMPRESS_BYTES = 1400  # Below about one packet compression costs more than it saves
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+ENCODINGS = ('zstd', 'gzip') if zstandard is not None else ('gzip',)  # In order of preference
+
+# Column name -> wire dtype for each bulk payload; 'ts' columns are timestamp strings sent as epoch ns
+RESULT_COLUMNS = {'id': '<i8', 'fx': '<f4', 'fy': '<f4', 'fz': '<f4', 'timestamp': 'ts'}
+CYCLE_COLUMNS = {'cycle': '<i8', 'push_result': '<f4', 'pull_result': '<f4', 'started_at': 'ts', 'finished_at': 'ts'}
+
+
+def _padding(length):
+    return b'\0' * (-length % ALIGN)
+
+
+def to_arrays(data, layout):
+    # Columnar dict of lists, as the JSON endpoints build it, into typed arrays
+    return {name: timestamps_to_ns([str(value) for value in data[name]]) if dtype == 'ts'
+            else np.asarray(data[name], dtype=dtype) for name, dtype in layout.items()}
+
+
+def encode_columns(columns, meta=None):
+    arrays = [(name, np.ascontiguousarray(values, dtype=np.asarray(values).dtype.newbyteorder('<')))
+              for name, values in columns.items()]
+    rows = len(arrays[0][1]) if arrays else 0
+    if any(len(values) != rows for _, values in arrays):
+        raise ValueError("All columns must have the same length")
+    header = json.dumps({"rows": rows, "columns": [[name, values.dtype.str] for name, values in arrays],
+                         "meta": meta or {}}).encode()
+    parts = [PREFIX.pack(MAGIC, VERSION, len(header)), header, _padding(PREFIX.size + len(header))]
+    for _, values in arrays:
+        data = values.tobytes()
+        parts += [data, _padding(len(data))]
+    return b''.join(parts)
+
+
+def decode_columns(payload):
+    # Returns the scalar fields and columns in one dict; columns are read-only views onto the payload
+    magic, version, header_len = PREFIX.unpack_from(payload)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a packed column payload")
+    header = json.loads(bytes(payload[PREFIX.size:PREFIX.size + header_len]))
+    offset = PREFIX.size + header_len
+    offset += -offset % ALIGN
+    data = dict(header["meta"])
+    rows = header["rows"]
+    for name, dtype in header["columns"]:
+        values = np.frombuffer(payload, dtype=dtype, count=rows, offset=offset)
+        data[name] = values
+        offset += values.nbytes + (-values.nbytes % ALIGN)
+    return data
+
+
+def timestamps(values):
+    # Packed timestamps are epoch ns; JSON ones are already strings
+    return ns_to_timestamps(values) if isinstance(values, np.ndarray) else values
+
+
+def choose_encoding(accepted):
+    # accepted is any container of content codings the client listed
+    for encoding in ENCODINGS:
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    return data
+
+
+def decompress(data, encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    if encoding == 'gzip':
+        return gzip.decompress(data)
+    return data